@@ -1,4 +1,5 @@
 from PySide6 import QtGui, QtWidgets
+from mapclientplugins.fieldworkpcmeshfittingstep import landmarkfit
 from mapclientplugins.fieldworkpcmeshfittingstep.ui_configuredialog import Ui_Dialog
 
 INVALID_STYLE_SHEET = 'background-color: rgba(239, 0, 0, 50)'
@@ -10,7 +11,7 @@ class ConfigureDialog(QtWidgets.QDialog):
     Configure dialog to present the user with the options to configure this step.
     '''
 
-    def __init__(self, distModes, parent=None):
+    def __init__(self, distModes, optimisers, parent=None):
         '''
         Constructor
         '''
@@ -28,20 +29,63 @@ class ConfigureDialog(QtWidgets.QDialog):
         self.identifierOccursCount = None
 
         self._distModes = distModes
+        self._optimisers = optimisers
         self._setupDialog()
         self._makeConnections()
 
     def _setupDialog(self):
         for m in self._distModes:
             self._ui.comboBoxDistanceMode.addItem(m)
+        for o in self._optimisers:
+            self._ui.comboBoxOptimiser.addItem(o)
+        for f in landmarkfit.LANDMARK_FITS:
+            self._ui.comboBoxLandmarkFit.addItem(f)
 
         self._ui.lineEditXTol.setValidator(QtGui.QDoubleValidator())
         self._ui.spinBoxPCsToFit.setSingleStep(1)
         self._ui.spinBoxSurfDisc.setSingleStep(1)
+        # 0 chooses the discretisation of each element from the data density
+        self._ui.spinBoxSurfDisc.setMinimum(0)
+        self._ui.spinBoxSurfDisc.setSpecialValueText('auto')
         self._ui.doubleSpinBoxMWeight.setSingleStep(0.1)
         self._ui.spinBoxMaxfev.setMaximum(10000)
         self._ui.spinBoxMaxfev.setSingleStep(100)
         self._ui.spinBoxNCP.setSingleStep(1)
+        self._ui.spinBoxThreads.setMinimum(0)
+        self._ui.spinBoxThreads.setMaximum(256)
+        self._ui.spinBoxThreads.setSingleStep(1)
+        self._ui.spinBoxMultiBoneRounds.setMinimum(1)
+        self._ui.spinBoxMultiBoneRounds.setSingleStep(1)
+        for w in (self._ui.doubleSpinBoxMaxFitTime, self._ui.doubleSpinBoxMaxBatchTime):
+            w.setDecimals(1)
+            w.setMaximum(86400.0)
+            w.setSingleStep(10.0)
+        self._ui.lineEditObjectiveTol.setValidator(QtGui.QDoubleValidator())
+        self._ui.doubleSpinBoxRMSEPlateau.setDecimals(4)
+        self._ui.doubleSpinBoxRMSEPlateau.setSingleStep(0.001)
+        self._ui.spinBoxStagnationWindow.setMinimum(1)
+        self._ui.spinBoxStagnationWindow.setMaximum(100000)
+        self._ui.spinBoxStagnationWindow.setSingleStep(10)
+        self._ui.spinBoxViewerMaxPoints.setMinimum(1000)
+        self._ui.spinBoxViewerMaxPoints.setMaximum(100000000)
+        self._ui.spinBoxViewerMaxPoints.setSingleStep(10000)
+        # 0 keeps every frame
+        self._ui.spinBoxSequenceWindow.setMinimum(0)
+        self._ui.spinBoxSequenceWindow.setMaximum(100000)
+        self._ui.spinBoxJobMaxAttempts.setMinimum(1)
+        self._ui.spinBoxJobMaxAttempts.setMaximum(100)
+        # 0 disables checkpoints
+        self._ui.spinBoxCheckpointInterval.setMinimum(0)
+        self._ui.spinBoxCheckpointInterval.setMaximum(1000000)
+        self._ui.spinBoxCheckpointInterval.setSingleStep(50)
+        # 0 disables the rigid pre-alignment
+        self._ui.spinBoxPreAlignIterations.setMinimum(0)
+        self._ui.spinBoxPreAlignIterations.setMaximum(1000)
+        self._ui.spinBoxPreAlignIterations.setSingleStep(10)
+        # 0 fits all modes at once
+        self._ui.spinBoxModesPerStage.setMinimum(0)
+        self._ui.spinBoxModesPerStage.setMaximum(100)
+        self._ui.spinBoxModesPerStage.setSpecialValueText('all')
 
     def _makeConnections(self):
         self._ui.lineEdit0.textChanged.connect(self.validate)
@@ -98,6 +142,25 @@ class ConfigureDialog(QtWidgets.QDialog):
         config['N Closest Points'] = str(self._ui.spinBoxNCP.value())
         config['Landmarks'] = self._ui.lineEditLandmarks.text()
         config['Landmark Weights'] = self._ui.lineEditLandmarkWeights.text()
+        config['Optimiser'] = self._ui.comboBoxOptimiser.currentText()
+        config['Threads'] = str(self._ui.spinBoxThreads.value())
+        config['Multi-Bone Rounds'] = str(self._ui.spinBoxMultiBoneRounds.value())
+        config['Max Fit Time'] = str(self._ui.doubleSpinBoxMaxFitTime.value())
+        config['Max Batch Time'] = str(self._ui.doubleSpinBoxMaxBatchTime.value())
+        config['Objective Tolerance'] = self._ui.lineEditObjectiveTol.text()
+        config['RMSE Plateau'] = str(self._ui.doubleSpinBoxRMSEPlateau.value())
+        config['Mode Change Tolerance'] = self._ui.lineEditModeChangeTol.text()
+        config['Stagnation Window'] = str(self._ui.spinBoxStagnationWindow.value())
+        config['QA Snapshots'] = self._ui.lineEditQASnapshots.text()
+        config['Viewer Max Points'] = str(self._ui.spinBoxViewerMaxPoints.value())
+        config['Fit Export'] = self._ui.lineEditFitExport.text()
+        config['Sequence Window'] = str(self._ui.spinBoxSequenceWindow.value())
+        config['Job Queue'] = self._ui.lineEditJobQueue.text()
+        config['Job Max Attempts'] = str(self._ui.spinBoxJobMaxAttempts.value())
+        config['Checkpoint Interval'] = str(self._ui.spinBoxCheckpointInterval.value())
+        config['Pre-Alignment Iterations'] = str(self._ui.spinBoxPreAlignIterations.value())
+        config['Modes per Stage'] = str(self._ui.spinBoxModesPerStage.value())
+        config['Landmark Fit'] = self._ui.comboBoxLandmarkFit.currentText()
         config['GUI'] = self._ui.checkBoxGUI.isChecked()
         return config
 
@@ -119,6 +182,25 @@ class ConfigureDialog(QtWidgets.QDialog):
         self._ui.spinBoxNCP.setValue(int(config['N Closest Points']))
         self._ui.lineEditLandmarks.setText(config['Landmarks'])
         self._ui.lineEditLandmarkWeights.setText(config['Landmark Weights'])
+        self._ui.comboBoxOptimiser.setCurrentIndex(self._optimisers.index(config['Optimiser']))
+        self._ui.spinBoxThreads.setValue(int(config['Threads']))
+        self._ui.spinBoxMultiBoneRounds.setValue(int(config['Multi-Bone Rounds']))
+        self._ui.doubleSpinBoxMaxFitTime.setValue(float(config['Max Fit Time']))
+        self._ui.doubleSpinBoxMaxBatchTime.setValue(float(config['Max Batch Time']))
+        self._ui.lineEditObjectiveTol.setText(config['Objective Tolerance'])
+        self._ui.doubleSpinBoxRMSEPlateau.setValue(float(config['RMSE Plateau']))
+        self._ui.lineEditModeChangeTol.setText(config['Mode Change Tolerance'])
+        self._ui.spinBoxStagnationWindow.setValue(int(config['Stagnation Window']))
+        self._ui.lineEditQASnapshots.setText(config['QA Snapshots'])
+        self._ui.spinBoxViewerMaxPoints.setValue(int(config['Viewer Max Points']))
+        self._ui.lineEditFitExport.setText(config['Fit Export'])
+        self._ui.spinBoxSequenceWindow.setValue(int(config['Sequence Window']))
+        self._ui.lineEditJobQueue.setText(config['Job Queue'])
+        self._ui.spinBoxJobMaxAttempts.setValue(int(config['Job Max Attempts']))
+        self._ui.spinBoxCheckpointInterval.setValue(int(config['Checkpoint Interval']))
+        self._ui.spinBoxPreAlignIterations.setValue(int(config['Pre-Alignment Iterations']))
+        self._ui.spinBoxModesPerStage.setValue(int(config['Modes per Stage']))
+        self._ui.comboBoxLandmarkFit.setCurrentIndex(landmarkfit.LANDMARK_FITS.index(config['Landmark Fit']))
         self._ui.checkBoxGUI.setChecked(bool(config['GUI']))
 
 
@@ -0,0 +1,96 @@
+'''
+Choice of the surface discretisation of a mesh from the size of the data
+it is fitted to. Sampling the surface with many more points than there are
+data points adds objective evaluation cost without improving the fit, so
+the surface gets about as many sample points as there are data points,
+spread evenly over the elements and capped at a low density per element.
+'''
+import numpy as np
+
+from mapclientplugins.fieldworkpcmeshfittingstep import objectives
+
+# xi grid density at which element lengths are measured
+PROBE_DENSITY = 5
+# discretisation limits of one xi direction of an element
+MIN_DENSITY = 2
+MAX_DENSITY = 10
+# target number of surface sample points per data point
+SAMPLES_PER_POINT = 1.0
+
+
+def elementLengths(GF, density=PROBE_DENSITY):
+    """(n elements, n xi directions) array of the length of each element of
+    GF along each of its xi directions, measured along the lines of a
+    density xi grid. Elements are in the order of makeBasisMatrix.
+    """
+    f = GF.ensemble_field_function
+    if not f.is_flat():
+        f = f.flatten()[0]
+    points = objectives.makeSurfaceEvaluator(GF, (density, density))(GF.get_field_parameters().ravel())
+
+    lengths = []
+    row = 0
+    for elementNumber in np.sort(list(f.mesh.elements.keys())):
+        element = f.mesh.elements[elementNumber]
+        grid = element.generate_eval_grid([density] * element.dimensions).reshape((-1, element.dimensions))
+        X = points[row:row + len(grid)]
+        row += len(grid)
+
+        # integer lattice coordinates of the grid points
+        lo, hi = np.array(element.interior, dtype=float).T
+        lattice = np.round((grid - lo) / (hi - lo) * (density - 1)).astype(int)
+        index = {tuple(l): i for i, l in enumerate(lattice)}
+        directionLengths = []
+        for k in range(element.dimensions):
+            step = np.zeros(element.dimensions, dtype=int)
+            step[k] = 1
+            pairs = [(i, index[tuple(l + step)]) for i, l in enumerate(lattice) if tuple(l + step) in index]
+            i, j = np.array(pairs).T
+            meanStep = np.linalg.norm(X[j] - X[i], axis=1).mean()
+            directionLengths.append(meanStep * (density - 1))
+        lengths.append(directionLengths)
+    return np.array(lengths)
+
+
+def chooseDiscretisation(GF, data, samplesPerPoint=SAMPLES_PER_POINT, maxDensity=MAX_DENSITY):
+    """Discretisation of each element of GF that gives about samplesPerPoint
+    surface points per data point in total. Points are spread over the
+    elements in proportion to their size, and along each xi direction in
+    proportion to its length, so the sample spacing is even over the mesh.
+
+    inputs
+    ------
+    GF : geometric_field in the frame of data, e.g. after initialisation.
+    data : (n, 3) array of target points.
+    samplesPerPoint : target ratio of surface points to data points.
+    maxDensity : upper limit of the discretisation of an xi direction.
+
+    returns
+    -------
+    GD : tuple of one discretisation per element, e.g. ((4, 6), (5, 5), ...),
+        in the order of makeBasisMatrix.
+    """
+    nSamples = samplesPerPoint * len(data)
+    lengths = elementLengths(GF)
+    # spacing at which nSamples points cover the elements evenly
+    size = np.prod(lengths, axis=1).sum()
+    spacing = (size / nSamples) ** (1.0 / lengths.shape[1])
+    densities = np.clip(np.round(lengths / spacing).astype(int), MIN_DENSITY, maxDensity)
+    return tuple(tuple(int(d) for d in row) for row in densities)
+
+
+def isPerElement(GD):
+    """True if GD holds one discretisation per element.
+    """
+    return GD is not None and np.ndim(GD) == 2
+
+
+def describe(GD):
+    """Short description of a discretisation for logging.
+    """
+    if GD is None:
+        return 'auto'
+    if not isPerElement(GD):
+        return str(list(GD))
+    d = np.array(GD)
+    return '{} elements, {} to {} points per xi direction'.format(len(d), d.min(), d.max())
@@ -0,0 +1,131 @@
+'''
+Single-pass statistics of fitting errors for large clouds. Errors are
+read once, in cache-sized chunks, to accumulate their moments, maximum
+and a fixed-bin histogram of distances from which quantiles are
+estimated. Statistics of separate error arrays, e.g. the bones of a
+multi-bone fit, can be merged.
+'''
+import numpy as np
+
+# distance histogram bin edges: 40 log-spaced bins per decade from 1e-6 to
+# 1e6, plus one bin below and one above
+DISTANCE_EDGES = np.logspace(-6, 6, 12 * 40 + 1)
+DEFAULT_PERCENTILES = (50, 90, 95, 99)
+
+# number of errors processed at a time
+_chunkSize = 65536
+
+
+class ErrorStatistics(object):
+    """Streaming statistics of per-point squared distances.
+
+    The mean and standard deviation are of the squared distances, as are
+    the per-point errors of the fit, and are accumulated with Welford's
+    method. Quantiles and the maximum are of the distances. Quantiles are
+    interpolated within a histogram bin, so are within about 6% of the
+    exact value.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.maxError = 0.0
+        self._m2 = 0.0
+        self.counts = np.zeros(len(DISTANCE_EDGES) + 1, dtype=np.int64)
+
+    @classmethod
+    def fromErrors(cls, errors):
+        return cls().update(errors)
+
+    def update(self, errors):
+        """Add an array of squared distances. Returns self.
+        """
+        errors = np.asarray(errors, dtype=float).ravel()
+        for start in range(0, len(errors), _chunkSize):
+            e = errors[start:start + _chunkSize]
+            mean = e.mean()
+            self._merge(len(e), mean, np.square(e - mean).sum(), e.max())
+            bins = np.searchsorted(DISTANCE_EDGES, np.sqrt(np.maximum(e, 0.0)), side='right')
+            self.counts += np.bincount(bins, minlength=len(self.counts))
+        return self
+
+    def merge(self, other):
+        """Add the errors summarised by another ErrorStatistics. Returns
+        self.
+        """
+        if other.n > 0:
+            self._merge(other.n, other.mean, other._m2, other.maxError)
+            self.counts += other.counts
+        return self
+
+    def _merge(self, n, mean, m2, maxError):
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self._m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+        self.maxError = max(self.maxError, maxError)
+
+    @property
+    def sd(self):
+        if self.n == 0:
+            return 0.0
+        return np.sqrt(self._m2 / self.n)
+
+    @property
+    def rmse(self):
+        if self.n == 0:
+            return np.nan
+        return np.sqrt(self.mean)
+
+    @property
+    def maxDistance(self):
+        """Largest distance, the directed Hausdorff distance of the fit.
+        """
+        return np.sqrt(self.maxError)
+
+    def _binBounds(self, k):
+        lower = 0.0 if k == 0 else DISTANCE_EDGES[k - 1]
+        upper = self.maxDistance if k == len(DISTANCE_EDGES) else DISTANCE_EDGES[k]
+        return lower, min(upper, self.maxDistance)
+
+    def quantile(self, q):
+        """Approximate q quantile, 0 <= q <= 1, of the distances.
+        """
+        if self.n == 0:
+            return 0.0
+        target = q * self.n
+        cumulative = np.cumsum(self.counts)
+        k = min(int(np.searchsorted(cumulative, target, side='left')), len(self.counts) - 1)
+        lower, upper = self._binBounds(k)
+        before = cumulative[k] - self.counts[k]
+        frac = (target - before) / self.counts[k] if self.counts[k] else 0.0
+        return lower + min(max(frac, 0.0), 1.0) * (upper - lower)
+
+    def histogram(self):
+        """Bin edges and counts of the distance histogram, trimmed to the
+        bins from the first to the last non-empty one.
+        """
+        nonEmpty = np.flatnonzero(self.counts)
+        if len(nonEmpty) == 0:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        first, last = nonEmpty[0], nonEmpty[-1]
+        edges = [self._binBounds(k)[0] for k in range(first, last + 1)]
+        edges.append(self._binBounds(last)[1])
+        return np.array(edges), self.counts[first:last + 1].copy()
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        """Statistics as a dict for the fit report: the number of points,
+        the mean and SD of the squared distances, the RMS and maximum
+        distance, distance percentiles and the distance histogram.
+        """
+        edges, counts = self.histogram()
+        return {
+            'points': int(self.n),
+            'mean': float(self.mean),
+            'sd': float(self.sd),
+            'rmse': float(self.rmse),
+            'max distance': float(self.maxDistance),
+            'distance percentiles': {str(p): float(self.quantile(p / 100.0)) for p in percentiles},
+            'histogram': {'edges': edges.tolist(), 'counts': counts.tolist()},
+        }
@@ -0,0 +1,118 @@
+'''
+Compact, versioned binary files of fit results that can be memory-mapped
+for bulk loading.
+
+File layout, all little-endian:
+    magic       8 bytes, b'FWPCFIT\\0'
+    version     uint32
+    header size uint32
+    header      UTF-8 JSON of the config, the fit report and the dtype,
+                shape and offset of each array
+    arrays      raw C-ordered arrays, each starting on a 64 byte boundary
+                from the end of the header
+'''
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'FWPCFIT\0'
+VERSION = 1
+SUFFIX = '.fwfit'
+
+_prefix = struct.Struct('<8sII')
+_align = 64
+
+# name and stored dtype of the arrays of a fit result
+_arrays = (
+    ('x', '<f8'),
+    ('P', '<f8'),
+    ('errors', '<f4'),
+)
+
+
+def _padding(n):
+    return (-n) % _align
+
+
+def writeFitResult(filename, x, P, errors, config, report=None):
+    """Write a fit result.
+
+    inputs
+    ------
+    filename : output file path.
+    x : fitted parameters [tx, ty, tz, rx, ry, rz, (s), mode SDs...].
+    P : fitted nodal parameters, flattened or (3, n).
+    errors : per-point squared distances. Stored as float32.
+    config : step config used for the fit.
+    report : optional fit report, e.g. function evaluations and fit time.
+    """
+    arrays = {
+        'x': np.asarray(x),
+        'P': np.asarray(P).reshape((3, -1)),
+        'errors': np.asarray(errors),
+    }
+    entries = {}
+    offset = 0
+    for name, dtype in _arrays:
+        a = arrays[name] = np.ascontiguousarray(arrays[name], dtype=dtype)
+        entries[name] = {'dtype': dtype, 'shape': list(a.shape), 'offset': offset}
+        offset += a.nbytes + _padding(a.nbytes)
+
+    header = json.dumps({
+        'arrays': entries,
+        'config': config,
+        'report': report or {},
+    }, default=lambda o: o.item() if isinstance(o, np.generic) else str(o)).encode('utf-8')
+    header += b' ' * _padding(_prefix.size + len(header))
+
+    with open(filename, 'wb') as f:
+        f.write(_prefix.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for name, dtype in _arrays:
+            a = arrays[name]
+            f.write(a.tobytes())
+            f.write(b'\0' * _padding(a.nbytes))
+
+
+def readFitResult(filename, mmap=True):
+    """Read a fit result written by writeFitResult.
+
+    inputs
+    ------
+    filename : fit result file path.
+    mmap : if True, the arrays are read-only memory maps of the file, else
+        they are read into memory.
+
+    returns
+    -------
+    result : dict of x, P (3, n), errors (float32), config, report and
+        version.
+    """
+    with open(filename, 'rb') as f:
+        magic, version, headerSize = _prefix.unpack(f.read(_prefix.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a fit result file'.format(filename))
+        if version > VERSION:
+            raise ValueError('Fit result file version {} is newer than the supported version {}'.format(
+                version, VERSION))
+        header = json.loads(f.read(headerSize).decode('utf-8'))
+
+        dataStart = _prefix.size + headerSize
+        result = {
+            'version': version,
+            'config': header['config'],
+            'report': header['report'],
+        }
+        for name, entry in header['arrays'].items():
+            shape = tuple(entry['shape'])
+            if int(np.prod(shape)) == 0:
+                result[name] = np.empty(shape, dtype=entry['dtype'])
+            elif mmap:
+                result[name] = np.memmap(filename, dtype=entry['dtype'], mode='r',
+                                         offset=dataStart + entry['offset'], shape=shape)
+            else:
+                f.seek(dataStart + entry['offset'])
+                count = int(np.prod(shape))
+                result[name] = np.fromfile(f, dtype=entry['dtype'], count=count).reshape(shape)
+    return result
@@ -0,0 +1,329 @@
+'''
+Typed, validated fitting parameters compiled from the step configuration.
+'''
+import dataclasses
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from mapclientplugins.fieldworkpcmeshfittingstep import discretisation
+from mapclientplugins.fieldworkpcmeshfittingstep import landmarkfit
+from mapclientplugins.fieldworkpcmeshfittingstep import objectives
+from mapclientplugins.fieldworkpcmeshfittingstep import optimisers
+
+# config items that change the result of a fit of one bone. Threads only
+# changes how fast it runs, and Multi-Bone Rounds applies to multi-bone
+# fits only.
+FIT_CONFIG_KEYS = (
+    'Distance Mode', 'PCs to Fit', 'Surface Discretisation', 'Mahalanobis Weight',
+    'Max Func Evaluations', 'xtol', 'Fit Scale', 'N Closest Points', 'Landmarks',
+    'Landmark Weights', 'Optimiser', 'Max Fit Time', 'Max Batch Time', 'Objective Tolerance',
+    'RMSE Plateau', 'Mode Change Tolerance', 'Stagnation Window', 'Pre-Alignment Iterations',
+    'Modes per Stage', 'Landmark Fit',
+)
+
+
+def _toBool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value)
+    if value == 'True':
+        return True
+    elif value in ('False', ''):
+        return False
+    raise ValueError('undefined str mapping to boolean: {}'.format(value))
+
+
+def _readOnly(a):
+    a = np.array(a, dtype=float)
+    a.flags.writeable = False
+    return a
+
+
+def _timeLimit(value):
+    """Time limit in seconds, or None for no limit.
+    """
+    value = float(value)
+    if value < 0.0:
+        raise ValueError('Time limits must not be negative')
+    if value == 0.0:
+        return None
+    return value
+
+
+def _parseTolerances(value):
+    """Parse a comma separated list of non-negative tolerances.
+    """
+    value = value.strip()
+    if len(value) == 0:
+        return ()
+    try:
+        tols = tuple(float(v) for v in value.split(','))
+    except ValueError:
+        raise ValueError('Malformed tolerances. Tolerances must be comma separated numbers')
+    if any(t < 0.0 for t in tols):
+        raise ValueError('Tolerances must not be negative')
+    return tols
+
+
+def parseLandmarkConfig(landmarksConfig, weightsConfig):
+    """Parse the Landmarks and Landmark Weights config strings.
+
+    returns
+    -------
+    modelNames : tuple of model landmark names.
+    inputNames : tuple of the matching input landmark names.
+    weights : array of landmark weights.
+    """
+    if len(landmarksConfig) == 0:
+        return (), (), _readOnly([])
+
+    terms = landmarksConfig.strip().split(',')
+    termsWeights = weightsConfig.strip().split(',')
+    if len(terms) == 0:
+        raise ValueError('Malformed landmarks config. Terms must be comma separated')
+
+    if len(terms) != len(termsWeights):
+        raise ValueError('Malformed landmarks config. Mismatch in number of landmarks and weights')
+
+    modelNames = []
+    inputNames = []
+    weights = []
+    for term, termWeight in zip(terms, termsWeights):
+        kv = term.split(':')
+        if len(kv) != 2:
+            raise ValueError('Malformed landmarks config. Key and values must be separated by :')
+        try:
+            w = float(termWeight)
+        except ValueError:
+            raise ValueError('Malformed landmarks config. Bad landmark weight')
+
+        modelNames.append(kv[0].strip())
+        inputNames.append(kv[1].strip())
+        weights.append(w)
+
+    return tuple(modelNames), tuple(inputNames), _readOnly(weights)
+
+
+@dataclass(frozen=True, eq=False)
+class FitPlan(object):
+    """Fitting parameters parsed and validated once from the string config.
+    A plan is immutable and can be reused for any number of fits. Landmark
+    targets are per-subject and are bound with withLandmarks. A GD of None
+    is an automatic surface discretisation, chosen per mesh and cloud with
+    withDiscretisation.
+    """
+    distMode: str
+    nPCs: int
+    GD: Optional[tuple]
+    mWeight: float
+    maxfev: int
+    xtol: float
+    fitScale: bool
+    nClosestPoints: int
+    optimiser: str
+    nThreads: int
+    multiBoneRounds: int
+    maxFitTime: Optional[float] = None
+    maxBatchTime: Optional[float] = None
+    objectiveTol: float = 0.0
+    rmsePlateau: float = 0.0
+    modeChangeTols: Tuple[float, ...] = ()
+    stagnationWindow: int = 50
+    preAlignIterations: int = 0
+    modesPerStage: int = 0
+    landmarkFit: str = landmarkfit.NONE
+    landmarkModelNames: Tuple[str, ...] = ()
+    landmarkInputNames: Tuple[str, ...] = ()
+    landmarkWeights: np.ndarray = dataclasses.field(default_factory=lambda: _readOnly([]))
+    landmarkTargets: Optional[np.ndarray] = None
+
+    @classmethod
+    def fromConfig(cls, config, landmarks=None):
+        """Compile a plan from a step config dict. If landmarks is given,
+        the landmark targets are also resolved.
+        """
+        if config['Distance Mode'] not in objectives.DIST_MODES:
+            raise ValueError('Unknown distance mode ' + str(config['Distance Mode']))
+        if config['Optimiser'] not in optimisers.OPTIMISERS:
+            raise ValueError('Unknown optimiser ' + str(config['Optimiser']))
+
+        nPCs = int(config['PCs to Fit'])
+        if nPCs < 1:
+            raise ValueError('PCs to Fit must be at least 1')
+        surfDisc = int(config['Surface Discretisation'])
+        if surfDisc < 0:
+            raise ValueError('Surface Discretisation must not be negative')
+        nClosestPoints = int(config['N Closest Points'])
+        if nClosestPoints < 1:
+            raise ValueError('N Closest Points must be at least 1')
+        maxfev = int(config['Max Func Evaluations'])
+        if maxfev < 1:
+            raise ValueError('Max Func Evaluations must be at least 1')
+        multiBoneRounds = int(config['Multi-Bone Rounds'])
+        if multiBoneRounds < 1:
+            raise ValueError('Multi-Bone Rounds must be at least 1')
+        objectiveTol = float(config['Objective Tolerance'])
+        rmsePlateau = float(config['RMSE Plateau'])
+        if objectiveTol < 0.0 or rmsePlateau < 0.0:
+            raise ValueError('Tolerances must not be negative')
+        stagnationWindow = int(config['Stagnation Window'])
+        if stagnationWindow < 1:
+            raise ValueError('Stagnation Window must be at least 1')
+        preAlignIterations = int(config['Pre-Alignment Iterations'])
+        if preAlignIterations < 0:
+            raise ValueError('Pre-Alignment Iterations must not be negative')
+        modesPerStage = int(config['Modes per Stage'])
+        if modesPerStage < 0:
+            raise ValueError('Modes per Stage must not be negative')
+
+        modelNames, inputNames, weights = parseLandmarkConfig(
+            config['Landmarks'], config['Landmark Weights']
+        )
+        if config['Landmark Fit'] not in landmarkfit.LANDMARK_FITS:
+            raise ValueError('Unknown landmark fit ' + str(config['Landmark Fit']))
+        if config['Landmark Fit'] != landmarkfit.NONE and not modelNames:
+            raise ValueError('Landmark Fit {} needs Landmarks'.format(config['Landmark Fit']))
+        plan = cls(
+            distMode=config['Distance Mode'],
+            nPCs=nPCs,
+            GD=(surfDisc, surfDisc) if surfDisc > 0 else None,
+            mWeight=float(config['Mahalanobis Weight']),
+            maxfev=maxfev,
+            xtol=float(config['xtol']),
+            fitScale=_toBool(config['Fit Scale']),
+            nClosestPoints=nClosestPoints,
+            optimiser=config['Optimiser'],
+            nThreads=objectives.resolveThreads(config['Threads']),
+            multiBoneRounds=multiBoneRounds,
+            maxFitTime=_timeLimit(config['Max Fit Time']),
+            maxBatchTime=_timeLimit(config['Max Batch Time']),
+            objectiveTol=objectiveTol,
+            rmsePlateau=rmsePlateau,
+            modeChangeTols=_parseTolerances(config['Mode Change Tolerance']),
+            stagnationWindow=stagnationWindow,
+            preAlignIterations=preAlignIterations,
+            modesPerStage=modesPerStage,
+            landmarkFit=config['Landmark Fit'],
+            landmarkModelNames=modelNames,
+            landmarkInputNames=inputNames,
+            landmarkWeights=weights,
+        )
+        if landmarks is not None:
+            plan = plan.withLandmarks(landmarks)
+        return plan
+
+    def withLandmarks(self, landmarks):
+        """Return a copy of this plan with the landmark targets resolved from
+        a dict of input landmark coordinates.
+        """
+        if not self.landmarkInputNames:
+            return self
+        if landmarks is None:
+            raise ValueError('Landmarks configured but no input landmarks given')
+        try:
+            targets = [landmarks[n] for n in self.landmarkInputNames]
+        except KeyError as e:
+            raise ValueError('Input landmark {} not found'.format(e))
+        return dataclasses.replace(self, landmarkTargets=_readOnly(targets))
+
+    def withDiscretisation(self, GF, data):
+        """Return a copy of this plan with a discretisation of each element
+        of GF chosen from the density of data if the surface discretisation
+        is automatic, else this plan.
+        """
+        if self.GD is not None:
+            return self
+        return dataclasses.replace(self, GD=discretisation.chooseDiscretisation(GF, data))
+
+    def withoutLandmarkFit(self):
+        """Return a copy of this plan that does not fit the landmarks on
+        their own, e.g. for the frames of a sequence after the first.
+        """
+        if self.landmarkFit == landmarkfit.NONE:
+            return self
+        return dataclasses.replace(self, landmarkFit=landmarkfit.NONE)
+
+    def withEvaluationsUsed(self, nfev):
+        """Return a copy of this plan for the rest of a fit that has already
+        used nfev objective evaluations, e.g. one resumed from a checkpoint.
+        """
+        return dataclasses.replace(self, maxfev=max(self.maxfev - int(nfev), 1))
+
+    def batchDeadline(self):
+        """Absolute deadline for a batch of fits starting now, or None.
+        """
+        if self.maxBatchTime is None:
+            return None
+        return time.time() + self.maxBatchTime
+
+    def fitDeadline(self, batchDeadline=None):
+        """Absolute deadline for a fit starting now, bounded by the
+        deadline of its batch if given, or None.
+        """
+        deadline = batchDeadline
+        if self.maxFitTime is not None:
+            fitDeadline = time.time() + self.maxFitTime
+            if deadline is None or fitDeadline < deadline:
+                deadline = fitDeadline
+        return deadline
+
+    @property
+    def stopping(self):
+        """StoppingCriteria for the optimiser, or None if all stagnation
+        tests are disabled.
+        """
+        stopping = optimisers.StoppingCriteria(self.objectiveTol, self.rmsePlateau,
+                                               self.modeChangeTols, self.stagnationWindow)
+        if not stopping.enabled:
+            return None
+        return stopping
+
+    @property
+    def fitModes(self):
+        return np.arange(self.nPCs)
+
+    @property
+    def progressive(self):
+        """True if modes are released over more than one stage.
+        """
+        return 0 < self.modesPerStage < self.nPCs
+
+    @property
+    def nParams(self):
+        """Number of rigid(+scale) and mode parameters fitted.
+        """
+        if self.fitScale:
+            return 7 + self.nPCs
+        return 6 + self.nPCs
+
+    @property
+    def hasLandmarks(self):
+        return len(self.landmarkModelNames) > 0
+
+    def describe(self):
+        """Lines describing the plan for logging.
+        """
+        return [
+            'Distance Mode: ' + self.distMode,
+            'PCs to Fit: ' + str(self.fitModes),
+            'GF: ' + discretisation.describe(self.GD),
+            'MWeight: ' + str(self.mWeight),
+            'xtol: ' + str(self.xtol),
+            'fit scale: ' + str(self.fitScale),
+            'n closest points: ' + str(self.nClosestPoints),
+            'maxfev: ' + str(self.maxfev),
+            'optimiser: ' + self.optimiser,
+            'threads: ' + str(self.nThreads),
+            'max fit time: ' + str(self.maxFitTime),
+            'objective tolerance: ' + str(self.objectiveTol),
+            'RMSE plateau: ' + str(self.rmsePlateau),
+            'mode change tolerance: ' + str(list(self.modeChangeTols)),
+            'pre-alignment iterations: ' + str(self.preAlignIterations),
+            'modes per stage: ' + str(self.modesPerStage or 'all'),
+            'landmarks: ' + str(list(zip(self.landmarkModelNames, self.landmarkInputNames))),
+            'landmark weights: ' + str(list(self.landmarkWeights)),
+            'landmark fit: ' + self.landmarkFit,
+        ]
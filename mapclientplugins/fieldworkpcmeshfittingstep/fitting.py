@@ -0,0 +1,349 @@
+'''
+Fitting of a Fieldwork mesh to a point cloud using a shape model, driven by
+a FitPlan. Shared by the step GUI, headless execution and batch fitting.
+'''
+import numpy as np
+from scipy.spatial import cKDTree
+from gias3.learning import PCA_fitting
+from gias3.musculoskeletal import fw_model_landmarks
+
+from mapclientplugins.fieldworkpcmeshfittingstep import errorstats
+from mapclientplugins.fieldworkpcmeshfittingstep import landmarkfit
+from mapclientplugins.fieldworkpcmeshfittingstep import memprofile
+from mapclientplugins.fieldworkpcmeshfittingstep import objectives
+from mapclientplugins.fieldworkpcmeshfittingstep import optimisers
+from mapclientplugins.fieldworkpcmeshfittingstep import prealign
+
+# landmark evaluators built in this process, keyed by landmark name and
+# mesh topology signature
+_landmarkEvaluators = {}
+
+
+def matchParamLength(x0, nParams):
+    """Pad x0 with zeros or truncate it to nParams parameters.
+    """
+    x0 = np.asarray(x0, dtype=float)
+    if len(x0) < nParams:
+        x0 = np.hstack([x0, np.zeros(nParams - len(x0))])
+    elif len(x0) > nParams:
+        x0 = x0[:nParams]
+    return x0
+
+
+def initFromModel(plan, GF, pc):
+    """Rigid(+scale) and mode fit of the shape model to the nodes of GF.
+
+    returns
+    -------
+    x0 : initial fit parameters.
+    P0 : (3, n) nodal coordinates of the shape model at x0.
+    """
+    xOpt, nodesOpt = PCA_fitting.fitSSMTo3DPoints(
+        GF.get_all_point_positions(), pc, plan.fitModes, m_weight=plan.mWeight,
+        do_scale=plan.fitScale, verbose=False,
+    )[:2]
+    return xOpt, nodesOpt.T
+
+
+def initFromTransform(plan, GF, pc, T0):
+    """Set the field parameters of GF to the shape model reconstructed from
+    the mode scores of the transform parameters T0, then apply the rigid
+    (+scale) part of T0.
+    """
+    if plan.fitScale:
+        pcSDs = T0[7:]
+    else:
+        pcSDs = T0[6:]
+
+    if len(pcSDs) > 0:
+        pcModes = np.arange(len(pcSDs))
+        reconParams = pc.reconstruct(
+            pc.getWeightsBySD(pcModes, pcSDs),
+            pcModes
+        ).reshape((3, -1, 1))
+        GF.field_parameters = reconParams
+    else:
+        reconParams = pc.reconstruct(
+            pc.getWeightsBySD([0, ], [0.0, ]),
+            [0, ]
+        ).reshape((3, -1, 1))
+        GF.set_field_parameters(reconParams)
+
+    # apply rigid or rigid+scale transform
+    if plan.fitScale:
+        GF.transformRigidScaleRotateAboutCoM(T0[:7])
+    else:
+        GF.transformRigidRotateAboutCoM(T0[:6])
+
+
+def getLandmarkEvaluator(name, GF, signature=None):
+    """Return the evaluator of the named landmark for meshes with the
+    topology of GF. Evaluators depend only on the topology so each is built
+    once per process and reused by repeat fits and batch fits.
+    """
+    if signature is None:
+        signature = objectives.topologySignature(GF)
+    key = (name, signature)
+    evaluator = _landmarkEvaluators.get(key)
+    if evaluator is None:
+        evaluator = fw_model_landmarks.makeLandmarkEvaluator(name, GF)
+        _landmarkEvaluators[key] = evaluator
+    return evaluator
+
+
+def makeLandmarkObj(targ, evaluator):
+    def obj(P):
+        return ((targ - evaluator(P)) ** 2.0).sum()
+
+    return obj
+
+
+def _landmarkEvaluatorsFor(plan, GF):
+    if not plan.hasLandmarks:
+        raise ValueError('Landmark fitting needs configured Landmarks')
+    if plan.landmarkTargets is None:
+        raise ValueError('Landmark targets not bound to the fit plan')
+    signature = objectives.topologySignature(GF)
+    return [getLandmarkEvaluator(name, GF, signature) for name in plan.landmarkModelNames]
+
+
+def fitLandmarks(plan, GF, pc, x0, model=None, deadline=None):
+    """Fit the shape model pc, with the topology of GF, to the landmark
+    targets of plan alone, see landmarkfit.fitLandmarks. The fit is bounded
+    by plan.maxfev and by deadline, an absolute time.time(). A shape model
+    can be given to share it with a later fit.
+
+    returns
+    -------
+    xOpt, POpt : as for fit.
+    fitErrors : unweighted squared distance of each landmark.
+    rmse, info : as for fit.
+    """
+    if model is None:
+        model = optimisers.RigidModesModel(pc, plan.fitModes, plan.fitScale)
+    x0 = matchParamLength(x0, plan.nParams)
+    xOpt, POpt, fitErrors, info = landmarkfit.fitLandmarks(
+        model, _landmarkEvaluatorsFor(plan, GF), plan.landmarkTargets, x0,
+        weights=plan.landmarkWeights, mWeight=plan.mWeight, maxfev=plan.maxfev, deadline=deadline,
+    )
+    errorStatistics = errorstats.ErrorStatistics.fromErrors(fitErrors)
+    info['errorStatistics'] = errorStatistics.summary()
+    return xOpt, POpt, fitErrors, errorStatistics.rmse, info
+
+
+def makeObj(plan, GF, data, dataWeights=None):
+    """
+    return an obj with weighting, and one without for rmse calculation
+    """
+    dataObj, dataObjNoWeights = _makeDataObjs(plan.withDiscretisation(GF, data), GF, data, dataWeights)
+    return _addLandmarkObjs(plan, GF, dataObj, dataObjNoWeights)
+
+
+def _makeDataObjs(plan, GF, data, dataWeights=None, evaluator=None, dataTree=None):
+    # both objectives share the surface evaluator and, for EPDP, the index
+    # of the data
+    if evaluator is None:
+        evaluator = objectives.makeSurfaceEvaluator(GF, plan.GD, plan.nThreads)
+    if dataTree is None and plan.distMode == 'EPDP':
+        dataTree = cKDTree(data)
+    dataObj = objectives.makeDataObj(plan.distMode, GF, data, plan.GD, dataWeights,
+                                     nClosestPoints=plan.nClosestPoints, nThreads=plan.nThreads,
+                                     evaluator=evaluator, dataTree=dataTree)
+
+    dataObjNoWeights = objectives.makeDataObj(plan.distMode, GF, data, plan.GD,
+                                              nClosestPoints=plan.nClosestPoints, nThreads=plan.nThreads,
+                                              evaluator=evaluator, dataTree=dataTree)
+    return dataObj, dataObjNoWeights
+
+
+def _addLandmarkObjs(plan, GF, dataObj, dataObjNoWeights):
+    # handle landmarks
+    if not plan.hasLandmarks:
+        return dataObj, dataObjNoWeights
+
+    if plan.landmarkTargets is None:
+        raise ValueError('Landmark targets not bound to the fit plan')
+
+    signature = objectives.topologySignature(GF)
+    ldObjs = []
+    for ldName, ldTarg in zip(plan.landmarkModelNames, plan.landmarkTargets):
+        ldEvaluator = getLandmarkEvaluator(ldName, GF, signature)
+        ldObjs.append(makeLandmarkObj(ldTarg, ldEvaluator))
+    ldWeights = plan.landmarkWeights
+
+    def mainObj(P):
+        gE = dataObj(P)
+        P3 = P.reshape((3, -1))
+        ldE = np.array([f(P3) for f in ldObjs]) * ldWeights
+        return np.hstack([gE, ldE])
+
+    def mainObjNoWeights(P):
+        gE = dataObjNoWeights(P)
+        P3 = P.reshape((3, -1))
+        ldE = np.array([f(P3) for f in ldObjs])
+        return np.hstack([gE, ldE])
+
+    return mainObj, mainObjNoWeights
+
+
+def _samePC(pc, other):
+    if pc is other:
+        return True
+    return (np.array_equal(pc.mean, other.mean) and np.array_equal(pc.weights, other.weights)
+            and np.array_equal(pc.modes, other.modes))
+
+
+class FitContext(object):
+    """The objectives and shape model of one fitting problem. A context can
+    be kept between fits: refits with new data weights or optimiser
+    settings reuse its surface evaluator, data index and landmark
+    evaluators, and resume from the last solution.
+
+    A surface evaluator and shape model can be given to share them between
+    contexts of the same mesh and plan, e.g. the frames of a sequence.
+    An automatic surface discretisation is chosen once, when the context is
+    created, and kept in GD.
+    """
+
+    def __init__(self, plan, GF, pc, data, dataWeights=None, evaluator=None, model=None):
+        self.plan = plan
+        self.pc = pc
+        self.data = data
+        self.signature = objectives.topologySignature(GF)
+        with memprofile.stage('objective construction'):
+            resolvedPlan = plan.withDiscretisation(GF, data)
+            self.GD = resolvedPlan.GD
+            self._dataObj, dataObjNoWeights = _makeDataObjs(resolvedPlan, GF, data, dataWeights, evaluator)
+            self.obj, self.objNoWeights = _addLandmarkObjs(plan, GF, self._dataObj, dataObjNoWeights)
+            if model is None:
+                model = optimisers.RigidModesModel(pc, plan.fitModes, plan.fitScale)
+        self.model = model
+        self.GF = GF
+        self.x0 = None
+        self.xOpt = None
+        self.errorStatistics = None
+
+    def matches(self, plan, GF, pc, data):
+        """True if plan, GF, pc and data pose the same fitting problem as
+        this context, up to the data weights and the optimiser settings.
+        """
+        p = self.plan
+        return (p.distMode == plan.distMode and p.GD == plan.GD
+                and p.nClosestPoints == plan.nClosestPoints and p.nThreads == plan.nThreads
+                and p.nPCs == plan.nPCs and p.fitScale == plan.fitScale
+                and p.landmarkModelNames == plan.landmarkModelNames
+                and np.array_equal(p.landmarkWeights, plan.landmarkWeights)
+                and (p.landmarkTargets is None) == (plan.landmarkTargets is None)
+                and np.array_equal(p.landmarkTargets, plan.landmarkTargets)
+                and self.signature == objectives.topologySignature(GF)
+                and _samePC(self.pc, pc)
+                and (self.data is data or np.array_equal(self.data, data)))
+
+    def update(self, plan, dataWeights=None):
+        """Use the optimiser settings of plan and new data weights for the
+        next fit. plan must match this context.
+        """
+        self.plan = plan
+        if dataWeights is not None:
+            dataWeights = np.asarray(dataWeights, dtype=float)
+        self._dataObj.dataWeights = dataWeights
+
+    def resetSolution(self):
+        """Start the next fit from its given x0.
+        """
+        self.x0 = None
+        self.xOpt = None
+
+    def fit(self, x0, batchDeadline=None, checkpoint=None, preAlign=True):
+        """Fit from x0. If x0 is the start of the last fit, the fit resumes
+        from the last solution instead. Otherwise, if preAlign is True, the
+        fit starts from the landmark fit and then the rigid ICP
+        pre-alignment of x0 if the plan has them. The context always fits
+        the data, so landmarkfit.ONLY is treated as landmarkfit.INITIALISE.
+        checkpoint is an optional (interval, callback) pair passed to
+        optimisers.minimise. See fit for the other inputs and the outputs.
+        """
+        plan = self.plan
+        deadline = plan.fitDeadline(batchDeadline)
+        x0 = matchParamLength(x0, plan.nParams)
+        preInfo = {}
+        xStart = x0
+        if self.xOpt is not None and np.array_equal(x0, self.x0):
+            print('resuming from the last solution')
+            xStart = self.xOpt
+        elif preAlign:
+            with memprofile.stage('pre-alignment'):
+                if plan.landmarkFit != landmarkfit.NONE:
+                    xStart, _, _, _, landmarkInfo = fitLandmarks(
+                        plan, self.GF, self.pc, xStart, self.model, deadline)
+                    preInfo['landmarkInitialisation'] = landmarkInfo
+                if plan.preAlignIterations > 0:
+                    xStart, preInfo['preAlignment'] = prealign.rigidICP(
+                        self.model, self._dataObj.evaluator, self.data, xStart, plan.preAlignIterations)
+
+        with memprofile.stage('optimisation'):
+            if plan.progressive:
+                xOpt, POpt, info = optimisers.minimiseProgressive(
+                    plan.optimiser, self.obj, self.model, xStart, plan.modesPerStage,
+                    mWeight=plan.mWeight, xtol=plan.xtol, maxfev=plan.maxfev, deadline=deadline,
+                    stopping=plan.stopping, checkpoint=checkpoint,
+                )
+            else:
+                xOpt, POpt, info = optimisers.minimise(plan.optimiser, self.obj, self.model, xStart,
+                                                       mWeight=plan.mWeight, xtol=plan.xtol,
+                                                       maxfev=plan.maxfev, deadline=deadline,
+                                                       stopping=plan.stopping,
+                                                       checkpoint=checkpoint,
+                                                       )
+        print('{}: {} function evaluations in {:.2f} s ({})'.format(
+            plan.optimiser, info['nfev'], info['time'], info['message']))
+        if info['budgetExhausted']:
+            print('WARNING: fit stopped by the time limit, returning the best parameters found')
+
+        info['surfaceDiscretisation'] = self.GD
+        info.update(preInfo)
+        self.x0 = x0
+        self.xOpt = xOpt
+        with memprofile.stage('error evaluation'):
+            fitErrors = self.objNoWeights(POpt.copy())
+            self.errorStatistics = errorstats.ErrorStatistics.fromErrors(fitErrors)
+        info['errorStatistics'] = self.errorStatistics.summary()
+        rmse = self.errorStatistics.rmse
+        return xOpt, POpt, fitErrors, rmse, info
+
+
+def fit(plan, GF, pc, data, x0, dataWeights=None, batchDeadline=None):
+    """Fit the shape model pc, with the topology of GF, to data.
+
+    inputs
+    ------
+    plan : FitPlan with landmark targets bound if landmarks are used.
+    GF : geometric_field with the topology of the shape model.
+    pc : PrincipalComponents shape model.
+    data : (n, 3) array of target points.
+    x0 : initial fit parameters, padded or truncated to plan.nParams.
+    dataWeights : optional (n,) array of data point weights.
+    batchDeadline : optional absolute deadline of the batch this fit is
+        part of. The fit stops at the earlier of this and plan.maxFitTime.
+
+    returns
+    -------
+    xOpt : fitted parameters [tx, ty, tz, rx, ry, rz, (s), mode SDs...].
+    POpt : fitted flattened nodal parameters.
+    fitErrors : unweighted squared distances at POpt.
+    rmse : root-mean-squared distance at POpt.
+    info : dict of optimiser information, see optimisers.minimise, the
+        surface discretisation used ('surfaceDiscretisation'), a summary of
+        the errors ('errorStatistics', see
+        errorstats.ErrorStatistics.summary) and, if the fit started from
+        the landmark fit or the pose was pre-aligned, the information of
+        those stages ('landmarkInitialisation', see fitLandmarks, and
+        'preAlignment', see prealign.rigidICP).
+
+    If plan.landmarkFit is landmarkfit.ONLY the model is fitted to the
+    landmarks alone with fitLandmarks, data is not used and fitErrors are
+    the squared landmark distances.
+    """
+    if plan.landmarkFit == landmarkfit.ONLY:
+        return fitLandmarks(plan, GF, pc, x0, deadline=plan.fitDeadline(batchDeadline))
+    return FitContext(plan, GF, pc, data, dataWeights).fit(x0, batchDeadline)
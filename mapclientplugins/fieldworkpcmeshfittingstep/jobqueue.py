@@ -0,0 +1,175 @@
+'''
+File-backed queue of headless fit jobs that survives the process. Each job
+has a JSON state file, an optional optimiser checkpoint and, once done, a
+fit result file in the queue directory. All files are replaced atomically
+so an interrupted batch leaves no partial outputs.
+'''
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def digest(*items):
+    """Hex digest of arrays and JSON-serialisable items, used to derive a
+    job id from the inputs of a fit.
+    """
+    h = hashlib.sha1()
+    for item in items:
+        if item is None:
+            h.update(b'None')
+        elif isinstance(item, np.ndarray):
+            item = np.ascontiguousarray(item)
+            h.update(str((item.dtype.str, item.shape)).encode())
+            h.update(item.tobytes())
+        else:
+            h.update(json.dumps(item, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def atomicWrite(filename, writeFunc):
+    """Call writeFunc with a temporary filename in the same directory, then
+    move the file to filename in one step.
+    """
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        writeFunc(tmp)
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _writeJSON(filename, obj):
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(obj, f, indent=4, default=str)
+
+    atomicWrite(filename, write)
+
+
+def _readJSON(filename):
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class JobQueue(object):
+    """Job states and outputs in a directory.
+
+    A job is pending until it is first run. A job found running when it is
+    next run was interrupted, and counts as a failed attempt. Done jobs are
+    skipped, and failed jobs are retried until maxAttempts attempts have
+    been made.
+
+    inputs
+    ------
+    directory : queue directory, created if needed.
+    maxAttempts : maximum number of times a job is run.
+    """
+
+    def __init__(self, directory, maxAttempts=3):
+        self.directory = directory
+        self.maxAttempts = int(maxAttempts)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, jobId, suffix):
+        return os.path.join(self.directory, jobId + suffix)
+
+    def resultFile(self, jobId, suffix='.fwfit'):
+        return self._path(jobId, suffix)
+
+    def state(self, jobId):
+        """The state record of a job: a dict of state, attempts, error,
+        updated and any fields given to markDone.
+        """
+        record = _readJSON(self._path(jobId, '.job.json'))
+        if record is None:
+            record = {'state': PENDING, 'attempts': 0, 'error': None, 'updated': None}
+        return record
+
+    def _setState(self, jobId, record, state, **fields):
+        record.update(fields)
+        record['state'] = state
+        record['updated'] = time.time()
+        _writeJSON(self._path(jobId, '.job.json'), record)
+        return record
+
+    def isDone(self, jobId):
+        return self.state(jobId)['state'] == DONE
+
+    def canRun(self, jobId):
+        """True if the job is not done and has attempts left.
+        """
+        record = self.state(jobId)
+        return record['state'] != DONE and record['attempts'] < self.maxAttempts
+
+    def markRunning(self, jobId):
+        record = self.state(jobId)
+        return self._setState(jobId, record, RUNNING, attempts=record['attempts'] + 1, error=None)
+
+    def markDone(self, jobId, **fields):
+        """Mark a job done, storing fields in its state record, and remove its
+        checkpoint.
+        """
+        record = self._setState(jobId, self.state(jobId), DONE, **fields)
+        self.clearCheckpoint(jobId)
+        return record
+
+    def markFailed(self, jobId, error):
+        return self._setState(jobId, self.state(jobId), FAILED, error=str(error))
+
+    def writeResult(self, jobId, writeFunc, suffix='.fwfit'):
+        """Write the output file of a job atomically with writeFunc(filename).
+        """
+        atomicWrite(self.resultFile(jobId, suffix), writeFunc)
+
+    def saveCheckpoint(self, jobId, x, nfev):
+        """Save the best parameters of a running fit and the number of
+        objective evaluations spent so far.
+        """
+        _writeJSON(self._path(jobId, '.checkpoint.json'),
+                   {'x': [float(v) for v in x], 'nfev': int(nfev)})
+
+    def loadCheckpoint(self, jobId):
+        """Return (x, nfev) of the last checkpoint of a job, or None.
+        """
+        checkpoint = _readJSON(self._path(jobId, '.checkpoint.json'))
+        if checkpoint is None:
+            return None
+        return np.array(checkpoint['x'], dtype=float), checkpoint['nfev']
+
+    def clearCheckpoint(self, jobId):
+        filename = self._path(jobId, '.checkpoint.json')
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def run(self, jobId, func):
+        """Run func() as the job unless it is done or out of attempts. The
+        job is marked done with the dict returned by func, or failed if func
+        raises, in which case the exception is raised again.
+
+        returns
+        -------
+        ran : True if func was run, False if the job was skipped.
+        """
+        if not self.canRun(jobId):
+            return False
+        self.markRunning(jobId)
+        try:
+            fields = func()
+        except Exception as e:
+            self.markFailed(jobId, e)
+            raise
+        self.markDone(jobId, **(fields or {}))
+        return True
@@ -0,0 +1,95 @@
+'''
+Fitting of the shape model to landmarks alone. The pose is first solved in
+closed form from the landmarks of the initial shape, then the pose, scale
+and mode scores are refined together by least squares. There are only a
+few residuals per landmark, so a fit takes milliseconds and can stand on
+its own or start a fit to the point cloud.
+'''
+import time
+
+import numpy as np
+
+from mapclientplugins.fieldworkpcmeshfittingstep import optimisers
+from mapclientplugins.fieldworkpcmeshfittingstep import prealign
+
+# Landmark Fit config values
+NONE = 'None'
+INITIALISE = 'Initialise'
+ONLY = 'Only'
+LANDMARK_FITS = (NONE, INITIALISE, ONLY)
+
+
+def _evaluate(evaluators, P):
+    P3 = P.reshape((3, -1))
+    return np.array([e(P3) for e in evaluators], dtype=float).reshape((len(evaluators), 3))
+
+
+def fitLandmarks(model, evaluators, targets, x0, weights=None, mWeight=0.0, xtol=1e-8, maxfev=1000,
+                 deadline=None):
+    """Fit the shape model to landmarks.
+
+    The pose (and scale) are first aligned in closed form to the targets
+    using the landmarks of the shape at the mode scores of x0, if there
+    are at least 3 landmarks. The parameters are then refined by the
+    Trust Region LSQ backend of optimisers.minimise on the weighted
+    landmark distances and the mode scores weighted by mWeight, within
+    the same evaluation budget and deadline as a fit to the point cloud.
+
+    inputs
+    ------
+    model : optimisers.RigidModesModel.
+    evaluators : landmark evaluators, functions of (3, n nodes) nodal
+        parameters returning a landmark's coordinates.
+    targets : (n landmarks, 3) array of target coordinates.
+    x0 : initial fit parameters.
+    weights : optional weight of each landmark.
+    mWeight : Mahalanobis weight.
+    xtol : xtol of the least squares refinement.
+    maxfev : maximum number of evaluations of the refinement.
+    deadline : optional absolute time.time() by which the refinement
+        stops and returns the best parameters seen.
+
+    returns
+    -------
+    xOpt : fitted parameters.
+    POpt : fitted flattened nodal parameters.
+    errors : unweighted squared distance of each landmark.
+    info : as for optimisers.minimise, with the run time including the
+        closed form alignment.
+    """
+    t0 = time.time()
+    targets = np.asarray(targets, dtype=float).reshape((-1, 3))
+    if len(evaluators) != len(targets):
+        raise ValueError('Mismatch in number of landmark evaluators and targets')
+    if len(targets) == 0:
+        raise ValueError('No landmarks to fit')
+    if weights is None:
+        weights = np.ones(len(targets))
+    weights = np.asarray(weights, dtype=float)
+    x = np.array(x0, dtype=float)
+
+    if len(targets) >= 3:
+        # posed landmarks are s R(l - c) + c + t for the landmarks l and
+        # node centre of mass c of the unposed shape
+        xRest = x.copy()
+        xRest[:6] = 0.0
+        nodes = model(xRest)
+        com = nodes.reshape((3, -1)).mean(1)
+        s, R, t = prealign.similarity(_evaluate(evaluators, nodes) - com, targets, weights, model.fitScale)
+        x[:3] = t - com
+        x[3:6] = prealign.rotationAngles(R)
+        if model.fitScale:
+            x[6] *= s
+
+    def obj(P):
+        # one residual per coordinate rather than per landmark, so that
+        # the few landmarks still constrain every parameter
+        return (weights[:, np.newaxis] * np.square(_evaluate(evaluators, P) - targets)).ravel()
+
+    xOpt, POpt, info = optimisers.minimise('Trust Region LSQ', obj, model, x, mWeight=mWeight,
+                                           xtol=xtol, maxfev=maxfev, deadline=deadline)
+    errors = np.square(_evaluate(evaluators, POpt) - targets).sum(1)
+    info['time'] = time.time() - t0
+    print('landmark fit: {} landmarks, {} evaluations in {:.3f} s, rmse {:.4f}'.format(
+        len(targets), info['nfev'], info['time'], np.sqrt(errors.mean())))
+    return xOpt, POpt, errors, info
@@ -21,17 +21,20 @@ import os
 
 os.environ['ETS_TOOLKIT'] = 'qt'
 
-from PySide6.QtWidgets import QDialog, QAbstractItemView, QTableWidgetItem
+from PySide6.QtWidgets import QDialog, QAbstractItemView, QMessageBox, QTableWidgetItem
 from PySide6.QtGui import QDoubleValidator
 from PySide6.QtCore import Qt
-from PySide6.QtCore import QThread, Signal
+from PySide6.QtCore import QThread, QTimer, Signal
 
 from mapclientplugins.fieldworkpcmeshfittingstep.ui_mayavifittingviewerwidget import Ui_Dialog
+from mapclientplugins.fieldworkpcmeshfittingstep import errorstats
+from mapclientplugins.fieldworkpcmeshfittingstep import pointlod
+from mapclientplugins.fieldworkpcmeshfittingstep import sweep
 from traits.api import HasTraits, Instance, on_trait_change, \
     Int, Dict
 
-from gias3.mapclientpluginutilities.viewers import MayaviViewerObjectsContainer, MayaviViewerFieldworkModel, MayaviViewerLandmark, colours
-from gias3.mapclientpluginutilities.viewers.mayaviviewerdatapoints import MayaviViewerDataPoints
+from gias3.mapclientpluginutilities.viewers import MayaviViewerObjectsContainer, MayaviViewerLandmark, colours
+from mapclientplugins.fieldworkpcmeshfittingstep.scenecache import CachedDataPoints, CachedFieldworkModel
 
 import copy
 
@@ -48,20 +51,38 @@ class _ExecThread(QThread):
         self.update.emit(output)
 
 
+class _SweepThread(QThread):
+    result = Signal(int, object)
+
+    def __init__(self):
+        QThread.__init__(self)
+        self.sweep = None
+        self.configs = []
+
+    def run(self):
+        for i, result in self.sweep.run(self.configs):
+            self.result.emit(i, result)
+
+
 class MayaviPCMeshFittingViewerWidget(QDialog):
     '''
     Configure dialog to present the user with the options to configure this step.
     '''
     defaultColor = colours['bone']
     objectTableHeaderColumns = {'visible': 0}
+    sweepTableHeaderColumns = {'Distance Mode': 0, 'PCs to Fit': 1, 'Mahalanobis Weight': 2,
+                               'Surface Discretisation': 3, 'rmse': 4, 'mean': 5, 'sd': 6, 'time': 7}
     backgroundColour = (0.0, 0.0, 0.0)
     _dataRenderArgs = {'mode': 'point', 'scale_factor': 0.5, 'color': (0, 1, 0)}
     _GFUnfittedRenderArgs = {'color': (1, 0, 0)}
     _GFFittedRenderArgs = {'color': (1, 1, 0)}
     _landmarkRenderArgs = {'mode': 'sphere', 'scale_factor': 5.0, 'color': (0, 1, 0)}
     _GFD = [12, 12]
+    _dataLODMinPoints = 20000
+    _dataLODIdleInterval = 300  # ms
 
-    def __init__(self, data, GFUnfitted, config, fitFunc, resetCallback, distModes, landmarks=None, parent=None):
+    def __init__(self, data, GFUnfitted, config, fitFunc, resetCallback, distModes, optimisers, landmarks=None,
+                 sweepFunc=None, sweepLoadFunc=None, parent=None):
         '''
         Constructor
         '''
@@ -73,33 +94,78 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
         self._scene.background = self.backgroundColour
 
         self.selectedObjectName = None
-        self._data = data
-        self._GFUnfitted = GFUnfitted
-        self._GFFitted = copy.deepcopy(self._GFUnfitted)
         self._fitFunc = fitFunc
-        self._config = config
         self._resetCallback = resetCallback
         self._distModes = distModes
-        self._landmarks = landmarks
-        if self._landmarks is not None:
-            self._landmarkNames = sorted(self._landmarks.keys())
-            print(self._landmarkNames)
-        else:
-            self._landmarkNames = []
+        self._optimisers = optimisers
+        self._sweepFunc = sweepFunc
+        self._sweepLoadFunc = sweepLoadFunc
+        self._sweepConfigs = []
+        self._sweepResults = {}
+        self._sceneObjects = {}
+        self._landmarkNames = []
+        self._setInputs(data, GFUnfitted, config, landmarks)
 
         self._worker = _ExecThread(self._fitFunc)
         self._worker.update.connect(self._fitUpdate)
 
+        self._sweepWorker = _SweepThread()
+        self._sweepWorker.result.connect(self._sweepUpdate)
+        self._sweepWorker.finished.connect(self._sweepFinished)
+
+        self._dataLODTimer = QTimer(self)
+        self._dataLODTimer.setSingleShot(True)
+        self._dataLODTimer.setInterval(self._dataLODIdleInterval)
+        self._dataLODTimer.timeout.connect(self._refineData)
+
         self._initViewerObjects()
         self._setupGui()
         self._initialiseSettings()
         self._makeConnections()
         self._initialiseObjectTable()
         self._refresh()
+        self._initDataLOD()
 
         # for k, v in self._config.items():
         #     print k+': ', v
 
+    def _setInputs(self, data, GFUnfitted, config, landmarks):
+        self._data = data
+        self._GFUnfitted = GFUnfitted
+        self._GFFitted = copy.deepcopy(self._GFUnfitted)
+        self._config = config
+        self._landmarks = landmarks
+        if self._landmarks is not None:
+            self._landmarkNames = sorted(self._landmarks.keys())
+            print(self._landmarkNames)
+        else:
+            self._landmarkNames = []
+
+        # only a spatially uniform subset of the data is displayed, refined
+        # while the camera is idle
+        self._dataLOD = pointlod.PointCloudLOD(self._data, int(self._config['Viewer Max Points']),
+                                               self._dataLODMinPoints)
+
+    def reload(self, data, GFUnfitted, config, landmarks=None):
+        """Show new step inputs when the step is executed again. The data
+        and mesh actors of the scene are kept and updated in place.
+        """
+        self._dataLODTimer.stop()
+        for ln in self._landmarkNames:
+            self._objects.getObject(ln).remove()
+        self._setInputs(data, GFUnfitted, config, landmarks)
+        self._sceneObjects['data'].updateGeometry(self._dataLOD.current(), self._scene)
+        self._sceneObjects['GF Unfitted'].setModel(self._GFUnfitted, self._scene)
+        self._sceneObjects['GF Fitted'].setModel(self._GFFitted, self._scene)
+
+        self._initViewerObjects()
+        self._initialiseSettings()
+        self._initialiseObjectTable()
+        self._clearErrors()
+        self._clearSweep()
+        self._refresh()
+        self._dataLODTimer.start()
+
     def _makeConnections(self):
         self._ui.tableWidget.itemClicked.connect(self._tableItemClicked)
         self._ui.tableWidget.itemChanged.connect(self._visibleBoxChanged)
@@ -122,23 +188,30 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
         self._ui.checkBoxFitSize.clicked.connect(self._saveConfig)
         self._ui.lineEditLandmarks.textChanged.connect(self._saveConfig)
         self._ui.lineEditLandmarkWeights.textChanged.connect(self._saveConfig)
+        self._ui.comboBoxOptimiser.activated.connect(self._saveConfig)
+
+        self._ui.runSweepButton.clicked.connect(self._runSweep)
+        self._ui.stopSweepButton.clicked.connect(self._stopSweep)
+        self._ui.sweepTableWidget.itemClicked.connect(self._sweepItemClicked)
 
     def _initViewerObjects(self):
+        # data and mesh objects persist for the life of the widget
+        if not self._sceneObjects:
+            self._sceneObjects['data'] = CachedDataPoints('data',
+                                                          self._dataLOD.current(),
+                                                          self._dataRenderArgs)
+            self._sceneObjects['GF Unfitted'] = CachedFieldworkModel('GF Unfitted',
+                                                                     self._GFUnfitted,
+                                                                     self._GFD,
+                                                                     self._GFUnfittedRenderArgs)
+            self._sceneObjects['GF Fitted'] = CachedFieldworkModel('GF Fitted',
+                                                                   self._GFFitted,
+                                                                   self._GFD,
+                                                                   self._GFFittedRenderArgs)
+
         self._objects = MayaviViewerObjectsContainer()
-        self._objects.addObject('data',
-                                MayaviViewerDataPoints('data',
-                                                       self._data,
-                                                       render_args=self._dataRenderArgs))
-        self._objects.addObject('GF Unfitted',
-                                MayaviViewerFieldworkModel('GF Unfitted',
-                                                           self._GFUnfitted,
-                                                           self._GFD,
-                                                           render_args=self._GFUnfittedRenderArgs))
-        self._objects.addObject('GF Fitted',
-                                MayaviViewerFieldworkModel('GF Fitted',
-                                                           self._GFFitted,
-                                                           self._GFD,
-                                                           render_args=self._GFFittedRenderArgs))
+        for name in ('data', 'GF Unfitted', 'GF Fitted'):
+            self._objects.addObject(name, self._sceneObjects[name])
         for ln in self._landmarkNames:
             self._objects.addObject(ln, MayaviViewerLandmark(ln,
                                                              self._landmarks[ln],
@@ -146,17 +219,54 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
                                                              )
                                     )
 
+    def _initDataLOD(self):
+        interactor = self._scene.interactor
+        if interactor is not None:
+            interactor.add_observer('StartInteractionEvent', self._coarsenData)
+            interactor.add_observer('EndInteractionEvent', self._dataIdle)
+        self._dataLODTimer.start()
+
+    def _coarsenData(self, obj=None, event=None):
+        self._dataLODTimer.stop()
+        points = self._dataLOD.coarsen()
+        if points is not None:
+            self._objects.getObject('data').updateGeometry(points, self._scene)
+
+    def _dataIdle(self, obj=None, event=None):
+        self._dataLODTimer.start()
+
+    def _refineData(self):
+        points = self._dataLOD.refine()
+        if points is not None:
+            self._objects.getObject('data').updateGeometry(points, self._scene)
+        if not self._dataLOD.isFull:
+            self._dataLODTimer.start()
+
     def _setupGui(self):
         for m in self._distModes:
             self._ui.comboBoxDistanceMode.addItem(m)
+        for o in self._optimisers:
+            self._ui.comboBoxOptimiser.addItem(o)
 
         self._ui.lineEditXTol.setValidator(QDoubleValidator())
         self._ui.spinBoxPCsToFit.setSingleStep(1)
         self._ui.spinBoxSurfDisc.setSingleStep(1)
+        self._ui.spinBoxSurfDisc.setMinimum(0)
+        self._ui.spinBoxSurfDisc.setSpecialValueText('auto')
         self._ui.doubleSpinBoxMWeight.setSingleStep(0.1)
         self._ui.spinBoxMaxfev.setMaximum(10000)
         self._ui.spinBoxMaxfev.setSingleStep(100)
 
+        # 0 workers uses all available cores
+        self._ui.spinBoxSweepWorkers.setMinimum(0)
+        self._ui.spinBoxSweepWorkers.setMaximum(256)
+        self._ui.sweepTableWidget.verticalHeader().setVisible(False)
+        self._ui.sweepTableWidget.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self._ui.sweepTableWidget.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self._ui.sweepTableWidget.setSelectionMode(QAbstractItemView.SingleSelection)
+        if self._sweepFunc is None:
+            self._ui.runSweepButton.setEnabled(False)
+
     def _saveConfig(self):
         self._config['Distance Mode'] = self._ui.comboBoxDistanceMode.currentText()
         self._config['PCs to Fit'] = str(self._ui.spinBoxPCsToFit.value())
@@ -167,6 +277,7 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
         self._config['Fit Scale'] = self._ui.checkBoxFitSize.isChecked()
         self._config['Landmarks'] = self._ui.lineEditLandmarks.text()
         self._config['Landmark Weights'] = self._ui.lineEditLandmarkWeights.text()
+        self._config['Optimiser'] = self._ui.comboBoxOptimiser.currentText()
 
     def _initialiseSettings(self):
         self._ui.comboBoxDistanceMode.setCurrentIndex(self._distModes.index(self._config['Distance Mode']))
@@ -178,6 +289,7 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
         self._ui.checkBoxFitSize.setChecked(bool(self._config['Fit Scale']))
         self._ui.lineEditLandmarks.setText(self._config['Landmarks'])
         self._ui.lineEditLandmarkWeights.setText(self._config['Landmark Weights'])
+        self._ui.comboBoxOptimiser.setCurrentIndex(self._optimisers.index(self._config['Optimiser']))
 
     def _initialiseObjectTable(self):
 
@@ -252,10 +364,14 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
     def _fitUpdate(self, output):
         GFFitted, transformFitted, RMSEFitted, errorsFitted = output
 
-        # update error fields
+        # update error fields from one pass over the errors
+        stats = errorstats.ErrorStatistics.fromErrors(errorsFitted)
         self._ui.RMSELineEdit.setText(str(RMSEFitted))
-        self._ui.meanErrorLineEdit.setText(str(errorsFitted.mean()))
-        self._ui.SDLineEdit.setText(str(errorsFitted.std()))
+        self._ui.meanErrorLineEdit.setText(str(stats.mean))
+        self._ui.SDLineEdit.setText(str(stats.sd))
+        self._ui.medianErrorLineEdit.setText(str(stats.quantile(0.5)))
+        self._ui.p95ErrorLineEdit.setText(str(stats.quantile(0.95)))
+        self._ui.maxErrorLineEdit.setText(str(stats.maxDistance))
 
         # update fitted GF
         fittedObj = self._objects.getObject('GF Fitted')
@@ -266,6 +382,72 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
         # unlock reg ui
         self._fitUnlockUI()
 
+    def _sweepRanges(self):
+        return {
+            'Distance Mode': sweep.parseRange(self._ui.lineEditSweepDistModes.text(), str),
+            'PCs to Fit': sweep.parseRange(self._ui.lineEditSweepPCs.text(), int),
+            'Mahalanobis Weight': sweep.parseRange(self._ui.lineEditSweepMWeights.text(), float),
+            'Surface Discretisation': sweep.parseRange(self._ui.lineEditSweepSurfDisc.text(), int),
+        }
+
+    def _runSweep(self):
+        self._saveConfig()
+        try:
+            configs = sweep.expandGrid(self._config, self._sweepRanges())
+            sweeper = self._sweepFunc(configs, self._ui.spinBoxSweepWorkers.value())
+        except ValueError as e:
+            QMessageBox.warning(self, 'Invalid Sweep', str(e))
+            return
+
+        self._clearSweep()
+        self._sweepConfigs = configs
+        table = self._ui.sweepTableWidget
+        table.setRowCount(len(configs))
+        for row, c in enumerate(configs):
+            for key in sweep.SWEEP_KEYS:
+                table.setItem(row, self.sweepTableHeaderColumns[key], QTableWidgetItem(c[key]))
+
+        self._sweepWorker.sweep = sweeper
+        self._sweepWorker.configs = configs
+        self._fitLockUI()
+        self._ui.stopSweepButton.setEnabled(True)
+        self._sweepWorker.start()
+
+    def _stopSweep(self):
+        if self._sweepWorker.sweep is not None:
+            self._sweepWorker.sweep.cancel()
+        self._ui.stopSweepButton.setEnabled(False)
+
+    def _sweepUpdate(self, row, result):
+        self._sweepResults[row] = result
+        table = self._ui.sweepTableWidget
+        if 'error' in result:
+            table.setItem(row, self.sweepTableHeaderColumns['rmse'], QTableWidgetItem(result['error']))
+            return
+        for key in ('rmse', 'mean', 'sd', 'time'):
+            item = QTableWidgetItem('{:.4g}'.format(result[key]))
+            item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            table.setItem(row, self.sweepTableHeaderColumns[key], item)
+
+    def _sweepFinished(self):
+        self._sweepWorker.sweep = None
+        self._ui.stopSweepButton.setEnabled(False)
+        self._fitUnlockUI()
+
+    def _sweepItemClicked(self):
+        row = self._ui.sweepTableWidget.currentRow()
+        result = self._sweepResults.get(row)
+        if result is None or 'error' in result:
+            return
+        self._fitUpdate(self._sweepLoadFunc(result))
+        if self._sweepWorker.isRunning():
+            self._fitLockUI()
+
+    def _clearSweep(self):
+        self._sweepConfigs = []
+        self._sweepResults = {}
+        self._ui.sweepTableWidget.setRowCount(0)
+
     def _fitLockUI(self):
         self._ui.comboBoxDistanceMode.setEnabled(False)
         self._ui.spinBoxPCsToFit.setEnabled(False)
@@ -276,10 +458,12 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
         self._ui.checkBoxFitSize.setEnabled(False)
         self._ui.lineEditLandmarks.setEnabled(False)
         self._ui.lineEditLandmarkWeights.setEnabled(False)
+        self._ui.comboBoxOptimiser.setEnabled(False)
         self._ui.fitButton.setEnabled(False)
         self._ui.resetButton.setEnabled(False)
         self._ui.acceptButton.setEnabled(False)
         self._ui.abortButton.setEnabled(False)
+        self._ui.runSweepButton.setEnabled(False)
 
     def _fitUnlockUI(self):
         self._ui.comboBoxDistanceMode.setEnabled(True)
@@ -291,10 +475,12 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
         self._ui.checkBoxFitSize.setEnabled(True)
         self._ui.lineEditLandmarks.setEnabled(True)
         self._ui.lineEditLandmarkWeights.setEnabled(True)
+        self._ui.comboBoxOptimiser.setEnabled(True)
         self._ui.fitButton.setEnabled(True)
         self._ui.resetButton.setEnabled(True)
         self._ui.acceptButton.setEnabled(True)
         self._ui.abortButton.setEnabled(True)
+        self._ui.runSweepButton.setEnabled(self._sweepFunc is not None)
 
     def _fitCallback(self, output):
         GFParamsFitted = output[1]
@@ -310,10 +496,12 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
         fittedTableItem = self._ui.tableWidget.item(2, self.objectTableHeaderColumns['visible'])
         fittedTableItem.setCheckState(Qt.Unchecked)
 
-        # clear error fields
-        self._ui.RMSELineEdit.clear()
-        self._ui.meanErrorLineEdit.clear()
-        self._ui.SDLineEdit.clear()
+        self._clearErrors()
+
+    def _clearErrors(self):
+        for lineEdit in (self._ui.RMSELineEdit, self._ui.meanErrorLineEdit, self._ui.SDLineEdit,
+                         self._ui.medianErrorLineEdit, self._ui.p95ErrorLineEdit, self._ui.maxErrorLineEdit):
+            lineEdit.clear()
 
     def _accept(self):
         self._close()
@@ -323,11 +511,12 @@ class MayaviPCMeshFittingViewerWidget(QDialog):
         self._close()
 
     def _close(self):
+        # hide rather than remove objects so that the scene can be reused
+        # if the step is executed again
+        self._dataLODTimer.stop()
+        self._stopSweep()
         for name in self._objects.getObjectNames():
-            self._objects.getObject(name).remove()
-
-        self._objects._objects = {}
-        self._objects == None
+            self._objects.getObject(name).setVisibility(False)
 
         # for r in xrange(self._ui.tableWidget.rowCount()):
         #     self._ui.tableWidget.removeRow(r)
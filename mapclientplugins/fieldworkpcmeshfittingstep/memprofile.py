@@ -0,0 +1,286 @@
+'''
+Memory profiling of the stages of a fit. The step and the fitting code
+mark their stages with stage(name), which does nothing unless a
+MemoryProfiler is active. While one is, each stage records the peak
+memory traced by tracemalloc and the peak resident set size sampled in a
+background thread.
+
+profileStep runs the step's input, initialisation and fitting code over
+several cloud sizes, and checkRegressions compares the result with a
+saved baseline.
+'''
+import contextlib
+import os
+import threading
+import tracemalloc
+
+import numpy as np
+
+# stages marked in the step and fitting code
+STAGES = ('port ingestion', 'deep copies', 'initialisation', 'objective construction',
+          'pre-alignment', 'optimisation', 'error evaluation')
+
+# the profiler stages are recorded to, if any
+_active = None
+_noStage = contextlib.nullcontext()
+
+
+def stage(name):
+    """Context manager marking a stage of a fit for the active profiler.
+    """
+    if _active is None:
+        return _noStage
+    return _active.stage(name)
+
+
+def _readRSS():
+    """Resident set size of this process in bytes, or None where
+    /proc/self/statm is not available.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _RSSSampler(threading.Thread):
+    """Samples the resident set size every interval seconds and keeps the
+    peak since the last reset.
+    """
+
+    def __init__(self, interval=0.005):
+        super(_RSSSampler, self).__init__(daemon=True)
+        self.interval = interval
+        self.peak = _readRSS()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = _readRSS()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+        return rss
+
+    def resetPeak(self):
+        self.peak = _readRSS()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class _StageFrame(object):
+    def __init__(self, name, current, rss):
+        self.name = name
+        self.start = current
+        self.startRSS = rss
+        self.peak = current
+        self.peakRSS = rss
+
+
+class MemoryProfiler(object):
+    """Records the memory use of the stages run while it is active.
+
+    For each stage run it records the peak traced memory above the traced
+    memory at the start of the stage ('peak'), the traced memory still
+    held at its end ('retained') and the peak resident set size above that
+    at its start ('peak rss'), all in bytes. Stages can be nested, and the
+    peaks of a stage include those of the stages it contains.
+    """
+
+    def __init__(self, rssInterval=0.005):
+        self.rssInterval = rssInterval
+        self.records = []
+        self._frames = []
+        self._sampler = None
+        self._startedTracing = False
+
+    def __enter__(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError('A memory profiler is already active')
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._startedTracing = True
+        if _readRSS() is not None:
+            self._sampler = _RSSSampler(self.rssInterval)
+            self._sampler.start()
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = None
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+
+    def _peaks(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        peakRSS = None if self._sampler is None else self._sampler.peak
+        return peak, peakRSS
+
+    def _updateParent(self):
+        # fold the peaks so far into the enclosing stage before they are
+        # reset
+        if self._frames:
+            parent = self._frames[-1]
+            peak, peakRSS = self._peaks()
+            parent.peak = max(parent.peak, peak)
+            if peakRSS is not None:
+                parent.peakRSS = max(parent.peakRSS, peakRSS)
+
+    def _resetPeaks(self):
+        tracemalloc.reset_peak()
+        if self._sampler is not None:
+            self._sampler.resetPeak()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self._updateParent()
+        self._resetPeaks()
+        rss = None if self._sampler is None else self._sampler.sample()
+        frame = _StageFrame(name, tracemalloc.get_traced_memory()[0], rss)
+        self._frames.append(frame)
+        try:
+            yield
+        finally:
+            if self._sampler is not None:
+                self._sampler.sample()
+            peak, peakRSS = self._peaks()
+            self._frames.pop()
+            frame.peak = max(frame.peak, peak)
+            record = {
+                'stage': name,
+                'peak': frame.peak - frame.start,
+                'retained': tracemalloc.get_traced_memory()[0] - frame.start,
+                'peak rss': None,
+            }
+            if peakRSS is not None and frame.startRSS is not None:
+                record['peak rss'] = max(frame.peakRSS, peakRSS) - frame.startRSS
+            self.records.append(record)
+            # the enclosing stage resumes with its own peaks, which include
+            # this stage's
+            if self._frames:
+                parent = self._frames[-1]
+                parent.peak = max(parent.peak, frame.peak)
+                if peakRSS is not None:
+                    parent.peakRSS = max(parent.peakRSS, peakRSS)
+            self._resetPeaks()
+
+    def summary(self):
+        """Records combined per stage name: the number of times the stage
+        ran ('calls'), the largest peak and peak rss, and the total retained
+        memory. Returns a dict of stage name to dict.
+        """
+        stages = {}
+        for r in self.records:
+            s = stages.setdefault(r['stage'], {'calls': 0, 'peak': 0, 'retained': 0, 'peak rss': None})
+            s['calls'] += 1
+            s['peak'] = max(s['peak'], r['peak'])
+            s['retained'] += r['retained']
+            if r['peak rss'] is not None:
+                s['peak rss'] = max(s['peak rss'] or 0, r['peak rss'])
+        return stages
+
+
+def _subsample(a, index):
+    if a is None:
+        return None
+    return np.asarray(a)[index]
+
+
+def profileStep(data, GF, pc, config=None, sizes=None, T0=None, dataWeights=None, landmarks=None,
+                seed=0):
+    """Run the step's port input, model initialisation and fit without the
+    GUI under a MemoryProfiler, once for each cloud size.
+
+    inputs
+    ------
+    data : (n, 3) point cloud. It is randomly subsampled, or resampled
+        with repeats, to each size.
+    GF, pc, T0, dataWeights, landmarks : the other step inputs, as for
+        setPortData.
+    config : optional config items to change from the step defaults.
+    sizes : cloud sizes to profile. Defaults to the size of data.
+    seed : seed of the subsampling.
+
+    returns
+    -------
+    results : list of dicts of the cloud size ('points') and the stage
+        summary of MemoryProfiler.summary ('stages').
+    """
+    from mapclientplugins.fieldworkpcmeshfittingstep.step import FieldworkPCMeshFittingStep
+
+    data = np.asarray(data, dtype=float)
+    if sizes is None:
+        sizes = [len(data)]
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in sizes:
+        index = np.sort(rng.choice(len(data), size, replace=size > len(data)))
+        step = FieldworkPCMeshFittingStep('')
+        if config is not None:
+            step._config.update(config)
+        step._config['GUI'] = False
+        inputs = [data[index], GF, pc, T0, _subsample(dataWeights, index), landmarks]
+
+        with MemoryProfiler() as profiler:
+            for port, value in enumerate(inputs):
+                if value is not None:
+                    step.setPortData(port, value)
+            step._initGF()
+            step._fit()
+        results.append({'points': int(size), 'stages': profiler.summary()})
+    return results
+
+
+def formatResults(results):
+    """Table of profileStep results in MB.
+    """
+    mb = 1.0 / (1024 * 1024)
+    lines = ['{:>10s}  {:<24s} {:>5s} {:>10s} {:>10s} {:>10s}'.format(
+        'points', 'stage', 'calls', 'peak MB', 'kept MB', 'rss MB')]
+    for result in results:
+        for name, s in sorted(result['stages'].items(), key=lambda item: _stageOrder(item[0])):
+            rss = '-' if s['peak rss'] is None else '{:.1f}'.format(s['peak rss'] * mb)
+            lines.append('{:>10d}  {:<24s} {:>5d} {:>10.1f} {:>10.1f} {:>10s}'.format(
+                result['points'], name, s['calls'], s['peak'] * mb, s['retained'] * mb, rss))
+    return '\n'.join(lines)
+
+
+def _stageOrder(name):
+    if name in STAGES:
+        return STAGES.index(name), name
+    return len(STAGES), name
+
+
+def checkRegressions(results, baseline, tolerance=0.2, minBytes=1024 * 1024):
+    """Compare profileStep results with baseline results of the same cloud
+    sizes. A stage regresses if its peak memory grew by more than
+    tolerance times its baseline peak and by more than minBytes.
+
+    returns
+    -------
+    regressions : list of (points, stage, baseline peak, peak) tuples.
+    """
+    baselineBySize = {r['points']: r['stages'] for r in baseline}
+    regressions = []
+    for result in results:
+        stages = baselineBySize.get(result['points'])
+        if stages is None:
+            continue
+        for name, s in result['stages'].items():
+            if name not in stages:
+                continue
+            old = stages[name]['peak']
+            if s['peak'] - old > max(tolerance * old, minBytes):
+                regressions.append((result['points'], name, old, s['peak']))
+    return regressions
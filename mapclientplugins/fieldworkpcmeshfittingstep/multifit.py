@@ -0,0 +1,180 @@
+'''
+Simultaneous fitting of several shape models, e.g. the bones of a joint,
+to one shared point cloud.
+'''
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from mapclientplugins.fieldworkpcmeshfittingstep import errorstats
+from mapclientplugins.fieldworkpcmeshfittingstep import fitting
+from mapclientplugins.fieldworkpcmeshfittingstep import objectives
+from mapclientplugins.fieldworkpcmeshfittingstep import optimisers
+
+
+class MultiBoneFitter(object):
+    """Fits several (GF, PC model) pairs to one point cloud.
+
+    One k-d tree is built over the cloud and shared by all bones. Each fit
+    round assigns every cloud point to the bone with the closest surface
+    point, then fits each bone to its own points, starting from its
+    parameters in the previous round. Rounds stop when the assignment no
+    longer changes or the batch time limit of the plan runs out.
+    """
+
+    def __init__(self, data, GFs, pcs, plan, dataWeights=None):
+        if len(GFs) != len(pcs):
+            raise ValueError('Mismatch in number of fieldwork models and principal components')
+
+        self.data = np.asarray(data, dtype=float)
+        if dataWeights is None:
+            self.dataWeights = np.ones(len(self.data))
+        else:
+            self.dataWeights = np.asarray(dataWeights, dtype=float)
+        self.GFs = GFs
+        self.plan = plan
+        self.nThreads = plan.nThreads
+
+        # shared index over the cloud, and per-bone evaluators and models
+        # reused across fit rounds
+        self.dataTree = cKDTree(self.data)
+        self.GDs = [plan.withDiscretisation(GF, self.data).GD for GF in GFs]
+        self.evaluators = [objectives.makeSurfaceEvaluator(GF, GD, self.nThreads)
+                           for GF, GD in zip(GFs, self.GDs)]
+        self.models = [optimisers.RigidModesModel(pc, plan.fitModes, plan.fitScale) for pc in pcs]
+
+    def assign(self, Ps):
+        """Return the index of the closest bone for each cloud point given
+        the flattened nodal parameters of each bone.
+        """
+        eps = [ev(P) for ev, P in zip(self.evaluators, Ps)]
+        epBones = np.hstack([np.full(len(ep), b) for b, ep in enumerate(eps)])
+        i = cKDTree(np.vstack(eps)).query(self.data, workers=self.nThreads)[1]
+        return epBones[i]
+
+    def _makeBoneObj(self, b, labels):
+        plan = self.plan
+        owned = labels == b
+        if plan.distMode == 'EPDP':
+            # surface points whose closest cloud point belongs to another
+            # bone get zero weight
+            return objectives.makeDataObj('EPDP', self.GFs[b], self.data, self.GDs[b],
+                                          self.dataWeights * owned,
+                                          nClosestPoints=self.plan.nClosestPoints,
+                                          nThreads=self.nThreads,
+                                          evaluator=self.evaluators[b],
+                                          dataTree=self.dataTree)
+        return objectives.makeDataObj('DPEP', self.GFs[b], self.data[owned], self.GDs[b],
+                                      self.dataWeights[owned],
+                                      nClosestPoints=self.plan.nClosestPoints,
+                                      nThreads=self.nThreads,
+                                      evaluator=self.evaluators[b])
+
+    def fit(self, x0s, maxRounds=None):
+        """Fit all bones.
+
+        inputs
+        ------
+        x0s : list of initial parameter vectors, one per bone.
+        maxRounds : maximum number of assignment and fit rounds. Defaults
+            to plan.multiBoneRounds.
+
+        returns
+        -------
+        xOpts : list of fitted parameter vectors.
+        POpts : list of fitted flattened nodal parameters.
+        errors : list of arrays of the squared distance from each cloud
+            point assigned to a bone to the bone's surface.
+        labels : index of the bone each cloud point is assigned to.
+        info : dict of the total number of objective evaluations ('nfev'),
+            the run time in seconds ('time'), the number of rounds run
+            ('rounds'), whether the batch or a bone fit was stopped by
+            its time limit ('budgetExhausted'), what stopped the rounds
+            ('stopReason': 'converged', 'max rounds' or 'time budget'),
+            a termination message ('message'), what stopped the last
+            fit of each bone ('boneStopReasons'), the surface
+            discretisation of each bone ('surfaceDiscretisation'), and a
+            summary ('errorStatistics') and the RMS ('rmses') of the errors
+            of each bone.
+        """
+        plan = self.plan
+        if maxRounds is None:
+            maxRounds = plan.multiBoneRounds
+        if maxRounds < 1:
+            raise ValueError('Multi-Bone Rounds must be at least 1')
+        t0 = time.time()
+        batchDeadline = plan.batchDeadline()
+        budgetExhausted = False
+        xs = [fitting.matchParamLength(x0, plan.nParams) for x0 in x0s]
+        Ps = [m(x) for m, x in zip(self.models, xs)]
+        labels = None
+        nfev = 0
+        rounds = 0
+        stopReason = 'max rounds'
+        boneStopReasons = [None] * len(self.models)
+        for r in range(maxRounds):
+            newLabels = self.assign(Ps)
+            if labels is None:
+                nChanged = len(newLabels)
+            else:
+                nChanged = int((newLabels != labels).sum())
+            if nChanged == 0:
+                stopReason = 'converged'
+                break
+            labels = newLabels
+            rounds += 1
+
+            for b in range(len(self.models)):
+                if batchDeadline is not None and time.time() > batchDeadline:
+                    budgetExhausted = True
+                    break
+                if not np.any(labels == b):
+                    print('WARNING: no cloud points assigned to bone {}, not fitted'.format(b))
+                    continue
+                obj = self._makeBoneObj(b, labels)
+                kwargs = dict(mWeight=plan.mWeight, xtol=plan.xtol, maxfev=plan.maxfev,
+                              deadline=plan.fitDeadline(batchDeadline), stopping=plan.stopping)
+                if plan.progressive and r == 0:
+                    # later rounds start from fitted modes, so only the
+                    # first releases them progressively
+                    xs[b], Ps[b], info = optimisers.minimiseProgressive(
+                        plan.optimiser, obj, self.models[b], xs[b], plan.modesPerStage, **kwargs)
+                else:
+                    xs[b], Ps[b], info = optimisers.minimise(
+                        plan.optimiser, obj, self.models[b], xs[b], **kwargs)
+                nfev += info['nfev']
+                boneStopReasons[b] = info['stopReason']
+                budgetExhausted = budgetExhausted or info['budgetExhausted']
+            print('multi-bone round {}: {} points reassigned'.format(r, nChanged))
+            if batchDeadline is not None and time.time() > batchDeadline:
+                budgetExhausted = True
+                stopReason = 'time budget'
+                print('WARNING: multi-bone fit stopped by the batch time limit')
+                break
+
+        errors = []
+        for b in range(len(self.models)):
+            owned = labels == b
+            errObj = objectives.makeDataObj('DPEP', self.GFs[b], self.data[owned], self.GDs[b],
+                                            nClosestPoints=self.plan.nClosestPoints,
+                                            nThreads=self.nThreads,
+                                            evaluator=self.evaluators[b])
+            errors.append(errObj(Ps[b]))
+        errorStatistics = [errorstats.ErrorStatistics.fromErrors(e) for e in errors]
+
+        info = {
+            'nfev': nfev,
+            'time': time.time() - t0,
+            'rounds': rounds,
+            'budgetExhausted': budgetExhausted,
+            'stopReason': stopReason,
+            'message': 'multi-bone fit stopped after {} rounds ({})'.format(rounds, stopReason),
+            'boneStopReasons': boneStopReasons,
+            'surfaceDiscretisation': self.GDs,
+            'errorStatistics': [s.summary() for s in errorStatistics],
+            'rmses': [s.rmse for s in errorStatistics],
+        }
+        print('multi-bone fit: {} bones, {} function evaluations in {:.2f} s'.format(
+            len(self.models), nfev, info['time']))
+        return xs, Ps, errors, labels, info
@@ -0,0 +1,238 @@
+'''
+Data-to-mesh distance objectives with multi-threaded surface evaluation and
+closest-point queries.
+'''
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+DIST_MODES = ('DPEP', 'EPDP')
+
+# minimum number of evaluation points per surface evaluation chunk
+_minChunkRows = 2000
+
+_executors = {}
+
+
+def resolveThreads(nThreads):
+    """Number of threads to use. 0 or less means all available cores.
+    """
+    nThreads = int(nThreads)
+    if nThreads <= 0:
+        nThreads = os.cpu_count() or 1
+    return nThreads
+
+
+def getExecutor(nThreads):
+    """Return a process-wide thread pool with nThreads workers, or None
+    if nThreads is 1. Pools are kept for the lifetime of the process so
+    repeat fits do not pay the pool start-up cost.
+    """
+    nThreads = resolveThreads(nThreads)
+    if nThreads == 1:
+        return None
+
+    executor = _executors.get(nThreads)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=nThreads)
+        _executors[nThreads] = executor
+    return executor
+
+
+def topologySignature(GF):
+    """Digest of the element types and element to node maps of GF. Meshes
+    with the same signature share their topology, whatever their field
+    parameters.
+    """
+    f = GF.ensemble_field_function
+    elementMap = f.mapper._element_to_ensemble_map
+    h = hashlib.sha1(str(f.get_number_of_ensemble_points()).encode())
+    for elementNumber in sorted(f.mesh.elements.keys()):
+        element = f.mesh.elements[elementNumber]
+        h.update(repr((elementNumber, getattr(element, 'type', None),
+                       sorted(elementMap[elementNumber].items()))).encode())
+    return h.hexdigest()
+
+
+def makeBasisMatrix(GF, GD):
+    """Sparse (n evaluation points x n nodes) matrix of basis function
+    values at a regular GD xi-discretisation of every element in GF. Rows
+    are in the same order as GF.evaluate_geometric_field(GD).
+
+    GD can also hold one discretisation per element, in order of element
+    number, e.g. as chosen by discretisation.chooseDiscretisation.
+    """
+    f = GF.ensemble_field_function
+    if not f.is_flat():
+        f = f.flatten()[0]
+
+    elementNumbers = np.sort(list(f.mesh.elements.keys()))
+    if np.ndim(GD) == 2:
+        if len(GD) != len(elementNumbers):
+            raise ValueError('{} element discretisations given for {} elements'.format(
+                len(GD), len(elementNumbers)))
+        elementGDs = [tuple(d) for d in GD]
+    else:
+        elementGDs = [tuple(GD)] * len(elementNumbers)
+
+    basisValues = {}
+    rows = []
+    cols = []
+    vals = []
+    row = 0
+    for elementNumber, elementGD in zip(elementNumbers, elementGDs):
+        element = f.mesh.elements[elementNumber]
+        b = basisValues.get((element.type, elementGD))
+        if b is None:
+            evalGrid = element.generate_eval_grid(list(elementGD)).squeeze()
+            b = f.basis[element.type].eval(evalGrid.T).T
+            basisValues[(element.type, elementGD)] = b
+
+        emap = f.mapper._element_to_ensemble_map[elementNumber]
+        for n in range(b.shape[1]):
+            rows.append(np.arange(row, row + b.shape[0]))
+            cols.append(np.full(b.shape[0], emap[n][0][0]))
+            vals.append(b[:, n])
+        row += b.shape[0]
+
+    A = sparse.csr_matrix(
+        (np.hstack(vals), (np.hstack(rows), np.hstack(cols))),
+        shape=(row, f.get_number_of_ensemble_points())
+    )
+    return A
+
+
+class SurfaceEvaluator(object):
+    """Evaluates points on the mesh surface from flattened nodal
+    parameters. With an executor, the rows of the basis matrix are split
+    into chunks that are evaluated concurrently.
+    """
+
+    def __init__(self, A, executor=None, nChunks=1):
+        self.A = sparse.csr_matrix(A)
+        self.executor = executor
+        self.nPoints = self.A.shape[0]
+        self._chunks = [self.A]
+        if executor is not None:
+            nChunks = min(nChunks, max(1, self.nPoints // _minChunkRows))
+            if nChunks > 1:
+                bounds = np.linspace(0, self.nPoints, nChunks + 1).astype(int)
+                self._chunks = [self.A[bounds[i]:bounds[i + 1]] for i in range(nChunks)]
+
+    def __call__(self, P):
+        """Return the (n, 3) array of surface points for nodal parameters P.
+        """
+        P3 = P.reshape((3, -1)).T
+        if len(self._chunks) == 1:
+            return self.A.dot(P3)
+
+        return np.vstack(list(self.executor.map(lambda a: a.dot(P3), self._chunks)))
+
+
+def makeSurfaceEvaluator(GF, GD, nThreads=1):
+    """Create a SurfaceEvaluator for GF at discretisation GD that evaluates
+    in chunks over nThreads threads.
+    """
+    return SurfaceEvaluator(makeBasisMatrix(GF, GD), getExecutor(nThreads), resolveThreads(nThreads))
+
+
+class _DistanceObj(object):
+
+    def __init__(self, evaluator, data, dataWeights=None, nClosestPoints=1, nThreads=1):
+        self.evaluator = evaluator
+        self.data = np.asarray(data, dtype=float)
+        if dataWeights is None:
+            self.dataWeights = None
+        else:
+            self.dataWeights = np.asarray(dataWeights, dtype=float)
+        self.nClosestPoints = int(nClosestPoints)
+        self.workers = resolveThreads(nThreads)
+
+
+class DPEPObj(_DistanceObj):
+    """Squared distance from each data point to its closest evaluated point
+    on the mesh surface.
+    """
+
+    def __call__(self, P):
+        ep = self.evaluator(P)
+        d = cKDTree(ep).query(self.data, k=self.nClosestPoints, workers=self.workers)[0]
+        if self.nClosestPoints > 1:
+            d = d.mean(1)
+        # d is a new array, so it is squared and weighted in place
+        err = np.square(d, out=d)
+        if self.dataWeights is not None:
+            err *= self.dataWeights
+        return err
+
+
+class EPDPObj(_DistanceObj):
+    """Squared distance from each evaluated point on the mesh surface to its
+    closest data point. A prebuilt k-d tree of the data can be given to
+    share one index between several objectives.
+    """
+
+    def __init__(self, evaluator, data, dataWeights=None, nClosestPoints=1, nThreads=1,
+                 dataTree=None):
+        super(EPDPObj, self).__init__(evaluator, data, dataWeights, nClosestPoints, nThreads)
+        if dataTree is None:
+            dataTree = cKDTree(self.data)
+        self.dataTree = dataTree
+
+    def __call__(self, P):
+        ep = self.evaluator(P)
+        d, i = self.dataTree.query(ep, k=self.nClosestPoints, workers=self.workers)
+        if self.nClosestPoints > 1:
+            d = d.mean(1)
+        err = np.square(d, out=d)
+        if self.dataWeights is not None:
+            w = self.dataWeights[i]
+            if self.nClosestPoints > 1:
+                w = w.mean(1)
+            err *= w
+        return err
+
+
+_objClasses = {
+    'DPEP': DPEPObj,
+    'EPDP': EPDPObj,
+}
+
+
+def makeDataObj(distMode, GF, data, GD, dataWeights=None, nClosestPoints=1, nThreads=1,
+                evaluator=None, dataTree=None):
+    """Create a data-to-mesh objective function of the flattened nodal
+    parameters of GF.
+
+    inputs
+    ------
+    distMode : 'DPEP' or 'EPDP'.
+    GF : geometric_field to be fitted.
+    data : (n, 3) array of target points.
+    GD : per-element surface discretisation, e.g. [10, 10].
+    dataWeights : optional (n,) array of data point weights.
+    nClosestPoints : number of closest points averaged per distance.
+    nThreads : number of threads for surface evaluation and closest point
+        queries. 0 means all available cores.
+    evaluator : optional SurfaceEvaluator to share between objectives.
+    dataTree : optional cKDTree of data to share between EPDP objectives.
+
+    returns
+    -------
+    obj : function returning the per-point squared distances.
+    """
+    try:
+        objClass = _objClasses[distMode]
+    except KeyError:
+        raise ValueError('Unknown distance mode ' + str(distMode))
+
+    if evaluator is None:
+        evaluator = makeSurfaceEvaluator(GF, GD, nThreads)
+
+    if distMode == 'EPDP':
+        return objClass(evaluator, data, dataWeights, nClosestPoints, nThreads, dataTree=dataTree)
+    return objClass(evaluator, data, dataWeights, nClosestPoints, nThreads)
@@ -0,0 +1,504 @@
+'''
+Optimiser backends for fitting the rigid-body and principal component
+parameters of a shape model to a point cloud.
+'''
+import time
+from collections import deque
+
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.optimize import leastsq
+
+OPTIMISERS = ('PCFit', 'Trust Region LSQ', 'Gauss-Newton')
+# relative function tolerance of the PCFit backend, as in PCA_fitting.PCFit
+PCFIT_FTOL = 1e-6
+# lower bound on the xtol of the stages of a progressive fit before the last
+STAGE_XTOL = 1e-2
+
+
+def rotationMatrix(angles):
+    """Rotation matrix Rx.Ry.Rz of the angles (rx, ry, rz) of a fit
+    parameter vector, as applied by gias3 transform3D.transformRigid3D.
+    """
+    rx, ry, rz = angles
+    cx, sx = np.cos(rx), np.sin(rx)
+    cy, sy = np.cos(ry), np.sin(ry)
+    cz, sz = np.cos(rz), np.sin(rz)
+    Rx = np.array([[1.0, 0.0, 0.0], [0.0, cx, -sx], [0.0, sx, cx]])
+    Ry = np.array([[cy, 0.0, sy], [0.0, 1.0, 0.0], [-sy, 0.0, cy]])
+    Rz = np.array([[cz, -sz, 0.0], [sz, cz, 0.0], [0.0, 0.0, 1.0]])
+    return Rx.dot(Ry).dot(Rz)
+
+
+class RigidModesModel(object):
+    """Maps a fit parameter vector [tx, ty, tz, rx, ry, rz, (s), mode SDs...]
+    to the flattened nodal coordinates of the shape model, in the same way
+    as PCA_fitting.PCFit: the shape is reconstructed from the mode scores,
+    then scaled and rotated about its centre of mass and translated.
+
+    The mode scores are in standard deviations, a whitened space in which
+    the shape prior has unit variance in every mode and the squared
+    Mahalanobis distance is the squared norm of the scores. The modes are
+    scaled by their SDs once, here, so a reconstruction is a single
+    matrix-vector product.
+    """
+
+    def __init__(self, pc, modes, fitScale=False):
+        self.pc = pc
+        self.modes = np.asarray(modes, dtype=int)
+        self.fitScale = bool(fitScale)
+        if self.fitScale:
+            self.nRigid = 7
+        else:
+            self.nRigid = 6
+
+        basis = np.asarray(pc.modes)[:, self.modes] * np.sqrt(np.asarray(pc.weights)[self.modes])
+        mean = np.array(pc.mean, dtype=float)
+        if pc.sdNorm:
+            SD = np.asarray(pc.SD, dtype=float)
+            basis = basis * SD[:, np.newaxis]
+        self._mean = mean.reshape((3, -1))
+        self._basis = np.ascontiguousarray(basis.reshape((3, self._mean.shape[1], len(self.modes))))
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=float)
+        p = self._mean + self._basis.dot(x[self.nRigid:])
+        com = p.mean(1)[:, np.newaxis]
+        p -= com
+        if self.fitScale:
+            p *= x[6]
+        p = rotationMatrix(x[3:6]).dot(p)
+        p += com + x[:3, np.newaxis]
+        return p.ravel()
+
+    def modeSDs(self, x):
+        return x[self.nRigid:]
+
+    def lockModes(self, nFree, x):
+        """Model of the rigid parameters and the first nFree modes, with the
+        other modes held at their scores in x. The held modes are folded
+        into the mean of the returned model.
+
+        returns
+        -------
+        model : RigidModesModel of x[:nRigid + nFree].
+        xFree : x[:nRigid + nFree].
+        """
+        x = np.asarray(x, dtype=float)
+        nFree = int(nFree)
+        model = RigidModesModel(self.pc, self.modes[:nFree], self.fitScale)
+        model._mean = self._mean + self._basis[:, :, nFree:].dot(x[self.nRigid + nFree:])
+        return model, x[:self.nRigid + nFree].copy()
+
+
+class StoppingCriteria(object):
+    """Stagnation tests applied to the best evaluation seen over a sliding
+    window of objective evaluations. A test is disabled when its tolerance
+    is 0 or None.
+
+    inputs
+    ------
+    objectiveTol : stop when the lowest cost minimised by the optimiser
+        improved by less than this fraction of its value over the window.
+    rmseTol : stop when the RMS distance of the lowest-cost evaluation
+        improved by less than this over the window.
+    modeTols : stop when every fitted mode score of the best parameters
+        changed by less than its tolerance, in standard deviations, over
+        the window. A sequence shorter than the number of modes is padded
+        with its last value.
+    window : number of objective evaluations in the window. It is raised to
+        at least two finite-difference Jacobians' worth of evaluations so
+        that a Jacobian evaluation is not mistaken for stagnation.
+    """
+
+    def __init__(self, objectiveTol=0.0, rmseTol=0.0, modeTols=None, window=50):
+        self.objectiveTol = objectiveTol or 0.0
+        self.rmseTol = rmseTol or 0.0
+        if modeTols is not None and len(modeTols) == 0:
+            modeTols = None
+        self.modeTols = modeTols
+        self.window = int(window)
+
+    @property
+    def enabled(self):
+        return self.objectiveTol > 0.0 or self.rmseTol > 0.0 or self.modeTols is not None
+
+    def windowFor(self, nParams):
+        return max(self.window, 2 * (nParams + 1))
+
+    def modeTolsFor(self, nModes):
+        tols = np.asarray(self.modeTols, dtype=float)[:nModes]
+        if len(tols) < nModes:
+            tols = np.hstack([tols, np.full(nModes - len(tols), tols[-1])])
+        return tols
+
+
+class _StopFit(Exception):
+    """Raised by _FitMonitor to stop an optimiser early. reason is one of
+    'time budget', 'objective tolerance', 'rmse plateau' or 'mode change'.
+    """
+
+    def __init__(self, reason, message):
+        super(_StopFit, self).__init__(message)
+        self.reason = reason
+
+
+class _Best(object):
+    """Lowest-cost evaluation seen by a _FitMonitor: its cost, the RMS of
+    its distances and its parameter vector.
+    """
+
+    def __init__(self, cost, rmse, x):
+        self.cost = cost
+        self.rmse = rmse
+        self.x = x
+
+
+class _FitMonitor(object):
+    """Wraps an objective function of nodal parameters. Counts calls, keeps
+    the evaluation with the lowest cost seen so far, and stops the fit once
+    the wall-clock deadline has passed or the stopping criteria detect
+    stagnation.
+
+    Backends call it with the nodal parameters and the parameter vector
+    they were evaluated from. Evaluations are ranked by cost(err, modes,
+    mWeight), the sum of squares of the backend's own residuals, so a
+    stopped fit does not return a point the backend ranks worse than one
+    it has seen, e.g. a finite-difference probe.
+
+    checkpoint is an optional (interval, callback) pair. Every interval
+    evaluations, callback(x, nfev) is called with the parameter vector of
+    the best evaluation so far.
+    """
+
+    def __init__(self, obj, model, x0, cost, mWeight=0.0, deadline=None, stopping=None,
+                 checkpoint=None):
+        self.obj = obj
+        self.model = model
+        self.cost = cost
+        self.mWeight = mWeight
+        self.deadline = deadline
+        self.checkpoint = checkpoint
+        self.nfev = 0
+        self.best = None
+
+        self.stopping = None
+        self._history = None
+        if stopping is not None and stopping.enabled:
+            self.stopping = stopping
+            self._history = deque(maxlen=stopping.windowFor(len(x0)) + 1)
+            if stopping.modeTols is not None:
+                self._modeTols = stopping.modeTolsFor(len(x0) - model.nRigid)
+
+    def __call__(self, P, x):
+        if self.deadline is not None and self.best is not None and time.time() > self.deadline:
+            raise _StopFit('time budget', 'wall-clock time budget exhausted')
+
+        self.nfev += 1
+        err = self.obj(P)
+        cost = self.cost(err, self.model.modeSDs(x), self.mWeight)
+        if self.best is None or cost < self.best.cost:
+            self.best = _Best(cost, np.sqrt(np.sum(err) / len(err)), np.array(x, dtype=float))
+
+        if self._history is not None:
+            self._history.append(self.best)
+            if len(self._history) == self._history.maxlen:
+                self._checkStagnation(self._history[0], self._history[-1])
+
+        if self.checkpoint is not None:
+            interval, callback = self.checkpoint
+            if self.nfev % interval == 0:
+                callback(self.best.x, self.nfev)
+        return err
+
+    def _checkStagnation(self, old, new):
+        s = self.stopping
+        if s.objectiveTol > 0.0 and old.cost - new.cost <= s.objectiveTol * new.cost:
+            raise _StopFit('objective tolerance', 'relative objective change below tolerance')
+        if s.rmseTol > 0.0 and old.rmse - new.rmse <= s.rmseTol:
+            raise _StopFit('rmse plateau', 'RMSE plateaued')
+        if s.modeTols is not None:
+            nRigid = self.model.nRigid
+            dx = np.abs(new.x[nRigid:] - old.x[nRigid:])
+            if np.all(dx <= self._modeTols):
+                raise _StopFit('mode change', 'mode score changes below tolerance')
+
+
+def _makeResiduals(obj, model, mWeight):
+    """Residual vector in x: the square root of the per-point squared
+    distances returned by obj, followed by the weighted mode scores so that
+    the sum of squares includes the squared Mahalanobis distance.
+    """
+    mRootWeight = np.sqrt(mWeight)
+
+    def residuals(x):
+        r = np.sqrt(np.abs(obj(model(x), x)))
+        if mWeight > 0.0:
+            r = np.hstack([r, mRootWeight * model.modeSDs(x)])
+        return r
+
+    return residuals
+
+
+def _residualsCost(err, modes, mWeight):
+    """Sum of squares of the residuals of _makeResiduals.
+    """
+    return np.sum(np.abs(err)) + mWeight * np.dot(modes, modes)
+
+
+def _pcFitCost(err, modes, mWeight):
+    """Sum of squares of the PCFit residuals, which add the weighted
+    Mahalanobis distance to every squared distance.
+    """
+    return np.sum(np.square(err + mWeight * np.sqrt(np.dot(modes, modes))))
+
+
+def _pcFitMaxfev(maxfev, nParams):
+    """maxfev to give leastsq so that it calls the objective at most maxfev
+    times. MINPACK only checks its budget after a trial step, so it can
+    finish a forward-difference Jacobian and one more step past it, and
+    leastsq makes one extra call to check the objective.
+    """
+    return max(1, maxfev - nParams - 1)
+
+
+def _fitPCFit(obj, model, x0, mWeight, xtol, maxfev):
+    """The objective and Levenberg-Marquardt solver of
+    PCA_fitting.PCFit.rigidModeNFit and rigidScaleModeNFit, evaluated
+    through model so that obj sees the parameters of every evaluation. As
+    in PCFit, the weighted Mahalanobis distance is added to every residual.
+    """
+    def residuals(x):
+        m = model.modeSDs(x)
+        return obj(model(x), x) + mWeight * np.sqrt(np.dot(m, m))
+
+    xOpt, cov, infodict, message, ier = leastsq(residuals, x0, xtol=xtol, ftol=PCFIT_FTOL,
+                                                maxfev=_pcFitMaxfev(maxfev, len(x0)),
+                                                full_output=True)
+    return xOpt, model(xOpt), 'PCFit: ' + ' '.join(message.split())
+
+
+def _fitTrustRegion(obj, model, x0, mWeight, xtol, maxfev):
+    residuals = _makeResiduals(obj, model, mWeight)
+    # max_nfev does not count the evaluations of the forward-difference
+    # Jacobian, which least_squares makes at most once per counted one
+    res = least_squares(residuals, x0, method='trf', x_scale='jac',
+                        xtol=xtol, max_nfev=max(1, maxfev // (len(x0) + 1)),
+                        )
+    return res.x, model(res.x), res.message
+
+
+def _fitGaussNewton(obj, model, x0, mWeight, xtol, maxfev, ftol=1e-8, eps=1e-6,
+                    maxLineSearch=10):
+    """Gauss-Newton with a forward-difference Jacobian and a backtracking
+    (Armijo) line search along the Gauss-Newton step.
+    """
+    residuals = _makeResiduals(obj, model, mWeight)
+    x = np.array(x0, dtype=float)
+    r = residuals(x)
+    cost = 0.5 * np.dot(r, r)
+    nfev = 1
+    message = 'maximum number of function evaluations exceeded'
+    while nfev + len(x) < maxfev:
+        # forward-difference jacobian
+        J = np.empty((len(r), len(x)), dtype=float)
+        for i in range(len(x)):
+            h = eps * max(1.0, abs(x[i]))
+            xh = x.copy()
+            xh[i] += h
+            J[:, i] = (residuals(xh) - r) / h
+        nfev += len(x)
+
+        g = np.dot(J.T, r)
+        dx = np.linalg.lstsq(J, -r, rcond=None)[0]
+        slope = np.dot(g, dx)
+        if slope >= 0.0:
+            message = 'not a descent direction'
+            break
+
+        # backtracking line search
+        alpha = 1.0
+        accepted = False
+        for _ in range(maxLineSearch):
+            xNew = x + alpha * dx
+            rNew = residuals(xNew)
+            nfev += 1
+            costNew = 0.5 * np.dot(rNew, rNew)
+            if costNew <= cost + 1e-4 * alpha * slope:
+                accepted = True
+                break
+            alpha *= 0.5
+            if nfev >= maxfev:
+                break
+
+        if not accepted:
+            message = 'line search failed to reduce the objective'
+            break
+
+        stepNorm = np.linalg.norm(alpha * dx)
+        costChange = cost - costNew
+        x, r, cost = xNew, rNew, costNew
+        if stepNorm <= xtol * (xtol + np.linalg.norm(x)):
+            message = 'step size below xtol'
+            break
+        if costChange <= ftol * cost:
+            message = 'relative reduction in cost below ftol'
+            break
+
+    return x, model(x), message
+
+
+# fit function and cost minimised by each backend
+_backends = {
+    'PCFit': (_fitPCFit, _pcFitCost),
+    'Trust Region LSQ': (_fitTrustRegion, _residualsCost),
+    'Gauss-Newton': (_fitGaussNewton, _residualsCost),
+}
+
+
+def minimise(optimiser, obj, model, x0, mWeight=0.0, xtol=1e-6, maxfev=1000, deadline=None,
+             stopping=None, checkpoint=None):
+    """Fit the parameters of model to minimise the residuals returned by obj.
+
+    inputs
+    ------
+    optimiser : name of the optimiser backend, one of OPTIMISERS.
+    obj : function of flattened nodal parameters returning per-point
+        squared distances.
+    model : RigidModesModel mapping the parameter vector to nodal
+        parameters.
+    x0 : initial parameter vector.
+    deadline : optional absolute time.time() after which the fit is
+        stopped. The parameters of the evaluation with the lowest cost
+        minimised by the backend seen so far are then returned.
+    stopping : optional StoppingCriteria. When one of its tests stops the
+        fit, the parameters of the lowest-cost evaluation seen are returned.
+    checkpoint : optional (interval, callback) pair. callback(x, nfev) is
+        called with the best parameters so far every interval objective
+        evaluations, so that an interrupted fit can be resumed from x.
+
+    returns
+    -------
+    xOpt : optimised parameter vector.
+    POpt : flattened nodal parameters at xOpt.
+    info : dict of the number of objective evaluations ('nfev'), the
+        run time in seconds ('time'), the termination message ('message'),
+        what stopped the fit ('stopReason': 'optimiser' or a _StopFit
+        reason) and whether the fit was stopped by the deadline
+        ('budgetExhausted').
+    """
+    try:
+        backend, cost = _backends[optimiser]
+    except KeyError:
+        raise ValueError('Unknown optimiser ' + str(optimiser))
+    if maxfev < 1:
+        raise ValueError('Max Func Evaluations must be at least 1')
+
+    x0 = np.asarray(x0, dtype=float)
+    if checkpoint is not None and checkpoint[0] <= 0:
+        checkpoint = None
+    monitor = _FitMonitor(obj, model, x0, cost, mWeight, deadline, stopping, checkpoint)
+    t0 = time.time()
+    try:
+        xOpt, POpt, message = backend(monitor, model, x0, mWeight, xtol, maxfev)
+        stopReason = 'optimiser'
+    except _StopFit as e:
+        xOpt = monitor.best.x
+        POpt = model(xOpt)
+        message = str(e)
+        stopReason = e.reason
+
+    info = {
+        'nfev': monitor.nfev,
+        'time': time.time() - t0,
+        'message': message,
+        'stopReason': stopReason,
+        'budgetExhausted': stopReason == 'time budget',
+    }
+    return xOpt, POpt, info
+
+
+def modeStages(nModes, modesPerStage):
+    """Number of free modes at each stage of a progressive fit releasing
+    modesPerStage more modes at each stage, e.g. [2, 4, 5] for 5 modes
+    released 2 at a time.
+    """
+    if modesPerStage <= 0:
+        return [nModes]
+    return list(range(modesPerStage, nModes, modesPerStage)) + [nModes]
+
+
+def minimiseProgressive(optimiser, obj, model, x0, modesPerStage, mWeight=0.0, xtol=1e-6,
+                        maxfev=1000, deadline=None, stopping=None, checkpoint=None,
+                        stageXtol=STAGE_XTOL):
+    """Fit the parameters of model in stages that release modesPerStage
+    more modes at a time, each stage starting from the solution of the
+    last. Modes not yet released are held at their scores in x0. The
+    early stages have few parameters and converge in few evaluations, and
+    the higher modes are fitted from a shape and pose that have settled.
+
+    Only the last stage needs to converge fully, so the stages before it
+    stop at the looser of xtol and stageXtol. maxfev and deadline bound
+    all stages together. A stage stopped by the deadline ends the fit. See
+    minimise for the other inputs. checkpoint callbacks get the full
+    parameter vector and the evaluations of all stages so far.
+
+    returns
+    -------
+    xOpt, POpt, info : as for minimise, with info summed over the stages
+        and the message and stop reason of the last stage run. info also
+        holds a list of dicts of the free modes ('modes'), evaluations
+        ('nfev') and stop reason ('stop reason') of each stage
+        ('modeStages').
+    """
+    x = np.array(x0, dtype=float)
+    nfev = 0
+    t0 = time.time()
+    stages = []
+    nModes = len(model.modes)
+    for nFree in modeStages(nModes, modesPerStage):
+        stageModel, xStage = model.lockModes(nFree, x)
+        stageXtolUsed = xtol if nFree == nModes else max(xtol, stageXtol)
+        stageCheckpoint = None
+        if checkpoint is not None:
+            stageCheckpoint = (checkpoint[0], _stageCallback(checkpoint[1], x, nfev))
+        xStage, POpt, info = minimise(optimiser, obj, stageModel, xStage, mWeight=mWeight,
+                                      xtol=stageXtolUsed, maxfev=max(maxfev - nfev, 1), deadline=deadline,
+                                      stopping=stopping, checkpoint=stageCheckpoint)
+        x[:len(xStage)] = xStage
+        nfev += info['nfev']
+        stages.append({'modes': nFree, 'nfev': info['nfev'], 'stop reason': info['stopReason']})
+        if info['budgetExhausted'] or nfev >= maxfev:
+            break
+
+    info.update(nfev=nfev, time=time.time() - t0, modeStages=stages)
+    return x, model(x), info
+
+
+def _stageCallback(callback, x, nfevBefore):
+    def stageCallback(xStage, nfev):
+        xFull = x.copy()
+        xFull[:len(xStage)] = xStage
+        callback(xFull, nfevBefore + nfev)
+
+    return stageCallback
+
+
+def compareOptimisers(obj, model, x0, mWeight=0.0, xtol=1e-6, maxfev=1000,
+                      optimisers=OPTIMISERS):
+    """Run the same fit with each optimiser backend and tabulate the
+    number of objective evaluations to convergence, the run time and the
+    final RMS error of each.
+
+    returns
+    -------
+    results : list of (optimiser, nfev, time, rmse) tuples.
+    """
+    results = []
+    for name in optimisers:
+        xOpt, POpt, info = minimise(name, obj, model, x0, mWeight=mWeight,
+                                    xtol=xtol, maxfev=maxfev)
+        rmse = np.sqrt(obj(POpt).mean())
+        results.append((name, info['nfev'], info['time'], rmse))
+
+    return results
@@ -0,0 +1,91 @@
+'''
+Level-of-detail display of large point clouds.
+'''
+import numpy as np
+
+
+def uniformOrder(points, seed=0, nOrdered=None):
+    """Return an ordering of the points in which every prefix is spatially
+    uniform. Points are taken one per occupied cell of successively finer
+    grids over the bounding box, each grid having 8 times the cells of the
+    previous, so a prefix of any length covers the cloud evenly. If
+    nOrdered is given, only the first nOrdered points are guaranteed to be
+    in that order.
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    rng = np.random.default_rng(seed)
+    shuffled = rng.permutation(n)
+    lo = points.min(0)
+    extent = points.max(0) - lo
+    extent[extent == 0.0] = 1.0
+    # normalised coordinates of the shuffled points in [0, 1)
+    u = (points[shuffled] - lo) / extent
+    u = np.clip(u, 0.0, 1.0 - 1e-12)
+
+    if nOrdered is None:
+        nOrdered = n
+    order = []
+    nTaken = 0
+    remaining = np.arange(n)
+    cellsPerAxis = 1
+    while nTaken < nOrdered and len(remaining) and cellsPerAxis <= 2 ** 20:
+        ijk = (u[remaining] * cellsPerAxis).astype(np.int64)
+        keys = (ijk[:, 0] * cellsPerAxis + ijk[:, 1]) * cellsPerAxis + ijk[:, 2]
+        # first remaining point, in shuffled order, in each occupied cell
+        first = np.unique(keys, return_index=True)[1]
+        first.sort()
+        order.append(remaining[first])
+        nTaken += len(first)
+        taken = np.zeros(len(remaining), dtype=bool)
+        taken[first] = True
+        remaining = remaining[~taken]
+        cellsPerAxis *= 2
+    order.append(remaining)
+
+    return shuffled[np.hstack(order)]
+
+
+class PointCloudLOD(object):
+    """Progressively refined display subsets of a point cloud.
+
+    The coarsest level has minPoints points and each refinement doubles the
+    number of points shown, up to maxPoints.
+    """
+
+    def __init__(self, points, maxPoints=200000, minPoints=20000, seed=0):
+        self.points = np.asarray(points, dtype=float)
+        self.maxPoints = min(int(maxPoints), len(self.points))
+        self.minPoints = min(int(minPoints), self.maxPoints)
+        if self.minPoints < len(self.points):
+            self._order = uniformOrder(self.points, seed, self.maxPoints)[:self.maxPoints]
+        else:
+            self._order = np.arange(len(self.points))
+        self.nShown = self.minPoints
+
+    @property
+    def isFull(self):
+        return self.nShown >= self.maxPoints
+
+    def current(self):
+        """Points of the current level.
+        """
+        return self.points[self._order[:self.nShown]]
+
+    def coarsen(self):
+        """Drop to the coarsest level. Returns its points, or None if it is
+        already shown.
+        """
+        if self.nShown == self.minPoints:
+            return None
+        self.nShown = self.minPoints
+        return self.current()
+
+    def refine(self):
+        """Go up one level. Returns its points, or None if all points up to
+        maxPoints are already shown.
+        """
+        if self.isFull:
+            return None
+        self.nShown = min(2 * self.nShown, self.maxPoints)
+        return self.current()
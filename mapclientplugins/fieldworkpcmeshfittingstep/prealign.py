@@ -0,0 +1,193 @@
+'''
+Rigid pre-alignment of the shape model to a point cloud. ICP aligns the
+surface of the shape at its initial mode scores to a subsample of the
+cloud, with closed-form pose updates: point-to-plane (a 6x6 linear least
+squares solve) or point-to-point (SVD). Each iteration costs one closest
+point query of the subsample, far less than an objective evaluation of the
+full fit, so starting the fit from the aligned pose saves evaluations.
+'''
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from mapclientplugins.fieldworkpcmeshfittingstep import optimisers
+
+# number of cloud points aligned
+DEFAULT_POINTS = 2000
+# stop when the RMS distance improves by less than this fraction
+DEFAULT_TOL = 1e-5
+# pairs further apart than this multiple of the median pair distance are
+# left out of a pose update
+REJECT_FACTOR = 3.0
+# number of surface points whose principal axes give a surface normal
+NORMAL_NEIGHBOURS = 10
+METRICS = ('plane', 'point')
+
+
+def rotationAngles(R):
+    """Angles (rx, ry, rz) with optimisers.rotationMatrix(angles) == R.
+    """
+    ry = np.arcsin(np.clip(R[0, 2], -1.0, 1.0))
+    if abs(R[0, 2]) < 1.0 - 1e-12:
+        rx = np.arctan2(-R[1, 2], R[2, 2])
+        rz = np.arctan2(-R[0, 1], R[0, 0])
+    else:
+        # gimbal lock, only rx + rz or rx - rz is defined
+        rx = np.arctan2(R[2, 1], R[1, 1])
+        rz = 0.0
+    return np.array([rx, ry, rz])
+
+
+def similarity(src, dst, weights=None, fitScale=False):
+    """Weighted least-squares scale s, rotation R and translation t with
+    s R.src + t ~ dst for (n, 3) arrays of paired points (Umeyama). s is 1
+    unless fitScale.
+    """
+    if weights is None:
+        w = np.full(len(src), 1.0 / len(src))
+    else:
+        w = np.asarray(weights, dtype=float) / np.sum(weights)
+    srcMean = w.dot(src)
+    dstMean = w.dot(dst)
+    srcC = src - srcMean
+    H = (srcC * w[:, np.newaxis]).T.dot(dst - dstMean)
+    U, S, Vt = np.linalg.svd(H)
+    D = np.eye(3)
+    D[2, 2] = np.sign(np.linalg.det(Vt.T.dot(U.T)))
+    R = Vt.T.dot(D).dot(U.T)
+    s = 1.0
+    if fitScale:
+        s = S.dot(np.diag(D)) / w.dot(np.square(srcC).sum(1))
+    return s, R, dstMean - s * R.dot(srcMean)
+
+
+def kabsch(src, dst):
+    """Least-squares rotation R and translation t with R.src + t ~ dst for
+    (n, 3) arrays of paired points.
+    """
+    s, R, t = similarity(src, dst)
+    return R, t
+
+
+def surfaceNormals(points, tree=None, k=NORMAL_NEIGHBOURS):
+    """Unit normals, of arbitrary sign, of surface points sampled densely
+    enough that each point and its k - 1 nearest neighbours lie on a
+    locally flat patch: the direction of least variance of the k points.
+    """
+    if tree is None:
+        tree = cKDTree(points)
+    k = min(k, len(points))
+    neighbours = points[tree.query(points, k=k)[1]]
+    neighbours = neighbours - neighbours.mean(1)[:, np.newaxis, :]
+    cov = np.einsum('nki,nkj->nij', neighbours, neighbours)
+    return np.linalg.eigh(cov)[1][:, :, 0]
+
+
+def pointToPlane(src, dst, normals):
+    """Small rotation R and translation t reducing the distances of R.src + t
+    to the tangent planes through dst with the given normals, from the
+    linearised least squares problem. Directions the planes do not
+    constrain, e.g. sliding along a flat patch, are left unchanged.
+    """
+    A = np.hstack([np.cross(src, normals), normals])
+    b = ((dst - src) * normals).sum(1)
+    omega, t = np.split(np.linalg.lstsq(A, b, rcond=None)[0], 2)
+    # nearest rotation to the linearised one
+    U, S, Vt = np.linalg.svd(np.eye(3) + np.cross(np.eye(3), omega))
+    R = U.dot(Vt)
+    return R, t
+
+
+def rigidICP(model, evaluator, data, x0, maxIterations, nPoints=DEFAULT_POINTS, tol=DEFAULT_TOL,
+             metric='plane', seed=0):
+    """Align the shape model to data by rigid ICP, starting from the pose of
+    x0. The mode scores and scale of x0 are kept.
+
+    The fit parameters rotate the model nodes about their centre of mass c
+    and then translate them by t. The surface points are affine in the
+    nodes, so the posed surface points are R(s - c) + c + t for the surface
+    points s of the unposed shape, and ICP can run on s without evaluating
+    the model again.
+
+    inputs
+    ------
+    model : optimisers.RigidModesModel.
+    evaluator : objectives.SurfaceEvaluator of the mesh surface points.
+    data : (n, 3) array of target points.
+    x0 : initial fit parameters.
+    maxIterations : maximum number of ICP iterations.
+    nPoints : number of data points, randomly sampled, that are aligned.
+    tol : stop when the RMS distance improves by less than this fraction.
+    metric : 'plane' for point-to-plane ICP, which converges in fewer
+        iterations on curved surfaces, or 'point' for point-to-point ICP.
+    seed : seed of the data sampling.
+
+    returns
+    -------
+    x : x0 with the aligned translation and rotation.
+    info : dict of the number of iterations ('iterations'), the RMS
+        distance of the sampled points to the surface before ('initial
+        rmse') and after ('rmse') alignment, and the time taken in seconds
+        ('time').
+    """
+    if metric not in METRICS:
+        raise ValueError('Unknown ICP metric ' + str(metric))
+    t0 = time.time()
+    x0 = np.array(x0, dtype=float)
+    data = np.asarray(data, dtype=float)
+    if len(data) > nPoints:
+        data = data[np.random.default_rng(seed).choice(len(data), nPoints, replace=False)]
+
+    # unposed shape at the mode scores and scale of x0
+    xRest = x0.copy()
+    xRest[:6] = 0.0
+    nodes = model(xRest)
+    com = nodes.reshape((3, -1)).mean(1)
+    surface = evaluator(nodes) - com
+    tree = cKDTree(surface)
+    if metric == 'plane':
+        normals = surfaceNormals(surface, tree)
+
+    R = optimisers.rotationMatrix(x0[3:6])
+    t = x0[:3] + com
+    rmse = initialRMSE = best = None
+    iterations = 0
+    while True:
+        # query in the shape frame so the tree and normals are made once
+        local = (data - t).dot(R)
+        d, index = tree.query(local)
+        rmsePrev = rmse
+        rmse = np.sqrt(np.mean(d * d))
+        if initialRMSE is None:
+            initialRMSE = rmse
+        if best is None or rmse < best[0]:
+            best = (rmse, R, t)
+        if iterations == maxIterations or (rmsePrev is not None and rmsePrev - rmse <= tol * rmsePrev):
+            break
+        keep = d <= REJECT_FACTOR * np.median(d)
+        if keep.sum() < 3:
+            break
+        if metric == 'plane':
+            # move the local data onto the planes, then invert the move
+            dR, dt = pointToPlane(local[keep], surface[index[keep]], normals[index[keep]])
+            R = R.dot(dR.T)
+            t = t - R.dot(dt)
+        else:
+            R, t = kabsch(surface[index[keep]], data[keep])
+        iterations += 1
+
+    # rejected pairs can make an update worse, so keep the best pose
+    rmse, R, t = best
+    x = x0.copy()
+    x[:3] = t - com
+    x[3:6] = rotationAngles(R)
+    info = {
+        'iterations': iterations,
+        'initial rmse': float(initialRMSE),
+        'rmse': float(rmse),
+        'time': time.time() - t0,
+    }
+    print('rigid pre-alignment: {} iterations in {:.2f} s, sampled rmse {:.4f} -> {:.4f}'.format(
+        iterations, info['time'], info['initial rmse'], info['rmse']))
+    return x, info
@@ -0,0 +1,220 @@
+'''
+Offscreen rendering of QA snapshots of a fit for batch runs without a
+display. Uses VTK directly, without Qt or Mayavi. Offscreen rendering
+without a display needs a VTK built with OSMesa or EGL.
+'''
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# (name, direction from the focal point to the camera, view up)
+VIEWS = (
+    ('front', (0.0, -1.0, 0.0), (0.0, 0.0, 1.0)),
+    ('back', (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)),
+    ('left', (-1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+    ('right', (1.0, 0.0, 0.0), (0.0, 0.0, 1.0)),
+    ('top', (0.0, 0.0, 1.0), (0.0, 1.0, 0.0)),
+    ('iso', (1.0, -1.0, 1.0), (0.0, 0.0, 1.0)),
+)
+
+_renderers = {}
+
+
+def getRenderer(width=800, height=600):
+    """Return a process-wide SnapshotRenderer of the given image size so
+    that repeat fits reuse one render pipeline.
+    """
+    key = (int(width), int(height))
+    renderer = _renderers.get(key)
+    if renderer is None:
+        renderer = SnapshotRenderer(*key)
+        _renderers[key] = renderer
+    return renderer
+
+
+def _asList(GFs):
+    if GFs is None:
+        return []
+    if isinstance(GFs, (list, tuple)):
+        return list(GFs)
+    return [GFs]
+
+
+class _MeshSlot(object):
+    """Actor and polydata of one mesh. Connectivity is only rebuilt when
+    the triangulation changes.
+    """
+
+    def __init__(self, vtk, numpy_support, renderer, colour, opacity):
+        self._vtk = vtk
+        self._ns = numpy_support
+        self.polyData = vtk.vtkPolyData()
+        self._T = None
+        mapper = vtk.vtkPolyDataMapper()
+        mapper.SetInputData(self.polyData)
+        mapper.ScalarVisibilityOff()
+        self.actor = vtk.vtkActor()
+        self.actor.SetMapper(mapper)
+        self.actor.GetProperty().SetColor(colour)
+        self.actor.GetProperty().SetOpacity(opacity)
+        self.actor.VisibilityOff()
+        renderer.AddActor(self.actor)
+
+    def update(self, P, T):
+        ns = self._ns
+        points = self.polyData.GetPoints()
+        if points is None or points.GetNumberOfPoints() != len(P):
+            points = self._vtk.vtkPoints()
+            self.polyData.SetPoints(points)
+        points.SetData(ns.numpy_to_vtk(np.ascontiguousarray(P, dtype=float), deep=True))
+
+        if self._T is None or not np.array_equal(self._T, T):
+            self._T = np.array(T)
+            cells = np.hstack([np.full((len(T), 1), 3), T]).astype(np.int64).ravel()
+            polys = self._vtk.vtkCellArray()
+            polys.SetCells(len(T), ns.numpy_to_vtkIdTypeArray(cells, deep=True))
+            self.polyData.SetPolys(polys)
+
+        points.Modified()
+        self.polyData.Modified()
+        self.actor.VisibilityOn()
+
+
+class SnapshotRenderer(object):
+    """Offscreen renderer of the point cloud coloured by per-point error,
+    the unfitted meshes and the fitted meshes from a fixed set of views.
+
+    The render window, actors and polydata are created once and updated in
+    place for each fit.
+    """
+    cloudPointSize = 3.0
+    unfittedColour = (1.0, 0.0, 0.0)
+    unfittedOpacity = 0.3
+    fittedColour = (1.0, 1.0, 0.0)
+    fittedOpacity = 0.6
+    backgroundColour = (0.0, 0.0, 0.0)
+    GD = (8, 8)
+
+    def __init__(self, width=800, height=600, views=VIEWS):
+        import vtk
+        from vtk.util import numpy_support
+        self._vtk = vtk
+        self._ns = numpy_support
+        self.views = views
+
+        self.renderer = vtk.vtkRenderer()
+        self.renderer.SetBackground(self.backgroundColour)
+        self.window = vtk.vtkRenderWindow()
+        self.window.SetOffScreenRendering(1)
+        self.window.SetSize(width, height)
+        self.window.AddRenderer(self.renderer)
+
+        # cloud
+        self._cloud = vtk.vtkPolyData()
+        self._cloudVerts = vtk.vtkVertexGlyphFilter()
+        self._cloudVerts.SetInputData(self._cloud)
+        self._lut = vtk.vtkLookupTable()
+        self._lut.SetHueRange(0.667, 0.0)
+        self._lut.Build()
+        cloudMapper = vtk.vtkPolyDataMapper()
+        cloudMapper.SetInputConnection(self._cloudVerts.GetOutputPort())
+        cloudMapper.SetLookupTable(self._lut)
+        cloudMapper.SetScalarModeToUsePointData()
+        cloudMapper.UseLookupTableScalarRangeOn()
+        self._cloudActor = vtk.vtkActor()
+        self._cloudActor.SetMapper(cloudMapper)
+        self._cloudActor.GetProperty().SetPointSize(self.cloudPointSize)
+        self.renderer.AddActor(self._cloudActor)
+
+        self._scalarBar = vtk.vtkScalarBarActor()
+        self._scalarBar.SetLookupTable(self._lut)
+        self._scalarBar.SetTitle('error')
+        self._scalarBar.SetNumberOfLabels(5)
+        self.renderer.AddActor2D(self._scalarBar)
+
+        self._unfittedSlots = []
+        self._fittedSlots = []
+
+        self._imageFilter = vtk.vtkWindowToImageFilter()
+        self._imageFilter.SetInput(self.window)
+        self._imageFilter.ReadFrontBufferOff()
+        self._writer = vtk.vtkPNGWriter()
+        self._writer.SetInputConnection(self._imageFilter.GetOutputPort())
+
+    def _updateMeshes(self, slots, GFs, colour, opacity):
+        while len(slots) < len(GFs):
+            slots.append(_MeshSlot(self._vtk, self._ns, self.renderer, colour, opacity))
+        for slot, GF in zip(slots, GFs):
+            slot.update(*GF.triangulate(list(self.GD)))
+        for slot in slots[len(GFs):]:
+            slot.actor.VisibilityOff()
+
+    def _updateCloud(self, data, dist):
+        ns = self._ns
+        points = self._cloud.GetPoints()
+        if points is None or points.GetNumberOfPoints() != len(data):
+            points = self._vtk.vtkPoints()
+            self._cloud.SetPoints(points)
+        points.SetData(ns.numpy_to_vtk(np.ascontiguousarray(data, dtype=float), deep=True))
+        points.Modified()
+
+        scalars = ns.numpy_to_vtk(np.ascontiguousarray(dist, dtype=float), deep=True)
+        scalars.SetName('error')
+        self._cloud.GetPointData().SetScalars(scalars)
+        self._cloud.Modified()
+        self._lut.SetTableRange(0.0, max(float(np.max(dist)), 1e-12))
+
+    def render(self, outputPrefix, data, GFUnfitted, GFFitted, errors=None):
+        """Write one PNG per view of data, GFUnfitted and GFFitted.
+
+        inputs
+        ------
+        outputPrefix : path prefix of the images. Each view is written to
+            <outputPrefix>_<view name>.png.
+        data : (n, 3) array of cloud points.
+        GFUnfitted : geometric_field or list of geometric_fields before
+            fitting.
+        GFFitted : geometric_field or list of geometric_fields after
+            fitting.
+        errors : optional (n,) array of squared distances of the cloud
+            points to the fitted mesh. If not given or of a different
+            length, the distance to the closest vertex of the fitted
+            meshes is used.
+
+        returns
+        -------
+        filenames : list of the image files written.
+        """
+        data = np.asarray(data, dtype=float)
+        GFFitted = _asList(GFFitted)
+        self._updateMeshes(self._unfittedSlots, _asList(GFUnfitted), self.unfittedColour, self.unfittedOpacity)
+        self._updateMeshes(self._fittedSlots, GFFitted, self.fittedColour, self.fittedOpacity)
+
+        if errors is not None and len(errors) == len(data):
+            dist = np.sqrt(np.abs(errors))
+        else:
+            verts = np.vstack([self._ns.vtk_to_numpy(s.polyData.GetPoints().GetData())
+                               for s in self._fittedSlots[:len(GFFitted)]])
+            dist = cKDTree(verts).query(data)[0]
+        self._updateCloud(data, dist)
+
+        outputDir = os.path.dirname(outputPrefix)
+        if outputDir and not os.path.isdir(outputDir):
+            os.makedirs(outputDir)
+
+        camera = self.renderer.GetActiveCamera()
+        filenames = []
+        for name, direction, viewUp in self.views:
+            camera.SetFocalPoint(0.0, 0.0, 0.0)
+            camera.SetPosition(direction)
+            camera.SetViewUp(viewUp)
+            self.renderer.ResetCamera()
+            self.window.Render()
+            self._imageFilter.Modified()
+            filename = '{}_{}.png'.format(outputPrefix, name)
+            self._writer.SetFileName(filename)
+            self._writer.Write()
+            filenames.append(filename)
+
+        return filenames
@@ -0,0 +1,167 @@
+'''
+Persistent Mayavi scene objects for the fitting viewer. Actors and their
+polydata are created once and their point coordinates are updated in place
+when the geometry changes, instead of being redrawn.
+'''
+import numpy as np
+
+from mapclientplugins.fieldworkpcmeshfittingstep import objectives
+
+# display tessellations keyed by mesh topology signature and discretisation
+_tessellations = {}
+
+
+class DisplayTessellation(object):
+    """Triangulation of a mesh topology at a discretisation, with the
+    basis matrix that maps nodal parameters to its vertices.
+    """
+
+    def __init__(self, GF, GD):
+        T, vertIndices = GF.triangulate(list(GD), ret_vert_map=True)[1:3]
+        self.T = T
+        self.A = objectives.makeBasisMatrix(GF, GD)[vertIndices]
+
+    def evaluate(self, params):
+        """Return the (n, 3) vertex coordinates for the nodal parameters
+        params, flattened or of shape (3, nNodes[, 1]).
+        """
+        return self.A.dot(np.asarray(params, dtype=float).reshape((3, -1)).T)
+
+
+def getTessellation(GF, GD):
+    """Return the process-wide DisplayTessellation of the topology of GF at
+    discretisation GD.
+    """
+    key = (objectives.topologySignature(GF), tuple(GD))
+    tessellation = _tessellations.get(key)
+    if tessellation is None:
+        tessellation = DisplayTessellation(GF, GD)
+        _tessellations[key] = tessellation
+    return tessellation
+
+
+def _setPointsInPlace(sceneObject, P):
+    """Overwrite the point coordinates of a mlab object's dataset and mark
+    them modified. Returns False if the number of points differs.
+    """
+    dataset = sceneObject.mlab_source.dataset
+    points = dataset.points.to_array()
+    if points.shape != P.shape:
+        return False
+    points[:] = P
+    dataset.points.modified()
+    dataset.modified()
+    return True
+
+
+class _CachedSceneObject(object):
+    typeName = None
+
+    def __init__(self, name, renderArgs=None):
+        self.name = name
+        if renderArgs is None:
+            renderArgs = {}
+        self.renderArgs = renderArgs
+        self.sceneObject = None
+        self.visible = True
+
+    def setVisibility(self, visible):
+        self.visible = visible
+        if self.sceneObject is not None:
+            self.sceneObject.visible = visible
+
+    def remove(self):
+        if self.sceneObject is not None:
+            self.sceneObject.remove()
+            self.sceneObject = None
+
+
+class CachedDataPoints(_CachedSceneObject):
+    """Point cloud drawn once and updated in place. The dataset is only
+    rebuilt when the number of points changes.
+    """
+    typeName = 'datapoints'
+
+    def __init__(self, name, coords, renderArgs=None):
+        super(CachedDataPoints, self).__init__(name, renderArgs)
+        self.coords = np.asarray(coords, dtype=float)
+
+    def draw(self, scene):
+        if self.sceneObject is not None:
+            self.setVisibility(True)
+            return
+        scene.disable_render = True
+        d = self.coords
+        self.sceneObject = scene.mlab.points3d(d[:, 0], d[:, 1], d[:, 2], name=self.name,
+                                               **self.renderArgs)
+        scene.disable_render = False
+
+    def updateGeometry(self, coords, scene):
+        self.coords = np.asarray(coords, dtype=float)
+        if self.sceneObject is None:
+            self.draw(scene)
+            return
+        if not _setPointsInPlace(self.sceneObject, self.coords):
+            d = self.coords
+            self.sceneObject.mlab_source.reset(x=d[:, 0], y=d[:, 1], z=d[:, 2])
+        scene.render()
+
+
+class CachedFieldworkModel(_CachedSceneObject):
+    """Triangulated surface of a geometric_field drawn once. New field
+    parameters only overwrite the vertex coordinates of the existing
+    polydata, evaluated with the cached tessellation of the mesh topology;
+    the triangulation is kept while the topology is unchanged.
+    """
+    typeName = 'fieldworkmodel'
+
+    def __init__(self, name, GF, GD, renderArgs=None):
+        super(CachedFieldworkModel, self).__init__(name, renderArgs)
+        self.GD = list(GD)
+        self._setModel(GF)
+
+    def _setModel(self, GF):
+        self.GF = GF
+        self.tessellation = getTessellation(GF, self.GD)
+        self.T = self.tessellation.T
+        self.P = self.tessellation.evaluate(GF.get_field_parameters())
+
+    def draw(self, scene):
+        if self.sceneObject is not None:
+            self.setVisibility(True)
+            return
+        scene.disable_render = True
+        P = self.P
+        self.sceneObject = scene.mlab.triangular_mesh(P[:, 0], P[:, 1], P[:, 2], self.T,
+                                                      name=self.name, **self.renderArgs)
+        scene.disable_render = False
+
+    def setModel(self, GF, scene):
+        """Show a different geometric_field. The existing actor is updated
+        in place if the triangulation is unchanged, else it is redrawn.
+        """
+        tessellation = self.tessellation
+        self._setModel(GF)
+        if self.sceneObject is None:
+            return
+        if tessellation is self.tessellation:
+            _setPointsInPlace(self.sceneObject, self.P)
+            scene.render()
+        else:
+            visible = self.visible
+            self.remove()
+            self.draw(scene)
+            self.setVisibility(visible)
+
+    def updateGeometry(self, params, scene):
+        """Set the field parameters of the model and update the vertex
+        coordinates of the drawn surface in place.
+        """
+        params = np.asarray(params, dtype=float)
+        self.GF.set_field_parameters(params.reshape((3, -1, 1)))
+        self.P = self.tessellation.evaluate(params)
+        if self.sceneObject is None:
+            self.draw(scene)
+            return
+        _setPointsInPlace(self.sceneObject, self.P)
+        scene.render()
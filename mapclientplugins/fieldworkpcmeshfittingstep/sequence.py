@@ -0,0 +1,111 @@
+'''
+Fitting of one mesh to an ordered sequence of point clouds, e.g. the
+frames of dynamic CT or MRI, with each frame starting from the solution of
+the previous one.
+'''
+import collections
+import collections.abc
+import time
+
+import numpy as np
+
+from mapclientplugins.fieldworkpcmeshfittingstep import fitting
+from mapclientplugins.fieldworkpcmeshfittingstep import objectives
+from mapclientplugins.fieldworkpcmeshfittingstep import optimisers
+
+
+def isSequence(data):
+    """True if data is a sequence of point clouds rather than one cloud: a
+    list or tuple of clouds, a (frames, n, 3) array or an iterator of
+    clouds.
+    """
+    if isinstance(data, np.ndarray):
+        return data.ndim == 3
+    if isinstance(data, (list, tuple)):
+        return len(data) > 0 and np.ndim(data[0]) == 2
+    return isinstance(data, collections.abc.Iterator)
+
+
+class SequenceFitter(object):
+    """Fits a shape model to each cloud of a sequence in order. The surface
+    evaluator and shape model are built once and shared by all frames, and
+    each frame starts from the fitted parameters of the previous frame.
+    Full results are only kept for the last window frames. An automatic
+    surface discretisation is chosen from the first frame.
+    """
+
+    def __init__(self, GF, pc, plan, window=10):
+        self.GF = GF
+        self.pc = pc
+        self.plan = plan
+        self.window = window
+        self.evaluator = None
+        if plan.GD is not None:
+            self.evaluator = objectives.makeSurfaceEvaluator(GF, plan.GD, plan.nThreads)
+        self.model = optimisers.RigidModesModel(pc, plan.fitModes, plan.fitScale)
+        self.recent = collections.deque(maxlen=window if window > 0 else None)
+        self.budgetExhausted = False
+
+    def _frameWeights(self, dataWeights, frame):
+        if dataWeights is None:
+            return None
+        if isinstance(dataWeights, (list, tuple)) or np.ndim(dataWeights) == 2:
+            return dataWeights[frame]
+        return dataWeights
+
+    def fit(self, frames, x0, dataWeights=None):
+        """Fit each cloud of frames in order. Yields a result per frame as
+        soon as it is fitted.
+
+        inputs
+        ------
+        frames : iterable of (n, 3) arrays. Frames are read one at a time
+            so it can be a generator that loads them lazily.
+        x0 : initial parameters of the first frame.
+        dataWeights : optional array of point weights used for every frame,
+            or a list of arrays with one per frame.
+
+        yields
+        ------
+        result : dict of the frame index ('frame'), the fitted parameters
+            ('xOpt') and flattened nodal parameters ('POpt'), the squared
+            errors ('errors'), the RMS error ('rmse'), the
+            errorstats.ErrorStatistics of the errors ('errorStatistics')
+            and the optimiser info ('info'). The batch time limit of the plan applies to the
+            whole sequence; frames after it runs out are not fitted and
+            budgetExhausted is set.
+        """
+        plan = self.plan
+        batchDeadline = plan.batchDeadline()
+        self.recent.clear()
+        self.budgetExhausted = False
+        x = x0
+        for frame, data in enumerate(frames):
+            if batchDeadline is not None and time.time() > batchDeadline:
+                print('WARNING: sequence fit stopped by the batch time limit at frame {}'.format(frame))
+                self.budgetExhausted = True
+                return
+            data = np.asarray(data, dtype=float)
+            if self.evaluator is None:
+                self.plan = plan = plan.withDiscretisation(self.GF, data)
+                self.evaluator = objectives.makeSurfaceEvaluator(self.GF, plan.GD, plan.nThreads)
+            context = fitting.FitContext(plan, self.GF, self.pc, data,
+                                         self._frameWeights(dataWeights, frame),
+                                         evaluator=self.evaluator, model=self.model)
+            xOpt, POpt, errors, rmse, info = context.fit(x, batchDeadline)
+            result = {
+                'frame': frame,
+                'xOpt': xOpt,
+                'POpt': POpt,
+                'errors': errors,
+                'rmse': rmse,
+                'errorStatistics': context.errorStatistics,
+                'info': info,
+            }
+            self.recent.append(result)
+            print('frame {}: rms error {:.4f}'.format(frame, rmse))
+            x = xOpt
+            # the landmarks do not move with the frames, so only the first
+            # frame starts from the landmark fit
+            plan = plan.withoutLandmarkFit()
+            yield result
@@ -0,0 +1,76 @@
+'''
+Distribution of a shape model to worker processes through memory-mapped
+files. The mean, modes and variance arrays are written once and every
+worker maps the same pages read-only instead of unpickling its own copy.
+'''
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from gias3.learning.PCA import PrincipalComponents
+
+# arrays of a PrincipalComponents needed for fitting
+_pcArrays = ('mean', 'weights', 'modes', 'SD')
+
+# shape models attached in this process, keyed by directory
+_attached = {}
+
+
+class PCHandle(object):
+    """Picklable reference to a shape model published by SharedPC.
+    """
+
+    def __init__(self, directory, names, sdNorm):
+        self.directory = directory
+        self.names = tuple(names)
+        self.sdNorm = sdNorm
+
+    def attach(self):
+        """Return a PrincipalComponents whose arrays are read-only memory
+        maps of the published files. Repeat calls in a process return the
+        same object.
+        """
+        pc = _attached.get(self.directory)
+        if pc is None:
+            arrays = {name: np.load(os.path.join(self.directory, name + '.npy'), mmap_mode='r')
+                      for name in self.names}
+            pc = PrincipalComponents(**arrays)
+            pc.sdNorm = self.sdNorm
+            _attached[self.directory] = pc
+        return pc
+
+
+class SharedPC(object):
+    """Publishes the arrays of a PrincipalComponents to .npy files in a
+    temporary directory for workers to attach with handle.attach(). The
+    files are removed on close, or on leaving a with block.
+
+    inputs
+    ------
+    pc : PrincipalComponents to publish.
+    directory : optional parent directory of the files. Defaults to the
+        system temporary directory.
+    """
+
+    def __init__(self, pc, directory=None):
+        self.directory = tempfile.mkdtemp(prefix='fwpcfit-pc-', dir=directory)
+        names = []
+        for name in _pcArrays:
+            a = getattr(pc, name, None)
+            if a is None or np.ndim(a) == 0:
+                continue
+            np.save(os.path.join(self.directory, name + '.npy'), np.ascontiguousarray(a))
+            names.append(name)
+        self.handle = PCHandle(self.directory, names, getattr(pc, 'sdNorm', False))
+
+    def close(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,19 +1,32 @@
 '''
 MAP Client Plugin Step
 '''
+import datetime
 import json
+import os
+import time
 
 from PySide6 import QtGui
 
 from mapclient.mountpoints.workflowstep import WorkflowStepMountPoint
 from mapclientplugins.fieldworkpcmeshfittingstep.configuredialog import ConfigureDialog
 from mapclientplugins.fieldworkpcmeshfittingstep.mayavipcmeshfittingviewerwidget import MayaviPCMeshFittingViewerWidget
+from mapclientplugins.fieldworkpcmeshfittingstep import errorstats
+from mapclientplugins.fieldworkpcmeshfittingstep import fitexport
+from mapclientplugins.fieldworkpcmeshfittingstep import fitplan
+from mapclientplugins.fieldworkpcmeshfittingstep import fitting
+from mapclientplugins.fieldworkpcmeshfittingstep import jobqueue
+from mapclientplugins.fieldworkpcmeshfittingstep import landmarkfit
+from mapclientplugins.fieldworkpcmeshfittingstep import memprofile
+from mapclientplugins.fieldworkpcmeshfittingstep import multifit
+from mapclientplugins.fieldworkpcmeshfittingstep import objectives
+from mapclientplugins.fieldworkpcmeshfittingstep import optimisers
+from mapclientplugins.fieldworkpcmeshfittingstep import qasnapshots
+from mapclientplugins.fieldworkpcmeshfittingstep import sequence
+from mapclientplugins.fieldworkpcmeshfittingstep import sweep
 
 import copy
 import numpy as np
-from gias3.fieldwork.field import geometric_field_fitter as GFF
-from gias3.learning import PCA_fitting
-from gias3.musculoskeletal import fw_model_landmarks
 from gias3.mapclientpluginutilities.datatypes import transformations
 
 
@@ -23,7 +36,8 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
     for new steps.
     '''
 
-    _distModes = ('DPEP', 'EPDP')
+    _distModes = objectives.DIST_MODES
+    _optimisers = optimisers.OPTIMISERS
 
     _configDefaults = {}
     _configDefaults['identifier'] = ''
@@ -37,6 +51,25 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
     _configDefaults['N Closest Points'] = '1'
     _configDefaults['Landmarks'] = ''
     _configDefaults['Landmark Weights'] = ''
+    _configDefaults['Optimiser'] = 'PCFit'
+    _configDefaults['Threads'] = '1'
+    _configDefaults['Multi-Bone Rounds'] = '5'
+    _configDefaults['Max Fit Time'] = '0'
+    _configDefaults['Max Batch Time'] = '0'
+    _configDefaults['Objective Tolerance'] = '0'
+    _configDefaults['RMSE Plateau'] = '0'
+    _configDefaults['Mode Change Tolerance'] = ''
+    _configDefaults['Stagnation Window'] = '50'
+    _configDefaults['Pre-Alignment Iterations'] = '0'
+    _configDefaults['Modes per Stage'] = '0'
+    _configDefaults['Landmark Fit'] = 'None'
+    _configDefaults['QA Snapshots'] = ''
+    _configDefaults['Viewer Max Points'] = '200000'
+    _configDefaults['Fit Export'] = ''
+    _configDefaults['Sequence Window'] = '10'
+    _configDefaults['Job Queue'] = ''
+    _configDefaults['Job Max Attempts'] = '3'
+    _configDefaults['Checkpoint Interval'] = '100'
     _configDefaults['GUI'] = True
 
     def __init__(self, location):
@@ -96,6 +129,11 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
                       'http://physiomeproject.org/workflow/1.0/rdf-schema#provides',
                       'numpy#array1d'))
 
+        # fit report (dict)
+        self.addPort(('http://physiomeproject.org/workflow/1.0/rdf-schema#port',
+                      'http://physiomeproject.org/workflow/1.0/rdf-schema#provides',
+                      'python#dict'))
+
         self._config = {}
         for k, v in list(self._configDefaults.items()):
             self._config[k] = v
@@ -110,186 +148,132 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
         self._T0 = None
         self._TFitted = None
         self._fitErrors = None
+        self._fitReport = None
         self._fitter = None
         self._landmarks = None
         self._initModelState = 'input_model'
         self._x0FromInputModel = None
+        self._plan = None
+        self._planConfig = None
+        self._fitContext = None
 
         self._widget = None
 
-    def _parseLandmarkConfig(self):
-        config = self._config['Landmarks']
-        configWeights = self._config['Landmark Weights']
-        if len(config) == 0:
-            return None, None
-
-        landmarksMap = []
-        landmarkWeights = []
-        terms = config.strip().split(',')
-        termsWeights = configWeights.strip().split(',')
-        if len(terms) == 0:
-            raise ValueError('Malformed landmarks config. Terms must be comma separated')
-            # print 'ERROR: Malformed landmarks config. Terms must be comma separated'
-            # return None, None
-
-        if len(terms) != len(termsWeights):
-            raise ValueError('Malformed landmarks config. Mismatch in number of landmarks and weights')
-            # print 'ERROR: Malformed landmarks config. Mismatch in number of landmarks and weights'
-            # return None, None
-
-        for term, termWeight in zip(terms, termsWeights):
-            kv = term.split(':')
-            if len(kv) != 2:
-                raise ValueError('Malformed landmarks config. Key and values must be separated by :')
-                # print 'ERROR: Malformed landmarks config. Key and values must be separated by :'
-                # return None, None
-            try:
-                w = float(termWeight)
-            except ValueError:
-                raise ValueError('Malformed landmarks config. Bad landmark weight')
-                # print 'ERROR: Malformed landmarks config. Bad landmark weight'
-                # return None, None
-
-            landmarksMap.append([kv[0].strip(), self._landmarks[kv[1].strip()]])
-            landmarkWeights.append(w)
-
-        return landmarksMap, landmarkWeights
-
-    def _makeObj(self, gObjMaker, GD, nClosestPoints):
+    def _getPlan(self):
+        """Return the fit plan compiled from the current config. The config
+        is only parsed again if it has changed since the last fit.
         """
-        return an obj with weighting, and one without for rmse calculation
+        if self._plan is None or self._config != self._planConfig:
+            self._plan = fitplan.FitPlan.fromConfig(self._config)
+            self._planConfig = dict(self._config)
+        return self._plan.withLandmarks(self._landmarks)
+
+    def _getFitContext(self, plan):
+        """Return the fit context for the current inputs. The context of the
+        last fit is kept if only the data weights or optimiser settings have
+        changed, so a refit reuses its surface evaluator and data index and
+        resumes from its solution.
         """
-        dataObj = gObjMaker(self._GF, self._data, GD, self._dataWeights,
-                            n_closest_points=nClosestPoints)
-
-        dataObjNoWeights = gObjMaker(self._GF, self._data, GD,
-                                     n_closest_points=nClosestPoints)
-
-        # handle landmarks
-        ldMap, ldWeights = self._parseLandmarkConfig()
-        if ldMap is None:
-            return dataObj, dataObjNoWeights
+        context = self._fitContext
+        if context is not None and context.matches(plan, self._GF, self._pc, self._data):
+            context.update(plan, self._dataWeights)
         else:
-            ldObjs = []
-            for ldName, ldTarg in ldMap:
-                evaluator = fw_model_landmarks.makeLandmarkEvaluator(ldName, self._GF)
-                ldObjs.append(_makeLandmarkObj(ldTarg, evaluator))
-
-            def mainObj(P):
-                gE = dataObj(P)
-                P3 = P.reshape((3, -1))
-                ldE = np.array([f(P3) for f in ldObjs]) * ldWeights
-                # print ldE
-                return np.hstack([gE, ldE])
-
-            def mainObjNoWeights(P):
-                gE = dataObjNoWeights(P)
-                P3 = P.reshape((3, -1))
-                ldE = np.array([f(P3) for f in ldObjs])
-                return np.hstack([gE, ldE])
-
-            return mainObj, mainObjNoWeights
-
-    def _fit(self):
-
-        # parse parameters
-        if self._config['Distance Mode'] == 'DPEP':
-            gObjMaker = GFF.makeObjDPEP
-        elif self._config['Distance Mode'] == 'EPDP':
-            gObjMaker = GFF.makeObjEPDP
-        fitModes = np.arange(int(self._config['PCs to Fit']))
-        GD = [int(self._config['Surface Discretisation']), ] * 2
-        mWeight = float(self._config['Mahalanobis Weight'])
-        xtol = float(self._config['xtol'])
-        fitScale = self._config['Fit Scale']
-        nClosestPoints = int(self._config['N Closest Points'])
-        maxfev = int(self._config['Max Func Evaluations'])
-        reqNParams = 6 + len(fitModes)
-        if fitScale:
-            reqNParams += 1
+            context = fitting.FitContext(plan, self._GF, self._pc, self._data, self._dataWeights)
+            self._fitContext = context
+        return context
+
+    def _fit(self, checkpoint=None, resume=None):
+        """Fit the shape model to the data. checkpoint is an optional
+        (interval, callback) pair passed to the optimiser, and resume an
+        optional (x, nfev) checkpoint to continue a fit from.
+        """
+        plan = self._getPlan()
+        x0 = self._getX0()
+        nfevUsed = 0
+        if resume is not None:
+            x0, nfevUsed = resume
+            plan = plan.withEvaluationsUsed(nfevUsed)
+            print('resuming from a checkpoint after {} function evaluations'.format(nfevUsed))
 
         print('\nFitting with parameters:')
         print('Fit params:')
-        print(('Distance Mode: ' + self._config['Distance Mode']))
-        print(('PCs to Fit: ' + str(fitModes)))
-        print(('GF: ' + str(GD)))
-        print(('MWeight: ' + str(mWeight)))
-        print(('xtol: ' + str(xtol)))
-        print(('fit scale: ' + str(fitScale)))
-        print(('n closest points: ' + str(nClosestPoints)))
-        print(('maxfev: ' + str(maxfev)))
-        print(('landmarks: ' + str(self._config['Landmarks'])))
-        print(('landmark weights: ' + str(self._config['Landmark Weights'])))
-
-        # initialise fitter
-        PCFitter = PCA_fitting.PCFit()
-        PCFitter.setPC(self._pc)
-        PCFitter.xtol = xtol
-        obj, objNoWeights = self._makeObj(gObjMaker, GD, nClosestPoints)
-
-        # get initial transform
-        if (self._initModelState == 'input_transformation'):
-            if self._TFitted is not None:
-                x0 = self._TFitted.getT()
-            else:
-                x0 = self._T0.getT()
-        elif self._initModelState == 'input_model':
-            x0 = np.array(self._x0FromInputModel)
-
-        if len(x0) < reqNParams:
-            x0 = np.hstack([x0, np.zeros(reqNParams - len(x0))])
-        elif len(x0) > reqNParams:
-            x0 = x0[:reqNParams]
+        for line in plan.describe():
+            print(line)
 
         # fit
-        if fitScale == 'True':
-            GXOpt, GPOpt = PCFitter.rigidScaleModeNFit(obj, modes=fitModes[1:],
-                                                       x0=x0, m_weight=mWeight,
-                                                       maxfev=maxfev,
-                                                       )
+        if plan.landmarkFit == landmarkfit.ONLY:
+            GXOpt, GPOpt, self._fitErrors, self._RMSEFitted, info = fitting.fitLandmarks(
+                plan, self._GF, self._pc, x0, deadline=plan.fitDeadline()
+            )
         else:
-            GXOpt, GPOpt = PCFitter.rigidModeNFit(obj, modes=fitModes[1:],
-                                                  x0=x0, m_weight=mWeight,
-                                                  maxfev=maxfev,
-                                                  )
+            GXOpt, GPOpt, self._fitErrors, self._RMSEFitted, info = self._getFitContext(plan).fit(
+                x0, checkpoint=checkpoint, preAlign=resume is None
+            )
+        info['nfev'] += nfevUsed
+        self._fitReport = _makeFitReport(info)
         self._GF.set_field_parameters(GPOpt.copy().reshape((3, -1, 1)))
-        # error calculation
-        self._fitErrors = objNoWeights(GPOpt.copy())
-        self._RMSEFitted = np.sqrt(self._fitErrors.mean())
         # transform and GF
         self._TFitted = transformations.RigidPCModesTransform(GXOpt)
-        self._GFFitted = copy.deepcopy(self._GF)
+        with memprofile.stage('deep copies'):
+            self._GFFitted = copy.deepcopy(self._GF)
 
         print('fitted pc parameters', GXOpt)
         return self._GFFitted, self._TFitted, self._RMSEFitted, self._fitErrors
 
+    def _getX0(self):
+        """Initial fit parameters: the last fit or the input transform if
+        initialised by transform, else the fit to the input model.
+        """
+        if (self._initModelState == 'input_transformation'):
+            if self._TFitted is not None:
+                return self._TFitted.getT()
+            else:
+                return self._T0.getT()
+        elif self._initModelState == 'input_model':
+            return np.array(self._x0FromInputModel)
+
+    def _makeSweep(self, configs, nWorkers):
+        """Return a ParameterSweep of the current inputs over configs. Every
+        config is compiled first so that invalid values are reported before
+        any fit starts.
+        """
+        for c in configs:
+            fitplan.FitPlan.fromConfig(c, self._landmarks)
+        return sweep.ParameterSweep(self._GF, self._pc, self._data, self._getX0(),
+                                    self._dataWeights, self._landmarks, nWorkers)
+
+    def _loadSweepResult(self, result):
+        """Make a parameter sweep result the current fit.
+        """
+        self._GF.set_field_parameters(result['POpt'].copy().reshape((3, -1, 1)))
+        self._TFitted = transformations.RigidPCModesTransform(result['xOpt'])
+        self._GFFitted = copy.deepcopy(self._GF)
+        self._RMSEFitted = result['rmse']
+        self._fitErrors = result['errors']
+        self._fitReport = _makeFitReport(result['info'])
+        return self._GFFitted, self._TFitted, self._RMSEFitted, self._fitErrors
+
     def _initGF(self):
 
-        if self._T0 is not None:
-            self._initModelState = 'input_transformation'
-            self._initGFByInputTransform()
-        else:
-            self._initModelState = 'input_model'
-            self._initGFByInputModel()
+        with memprofile.stage('initialisation'):
+            if self._T0 is not None:
+                self._initModelState = 'input_transformation'
+                self._initGFByInputTransform()
+            else:
+                self._initModelState = 'input_model'
+                self._initGFByInputModel()
 
     def _initGFByInputModel(self):
         """Initialise the unfitted GF based on the input GF. Rigid or rigid+scale
         fit to the input GF to get initial translation, rotation, and scale (if scale fit)
         """
         print('initialising model by model')
-        mWeight = float(self._config['Mahalanobis Weight'])
-        pcModes = np.arange(int(self._config['PCs to Fit']))
-        targetPoints = self._GF.get_all_point_positions()
-        scale = (self._config['Fit Scale'] == 'True')
-
-        xOpt, nodesOpt = PCA_fitting.fitSSMTo3DPoints(
-            targetPoints, self._pc, pcModes, m_weight=mWeight,
-            do_scale=scale, verbose=False,
-        )[:2]
+        xOpt, nodesOpt = fitting.initFromModel(self._getPlan(), self._GF, self._pc)
 
         self._x0FromInputModel = xOpt
-        self._GF.set_field_parameters(nodesOpt.T[:, :, np.newaxis])
-        self._GFUnfitted = copy.deepcopy(self._GF)
+        self._GF.set_field_parameters(nodesOpt[:, :, np.newaxis])
+        with memprofile.stage('deep copies'):
+            self._GFUnfitted = copy.deepcopy(self._GF)
 
     def _initGFByInputTransform(self):
         """Initialise the unfitted GF based on the initial transformation parameters
@@ -297,39 +281,108 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
         """
         print('initialising model by transform')
         if self._T0 is not None:
-            T0 = self._T0.getT()
-            # apply shape model parameters
+            fitting.initFromTransform(self._getPlan(), self._GF, self._pc, self._T0.getT())
+            with memprofile.stage('deep copies'):
+                self._GFUnfitted = copy.deepcopy(self._GF)
+        else:
+            print('WARNING: no input transformations, nothing done')
 
-            if self._config['Fit Scale'] == 'True':
-                pcSDs = T0[7:]
-            else:
-                pcSDs = T0[6:]
-
-            if len(pcSDs) > 0:
-                pcModes = np.arange(int(self._config['PCs to Fit']))
-                reconParams = self._pc.reconstruct(
-                    self._pc.getWeightsBySD(pcModes, pcSDs),
-                    pcModes
-                ).reshape((3, -1, 1))
-                self._GF.field_parameters = reconParams
-            else:
-                reconParams = self._pc.reconstruct(
-                    self._pc.getWeightsBySD([0, ], [0.0, ]),
-                    [0, ]
-                ).reshape((3, -1, 1))
-                self._GF.set_field_parameters(reconParams)
-
-            # apply rigid or rigid+scale transform
-            if self._config['Fit Scale'] == 'True':
-                t = T0[:7]
-                self._GF.transformRigidScaleRotateAboutCoM(t)
-            else:
-                t = T0[:6]
-                self._GF.transformRigidRotateAboutCoM(t)
+    def _fitMultiBone(self):
+        """Fit a list of GFs and their list of PCs to the same point cloud.
+        Outputs are lists with one entry per bone.
+        """
+        if not isinstance(self._pc, (list, tuple)) or len(self._pc) != len(self._GF):
+            raise ValueError('Multi-bone fitting needs one principal components per fieldwork model')
 
-            self._GFUnfitted = copy.deepcopy(self._GF)
+        plan = self._getPlan()
+        fitter = multifit.MultiBoneFitter(self._data, self._GF, self._pc, plan,
+                                          dataWeights=self._dataWeights)
+
+        # initial parameters from input transforms if given, else from the
+        # input models
+        if isinstance(self._T0, (list, tuple)):
+            x0s = [T.getT() for T in self._T0]
         else:
-            print('WARNING: no input transformations, nothing done')
+            x0s = [fitting.initFromModel(plan, GF, pc)[0] for GF, pc in zip(self._GF, self._pc)]
+
+        xOpts, POpts, errors, labels, info = fitter.fit(x0s)
+        self._fitReport = _makeFitReport(info)
+
+        self._GFFitted = []
+        for GF, POpt in zip(self._GF, POpts):
+            GF.set_field_parameters(POpt.copy().reshape((3, -1, 1)))
+            self._GFFitted.append(copy.deepcopy(GF))
+        self._TFitted = [transformations.RigidPCModesTransform(xOpt) for xOpt in xOpts]
+        self._fitErrors = errors
+        self._RMSEFitted = info['rmses']
+        return self._GFFitted, self._TFitted, self._RMSEFitted, self._fitErrors
+
+    def _fitSequence(self):
+        """Fit the model to each cloud of a sequence in order, each frame
+        starting from the solution of the previous frame. Transforms and RMS
+        errors are output for every frame, fitted models and errors for the
+        last Sequence Window frames. If Fit Export is set, each frame is
+        written out as soon as it is fitted.
+        """
+        self._initGF()
+        plan = self._getPlan()
+        fitter = sequence.SequenceFitter(self._GF, self._pc, plan, int(self._config['Sequence Window']))
+
+        exportDir = self._config['Fit Export']
+        if exportDir:
+            if not os.path.isdir(exportDir):
+                os.makedirs(exportDir)
+            exportPrefix = self._outputPrefix(exportDir)
+
+        t0 = time.time()
+        self._TFitted = []
+        self._RMSEFitted = []
+        nfev = 0
+        budgetExhausted = False
+        frameStopReasons = []
+        exports = []
+        # errors of all frames, summarised without keeping them
+        errorStatistics = errorstats.ErrorStatistics()
+        for result in fitter.fit(self._data, self._getX0(), self._dataWeights):
+            info = result['info']
+            self._TFitted.append(transformations.RigidPCModesTransform(result['xOpt']))
+            self._RMSEFitted.append(result['rmse'])
+            errorStatistics.merge(result['errorStatistics'])
+            nfev += info['nfev']
+            budgetExhausted = budgetExhausted or info['budgetExhausted']
+            frameStopReasons.append(info['stopReason'])
+            if exportDir:
+                filename = '{}_frame{}{}'.format(exportPrefix, result['frame'], fitexport.SUFFIX)
+                fitexport.writeFitResult(filename, result['xOpt'], result['POpt'], result['errors'],
+                                         self._config, _makeFitReport(info))
+                exports.append(filename)
+
+        self._GFFitted = []
+        self._fitErrors = []
+        for result in fitter.recent:
+            self._GF.set_field_parameters(result['POpt'].copy().reshape((3, -1, 1)))
+            self._GFFitted.append(copy.deepcopy(self._GF))
+            self._fitErrors.append(result['errors'])
+
+        nFrames = len(self._TFitted)
+        if fitter.budgetExhausted:
+            stopReason = 'time budget'
+        else:
+            stopReason = 'completed'
+        self._fitReport = _makeFitReport({
+            'nfev': nfev,
+            'time': time.time() - t0,
+            'budgetExhausted': budgetExhausted or fitter.budgetExhausted,
+            'stopReason': stopReason,
+            'message': 'sequence fit of {} frames ({})'.format(nFrames, stopReason),
+            'frameStopReasons': frameStopReasons,
+            'surfaceDiscretisation': fitter.plan.GD,
+            'errorStatistics': errorStatistics.summary(),
+        })
+        if exports:
+            self._fitReport['fit exports'] = exports
+        print('sequence fit: {} frames, {} function evaluations in {:.2f} s'.format(
+            nFrames, nfev, self._fitReport['fit time']))
 
     def execute(self):
         '''
@@ -338,32 +391,195 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
         may be connected up to a button in a widget for example.
         '''
 
+        # several models to fit to the same cloud
+        if isinstance(self._GF, (list, tuple)):
+            if self._config['GUI']:
+                print('WARNING: no GUI for multi-bone fitting, fitting without GUI')
+            self._fitMultiBone()
+            self._writeQASnapshots()
+            self._exportFit()
+            self._doneExecution()
+            return
+
+        # one model fitted to a sequence of clouds
+        if sequence.isSequence(self._data):
+            if self._config['GUI']:
+                print('WARNING: no GUI for sequence fitting, fitting without GUI')
+            self._fitSequence()
+            self._doneExecution()
+            return
+
         # initialise unfitted model
         self._initGF()
 
+        gui = self._config['GUI']
+        if gui and self._data is None:
+            # only a landmark-only fit runs without a point cloud, and the
+            # viewer needs one
+            print('WARNING: no point cloud to show, fitting to the landmarks without GUI')
+            gui = False
+
         # Put your execute step code here before calling the '_doneExecution' method.
-        if self._config['GUI']:
-            self._widget = MayaviPCMeshFittingViewerWidget(
-                self._data,
-                self._GFUnfitted,
-                self._config,
-                self._fit,
-                self._reset,
-                self._distModes,
-                self._landmarks)
-
-            # self._widget._ui.registerButton.clicked.connect(self._register)
-            self._widget._ui.acceptButton.clicked.connect(self._doneExecution)
-            self._widget._ui.abortButton.clicked.connect(self._abort)
-            self._widget._ui.resetButton.clicked.connect(self._reset)
+        if gui:
+            if self._widget is None:
+                self._widget = MayaviPCMeshFittingViewerWidget(
+                    self._data,
+                    self._GFUnfitted,
+                    self._config,
+                    self._fit,
+                    self._reset,
+                    self._distModes,
+                    self._optimisers,
+                    self._landmarks,
+                    sweepFunc=self._makeSweep,
+                    sweepLoadFunc=self._loadSweepResult)
+
+                # self._widget._ui.registerButton.clicked.connect(self._register)
+                self._widget._ui.acceptButton.clicked.connect(self._accept)
+                self._widget._ui.abortButton.clicked.connect(self._abort)
+                self._widget._ui.resetButton.clicked.connect(self._reset)
+            else:
+                # reuse the scene of the previous execution
+                self._widget.reload(self._data, self._GFUnfitted, self._config, self._landmarks)
             self._widget.setModal(True)
             self._setCurrentWidget(self._widget)
 
+        elif self._config['Job Queue']:
+            self._fitJob()
+            self._doneExecution()
         else:
             self._fit()
-            self.GFFitted = copy.deepcopy(self._GF)
+            self._writeQASnapshots()
+            self._exportFit()
             self._doneExecution()
 
+    def _jobId(self):
+        """Id of the fit job of the current inputs and config: the step
+        identifier and a digest of everything the fit depends on.
+        """
+        config = {k: self._config[k] for k in fitplan.FIT_CONFIG_KEYS}
+        landmarks = None
+        if self._landmarks is not None:
+            landmarks = {k: np.asarray(v).tolist() for k, v in self._landmarks.items()}
+        if self._T0 is not None:
+            x0 = self._T0.getT()
+        else:
+            x0 = self._x0FromInputModel
+        return '{}_{}'.format(self._config['identifier'], jobqueue.digest(
+            np.asarray(self._data, dtype=float),
+            self._GFUnfitted.get_field_parameters(),
+            np.asarray(self._pc.mean), np.asarray(self._pc.weights), np.asarray(self._pc.modes),
+            np.asarray(x0, dtype=float),
+            None if self._dataWeights is None else np.asarray(self._dataWeights, dtype=float),
+            landmarks,
+            config,
+        ))
+
+    def _fitJob(self):
+        """Fit without the GUI as a job of the Job Queue directory. If the job
+        is already done its result is loaded instead of fitting again. An
+        interrupted fit resumes from its last checkpoint, and a failed fit
+        is retried until Job Max Attempts is reached.
+        """
+        queue = jobqueue.JobQueue(self._config['Job Queue'], int(self._config['Job Max Attempts']))
+        jobId = self._jobId()
+        if queue.isDone(jobId):
+            print('job {} already done, loading its result'.format(jobId))
+            self._loadJobResult(queue, jobId)
+            return
+        if not queue.canRun(jobId):
+            record = queue.state(jobId)
+            raise RuntimeError('job {} failed {} times, last error: {}'.format(
+                jobId, record['attempts'], record['error']))
+
+        def run():
+            resume = queue.loadCheckpoint(jobId)
+            nfevUsed = 0 if resume is None else resume[1]
+            interval = int(self._config['Checkpoint Interval'])
+            checkpoint = (interval, lambda x, nfev: queue.saveCheckpoint(jobId, x, nfevUsed + nfev))
+
+            self._fit(checkpoint=checkpoint, resume=resume)
+            self._writeQASnapshots()
+            self._exportFit()
+            queue.writeResult(jobId, lambda filename: fitexport.writeFitResult(
+                filename, self._TFitted.getT(), self._GFFitted.get_field_parameters(),
+                self._fitErrors, self._config, self._fitReport))
+            return {'rmse': float(self._RMSEFitted), 'report': self._fitReport}
+
+        queue.run(jobId, run)
+
+    def _loadJobResult(self, queue, jobId):
+        """Make the stored result of a done job the current fit.
+        """
+        result = fitexport.readFitResult(queue.resultFile(jobId), mmap=False)
+        record = queue.state(jobId)
+        self._GF.set_field_parameters(np.array(result['P'], dtype=float).reshape((3, -1, 1)))
+        self._TFitted = transformations.RigidPCModesTransform(np.array(result['x'], dtype=float))
+        self._GFFitted = copy.deepcopy(self._GF)
+        self._fitErrors = np.array(result['errors'], dtype=float)
+        self._RMSEFitted = record['rmse']
+        self._fitReport = record['report']
+
+    def _accept(self):
+        self._exportFit()
+        self._doneExecution()
+
+    def _outputPrefix(self, outputDir):
+        return os.path.join(outputDir, '{}_{}'.format(
+            self._config['identifier'], datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')))
+
+    def _exportFit(self):
+        """Write the last fit to a binary fit result file in the Fit Export
+        directory, if set. Multi-bone fits are written to one file per bone.
+        The files are listed in the fit report.
+        """
+        outputDir = self._config['Fit Export']
+        if not outputDir or self._TFitted is None:
+            return
+        if not os.path.isdir(outputDir):
+            os.makedirs(outputDir)
+
+        outputPrefix = self._outputPrefix(outputDir)
+        if isinstance(self._TFitted, (list, tuple)):
+            fits = [('{}_bone{}'.format(outputPrefix, i), T, GF, errors)
+                    for i, (T, GF, errors) in enumerate(zip(self._TFitted, self._GFFitted, self._fitErrors))]
+        else:
+            fits = [(outputPrefix, self._TFitted, self._GFFitted, self._fitErrors)]
+
+        report = dict(self._fitReport or {})
+        filenames = []
+        for prefix, T, GF, errors in fits:
+            filename = prefix + fitexport.SUFFIX
+            fitexport.writeFitResult(filename, T.getT(), GF.get_field_parameters(), errors,
+                                     self._config, report)
+            filenames.append(filename)
+        if self._fitReport is not None:
+            self._fitReport['fit exports'] = filenames
+        print('Fit results written to {}'.format(outputDir))
+
+    def _writeQASnapshots(self):
+        """Render offscreen snapshots of the last fit to the QA Snapshots
+        directory, if set. The image files are listed in the fit report.
+        """
+        outputDir = self._config['QA Snapshots']
+        if not outputDir:
+            return
+
+        outputPrefix = self._outputPrefix(outputDir)
+        if isinstance(self._fitErrors, np.ndarray):
+            errors = self._fitErrors
+        else:
+            errors = None
+        data = self._data
+        if data is None:
+            # landmark-only fit, show the landmark targets
+            data = self._getPlan().landmarkTargets
+        filenames = qasnapshots.getRenderer().render(
+            outputPrefix, data, self._GFUnfitted, self._GFFitted, errors
+        )
+        self._fitReport['qa snapshots'] = filenames
+        print('QA snapshots written to {}'.format(outputDir))
+
     def _abort(self):
         # self._doneExecution()
         raise RuntimeError('mesh fitting aborted')
@@ -373,7 +589,10 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
         self._TFitted = None
         self._RMSEFitted = None
         self._fitErrors = None
+        self._fitReport = None
         self._GF = copy.deepcopy(self._GFUnfitted)
+        if self._fitContext is not None:
+            self._fitContext.resetSolution()
 
     def setPortData(self, index, dataIn):
         '''
@@ -384,19 +603,24 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
 
         ######## TODO  BELOW  #############
 
-        if index == 0:
-            self._data = np.array(dataIn, dtype=float)  # ju#pointcoordinates
-        elif index == 1:
-            self._GF = dataIn  # ju#fieldworkmodel
-            self._GFUnfitted = copy.deepcopy(self._GF)
-        elif index == 2:
-            self._pc = dataIn  # ju#principalcomponents
-        elif index == 3:
-            self._T0 = dataIn  # transform list
-        elif index == 4:
-            self._dataWeights = np.array(dataIn, dtype=float)  # numpyarray1d - dataWeights
-        else:
-            self._landmarks = dataIn  # landmarks dictionary
+        with memprofile.stage('port ingestion'):
+            if index == 0:
+                if sequence.isSequence(dataIn):
+                    self._data = dataIn  # sequence of pointcoordinates
+                else:
+                    self._data = np.array(dataIn, dtype=float)  # ju#pointcoordinates
+            elif index == 1:
+                self._GF = dataIn  # ju#fieldworkmodel
+                with memprofile.stage('deep copies'):
+                    self._GFUnfitted = copy.deepcopy(self._GF)
+            elif index == 2:
+                self._pc = dataIn  # ju#principalcomponents
+            elif index == 3:
+                self._T0 = dataIn  # transform list
+            elif index == 4:
+                self._dataWeights = np.array(dataIn, dtype=float)  # numpyarray1d - dataWeights
+            else:
+                self._landmarks = dataIn  # landmarks dictionary
 
     def getPortData(self, index):
         '''
@@ -410,8 +634,10 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
             return self._TFitted  # ju#geometrictransform
         elif index == 8:
             return self._RMSEFitted  # float
-        else:
+        elif index == 9:
             return self._fitErrors  # numpyarray1d
+        else:
+            return self._fitReport  # dict
 
     def configure(self):
         '''
@@ -421,7 +647,7 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
         then set:
             self._configured = True
         '''
-        dlg = ConfigureDialog(self._distModes, self._main_window)
+        dlg = ConfigureDialog(self._distModes, self._optimisers, self._main_window)
         dlg.identifierOccursCount = self._identifierOccursCount
         dlg.setConfig(self._config)
         dlg.validate()
@@ -470,15 +696,34 @@ class FieldworkPCMeshFittingStep(WorkflowStepMountPoint):
         elif self._config['GUI'] == 'False':
             self._config['GUI'] = False
 
-        d = ConfigureDialog(self._distModes)
+        d = ConfigureDialog(self._distModes, self._optimisers)
         d.identifierOccursCount = self._identifierOccursCount
         d.setConfig(self._config)
         self._configured = d.validate()
 
 
-def _makeLandmarkObj(targ, evaluator):
-    def obj(P):
-        # print targ
-        return ((targ - evaluator(P)) ** 2.0).sum()
-
-    return obj
+def _makeFitReport(info):
+    """Summary of a fit for the fit report port.
+    """
+    report = {
+        'function evaluations': info['nfev'],
+        'fit time': info['time'],
+        'budget exhausted': info['budgetExhausted'],
+        'stop reason': info['stopReason'],
+        'message': info['message'],
+    }
+    if 'boneStopReasons' in info:
+        report['bone stop reasons'] = info['boneStopReasons']
+    if 'frameStopReasons' in info:
+        report['frame stop reasons'] = info['frameStopReasons']
+    if 'surfaceDiscretisation' in info:
+        report['surface discretisation'] = info['surfaceDiscretisation']
+    if 'errorStatistics' in info:
+        report['error statistics'] = info['errorStatistics']
+    if 'preAlignment' in info:
+        report['pre-alignment'] = info['preAlignment']
+    if 'modeStages' in info:
+        report['mode stages'] = info['modeStages']
+    if 'landmarkInitialisation' in info:
+        report['landmark initialisation'] = info['landmarkInitialisation']
+    return report
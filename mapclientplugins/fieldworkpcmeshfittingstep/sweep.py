@@ -0,0 +1,152 @@
+'''
+Parameter sweeps: fits of one set of inputs over a grid of configurations,
+run in a pool of worker processes.
+'''
+import itertools
+import multiprocessing
+import os
+import runpy
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from mapclientplugins.fieldworkpcmeshfittingstep import fitplan
+from mapclientplugins.fieldworkpcmeshfittingstep import fitting
+from mapclientplugins.fieldworkpcmeshfittingstep import objectives
+from mapclientplugins.fieldworkpcmeshfittingstep import sharedpc
+
+# config items that can be swept, in the order they vary in the grid
+SWEEP_KEYS = ('Distance Mode', 'PCs to Fit', 'Mahalanobis Weight', 'Surface Discretisation')
+
+# inputs of the fits, set once per worker process
+_workerInputs = None
+
+
+def parseRange(value, cast=float):
+    """Parse a sweep range. Either comma separated values, e.g. 0.1, 0.5,
+    or start:stop:step with stop included, e.g. 2:10:2. Returns a list of
+    the values as strings.
+    """
+    value = value.strip()
+    if len(value) == 0:
+        return []
+    if ':' in value:
+        try:
+            start, stop, step = (cast(v) for v in value.split(':'))
+        except ValueError:
+            raise ValueError('Malformed range {}. Ranges must be start:stop:step'.format(value))
+        if step <= 0:
+            raise ValueError('Range step must be positive')
+        n = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return [str(cast(start + i * step)) for i in range(max(n, 0))]
+    try:
+        return [str(cast(v.strip())) for v in value.split(',')]
+    except ValueError:
+        raise ValueError('Malformed range {}. Values must be comma separated'.format(value))
+
+
+def expandGrid(config, ranges):
+    """Return one config per combination of the swept values.
+
+    inputs
+    ------
+    config : base step config. Items not swept are taken from it.
+    ranges : dict of config item to a list of values. Items with no values
+        keep their value in config.
+
+    returns
+    -------
+    configs : list of config dicts.
+    """
+    keys = [k for k in SWEEP_KEYS if ranges.get(k)]
+    configs = []
+    for values in itertools.product(*[ranges[k] for k in keys]):
+        c = dict(config)
+        c.update(zip(keys, values))
+        # fits run in parallel, so each uses a single thread
+        c['Threads'] = '1'
+        configs.append(c)
+    return configs
+
+
+# script run by each worker process before any fit, see sweepworker
+_workerScript = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sweepworker.py')
+
+
+def _initWorker(GF, pcHandle, data, x0, dataWeights, landmarks):
+    global _workerInputs
+    pc = sharedpc.PCHandle(*pcHandle).attach()
+    _workerInputs = (GF, pc, data, x0, dataWeights, landmarks)
+
+
+def _fitConfig(config):
+    GF, pc, data, x0, dataWeights, landmarks = _workerInputs
+    plan = fitplan.FitPlan.fromConfig(config, landmarks)
+    t0 = time.perf_counter()
+    xOpt, POpt, fitErrors, rmse, info = fitting.fit(plan, GF, pc, data, x0, dataWeights)
+    return {
+        'xOpt': xOpt,
+        'POpt': POpt,
+        'errors': fitErrors,
+        'rmse': rmse,
+        'mean': fitErrors.mean(),
+        'sd': fitErrors.std(),
+        'time': time.perf_counter() - t0,
+        'info': info,
+    }
+
+
+class ParameterSweep(object):
+    """Fits of a shape model to a point cloud over a list of configs in a
+    pool of worker processes. The inputs are sent to each worker once,
+    except for the shape model which is published to memory-mapped files
+    that all workers share (see sharedpc).
+    """
+
+    def __init__(self, GF, pc, data, x0, dataWeights=None, landmarks=None, nWorkers=0):
+        self.inputs = (GF, pc, data, x0, dataWeights, landmarks)
+        self.nWorkers = nWorkers
+        self._cancelled = False
+
+    def cancel(self):
+        """Stop after the fits already running. Fits not yet started are
+        dropped.
+        """
+        self._cancelled = True
+
+    def run(self, configs):
+        """Fit each config. Yields (index of the config, result) as each fit
+        finishes. A result is a dict of xOpt, POpt, errors, rmse, mean, sd,
+        time and info, or of error with the message of the exception raised
+        by the fit.
+        """
+        self._cancelled = False
+        nWorkers = min(objectives.resolveThreads(self.nWorkers), len(configs))
+        if nWorkers == 0:
+            return
+        GF, pc, data, x0, dataWeights, landmarks = self.inputs
+        # workers are spawned rather than forked as the parent may be
+        # running a GUI. They start from sweepworker, which imports only the
+        # fitting modules, so the shape model handle is passed as its fields.
+        with sharedpc.SharedPC(pc) as sharedPC:
+            handle = sharedPC.handle
+            workerArgs = (GF, (handle.directory, handle.names, handle.sdNorm), data, x0,
+                          dataWeights, landmarks)
+            with ProcessPoolExecutor(max_workers=nWorkers,
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=runpy.run_path,
+                                     initargs=(_workerScript, {'workerArgs': workerArgs})
+                                     ) as executor:
+                futures = {executor.submit(_fitConfig, c): i for i, c in enumerate(configs)}
+                for future in as_completed(futures):
+                    if self._cancelled:
+                        for f in futures:
+                            f.cancel()
+                    if future.cancelled():
+                        continue
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {'error': str(e)}
+                    yield futures[future], result
@@ -0,0 +1,25 @@
+'''
+Start-up of parameter sweep worker processes, run with runpy.run_path as
+the initializer of the process pool. The package __init__ imports the
+step, and with it Qt and the viewer, which workers do not need. Before
+importing the sweep module this registers the package without running
+its __init__, so a worker imports only the fitting modules.
+
+The initializer arguments are in workerArgs. They must be plain data
+that unpickles without importing this package, as they are unpickled
+before this runs.
+'''
+import os
+import sys
+import types
+
+_packageName = 'mapclientplugins.fieldworkpcmeshfittingstep'
+
+if _packageName not in sys.modules:
+    _package = types.ModuleType(_packageName)
+    _package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules[_packageName] = _package
+
+from mapclientplugins.fieldworkpcmeshfittingstep import sweep
+
+sweep._initWorker(*workerArgs)
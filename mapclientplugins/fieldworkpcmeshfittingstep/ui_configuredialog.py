@@ -97,12 +97,12 @@ class Ui_Dialog(object):
         self.label14 = QLabel(self.configGroupBox)
         self.label14.setObjectName(u"label14")
 
-        self.formLayout.setWidget(12, QFormLayout.LabelRole, self.label14)
+        self.formLayout.setWidget(31, QFormLayout.LabelRole, self.label14)
 
         self.checkBoxGUI = QCheckBox(self.configGroupBox)
         self.checkBoxGUI.setObjectName(u"checkBoxGUI")
 
-        self.formLayout.setWidget(12, QFormLayout.FieldRole, self.checkBoxGUI)
+        self.formLayout.setWidget(31, QFormLayout.FieldRole, self.checkBoxGUI)
 
         self.checkBoxFitSize = QCheckBox(self.configGroupBox)
         self.checkBoxFitSize.setObjectName(u"checkBoxFitSize")
@@ -159,6 +159,196 @@ class Ui_Dialog(object):
 
         self.formLayout.setWidget(11, QFormLayout.FieldRole, self.lineEditLandmarkWeights)
 
+        self.label15 = QLabel(self.configGroupBox)
+        self.label15.setObjectName(u"label15")
+
+        self.formLayout.setWidget(12, QFormLayout.LabelRole, self.label15)
+
+        self.comboBoxOptimiser = QComboBox(self.configGroupBox)
+        self.comboBoxOptimiser.setObjectName(u"comboBoxOptimiser")
+
+        self.formLayout.setWidget(12, QFormLayout.FieldRole, self.comboBoxOptimiser)
+
+        self.label16 = QLabel(self.configGroupBox)
+        self.label16.setObjectName(u"label16")
+
+        self.formLayout.setWidget(13, QFormLayout.LabelRole, self.label16)
+
+        self.spinBoxThreads = QSpinBox(self.configGroupBox)
+        self.spinBoxThreads.setObjectName(u"spinBoxThreads")
+
+        self.formLayout.setWidget(13, QFormLayout.FieldRole, self.spinBoxThreads)
+
+        self.label17 = QLabel(self.configGroupBox)
+        self.label17.setObjectName(u"label17")
+
+        self.formLayout.setWidget(14, QFormLayout.LabelRole, self.label17)
+
+        self.spinBoxMultiBoneRounds = QSpinBox(self.configGroupBox)
+        self.spinBoxMultiBoneRounds.setObjectName(u"spinBoxMultiBoneRounds")
+
+        self.formLayout.setWidget(14, QFormLayout.FieldRole, self.spinBoxMultiBoneRounds)
+
+        self.label18 = QLabel(self.configGroupBox)
+        self.label18.setObjectName(u"label18")
+
+        self.formLayout.setWidget(15, QFormLayout.LabelRole, self.label18)
+
+        self.doubleSpinBoxMaxFitTime = QDoubleSpinBox(self.configGroupBox)
+        self.doubleSpinBoxMaxFitTime.setObjectName(u"doubleSpinBoxMaxFitTime")
+
+        self.formLayout.setWidget(15, QFormLayout.FieldRole, self.doubleSpinBoxMaxFitTime)
+
+        self.label19 = QLabel(self.configGroupBox)
+        self.label19.setObjectName(u"label19")
+
+        self.formLayout.setWidget(16, QFormLayout.LabelRole, self.label19)
+
+        self.doubleSpinBoxMaxBatchTime = QDoubleSpinBox(self.configGroupBox)
+        self.doubleSpinBoxMaxBatchTime.setObjectName(u"doubleSpinBoxMaxBatchTime")
+
+        self.formLayout.setWidget(16, QFormLayout.FieldRole, self.doubleSpinBoxMaxBatchTime)
+
+        self.label20 = QLabel(self.configGroupBox)
+        self.label20.setObjectName(u"label20")
+
+        self.formLayout.setWidget(17, QFormLayout.LabelRole, self.label20)
+
+        self.lineEditObjectiveTol = QLineEdit(self.configGroupBox)
+        self.lineEditObjectiveTol.setObjectName(u"lineEditObjectiveTol")
+
+        self.formLayout.setWidget(17, QFormLayout.FieldRole, self.lineEditObjectiveTol)
+
+        self.label21 = QLabel(self.configGroupBox)
+        self.label21.setObjectName(u"label21")
+
+        self.formLayout.setWidget(18, QFormLayout.LabelRole, self.label21)
+
+        self.doubleSpinBoxRMSEPlateau = QDoubleSpinBox(self.configGroupBox)
+        self.doubleSpinBoxRMSEPlateau.setObjectName(u"doubleSpinBoxRMSEPlateau")
+
+        self.formLayout.setWidget(18, QFormLayout.FieldRole, self.doubleSpinBoxRMSEPlateau)
+
+        self.label22 = QLabel(self.configGroupBox)
+        self.label22.setObjectName(u"label22")
+
+        self.formLayout.setWidget(19, QFormLayout.LabelRole, self.label22)
+
+        self.lineEditModeChangeTol = QLineEdit(self.configGroupBox)
+        self.lineEditModeChangeTol.setObjectName(u"lineEditModeChangeTol")
+
+        self.formLayout.setWidget(19, QFormLayout.FieldRole, self.lineEditModeChangeTol)
+
+        self.label23 = QLabel(self.configGroupBox)
+        self.label23.setObjectName(u"label23")
+
+        self.formLayout.setWidget(20, QFormLayout.LabelRole, self.label23)
+
+        self.spinBoxStagnationWindow = QSpinBox(self.configGroupBox)
+        self.spinBoxStagnationWindow.setObjectName(u"spinBoxStagnationWindow")
+
+        self.formLayout.setWidget(20, QFormLayout.FieldRole, self.spinBoxStagnationWindow)
+
+        self.label24 = QLabel(self.configGroupBox)
+        self.label24.setObjectName(u"label24")
+
+        self.formLayout.setWidget(21, QFormLayout.LabelRole, self.label24)
+
+        self.lineEditQASnapshots = QLineEdit(self.configGroupBox)
+        self.lineEditQASnapshots.setObjectName(u"lineEditQASnapshots")
+
+        self.formLayout.setWidget(21, QFormLayout.FieldRole, self.lineEditQASnapshots)
+
+        self.label25 = QLabel(self.configGroupBox)
+        self.label25.setObjectName(u"label25")
+
+        self.formLayout.setWidget(22, QFormLayout.LabelRole, self.label25)
+
+        self.spinBoxViewerMaxPoints = QSpinBox(self.configGroupBox)
+        self.spinBoxViewerMaxPoints.setObjectName(u"spinBoxViewerMaxPoints")
+
+        self.formLayout.setWidget(22, QFormLayout.FieldRole, self.spinBoxViewerMaxPoints)
+
+        self.label26 = QLabel(self.configGroupBox)
+        self.label26.setObjectName(u"label26")
+
+        self.formLayout.setWidget(23, QFormLayout.LabelRole, self.label26)
+
+        self.lineEditFitExport = QLineEdit(self.configGroupBox)
+        self.lineEditFitExport.setObjectName(u"lineEditFitExport")
+
+        self.formLayout.setWidget(23, QFormLayout.FieldRole, self.lineEditFitExport)
+
+        self.label27 = QLabel(self.configGroupBox)
+        self.label27.setObjectName(u"label27")
+
+        self.formLayout.setWidget(24, QFormLayout.LabelRole, self.label27)
+
+        self.spinBoxSequenceWindow = QSpinBox(self.configGroupBox)
+        self.spinBoxSequenceWindow.setObjectName(u"spinBoxSequenceWindow")
+
+        self.formLayout.setWidget(24, QFormLayout.FieldRole, self.spinBoxSequenceWindow)
+
+        self.label28 = QLabel(self.configGroupBox)
+        self.label28.setObjectName(u"label28")
+
+        self.formLayout.setWidget(25, QFormLayout.LabelRole, self.label28)
+
+        self.lineEditJobQueue = QLineEdit(self.configGroupBox)
+        self.lineEditJobQueue.setObjectName(u"lineEditJobQueue")
+
+        self.formLayout.setWidget(25, QFormLayout.FieldRole, self.lineEditJobQueue)
+
+        self.label29 = QLabel(self.configGroupBox)
+        self.label29.setObjectName(u"label29")
+
+        self.formLayout.setWidget(26, QFormLayout.LabelRole, self.label29)
+
+        self.spinBoxJobMaxAttempts = QSpinBox(self.configGroupBox)
+        self.spinBoxJobMaxAttempts.setObjectName(u"spinBoxJobMaxAttempts")
+
+        self.formLayout.setWidget(26, QFormLayout.FieldRole, self.spinBoxJobMaxAttempts)
+
+        self.label30 = QLabel(self.configGroupBox)
+        self.label30.setObjectName(u"label30")
+
+        self.formLayout.setWidget(27, QFormLayout.LabelRole, self.label30)
+
+        self.spinBoxCheckpointInterval = QSpinBox(self.configGroupBox)
+        self.spinBoxCheckpointInterval.setObjectName(u"spinBoxCheckpointInterval")
+
+        self.formLayout.setWidget(27, QFormLayout.FieldRole, self.spinBoxCheckpointInterval)
+
+        self.label31 = QLabel(self.configGroupBox)
+        self.label31.setObjectName(u"label31")
+
+        self.formLayout.setWidget(28, QFormLayout.LabelRole, self.label31)
+
+        self.spinBoxPreAlignIterations = QSpinBox(self.configGroupBox)
+        self.spinBoxPreAlignIterations.setObjectName(u"spinBoxPreAlignIterations")
+
+        self.formLayout.setWidget(28, QFormLayout.FieldRole, self.spinBoxPreAlignIterations)
+
+        self.label32 = QLabel(self.configGroupBox)
+        self.label32.setObjectName(u"label32")
+
+        self.formLayout.setWidget(29, QFormLayout.LabelRole, self.label32)
+
+        self.spinBoxModesPerStage = QSpinBox(self.configGroupBox)
+        self.spinBoxModesPerStage.setObjectName(u"spinBoxModesPerStage")
+
+        self.formLayout.setWidget(29, QFormLayout.FieldRole, self.spinBoxModesPerStage)
+
+        self.label33 = QLabel(self.configGroupBox)
+        self.label33.setObjectName(u"label33")
+
+        self.formLayout.setWidget(30, QFormLayout.LabelRole, self.label33)
+
+        self.comboBoxLandmarkFit = QComboBox(self.configGroupBox)
+        self.comboBoxLandmarkFit.setObjectName(u"comboBoxLandmarkFit")
+
+        self.formLayout.setWidget(30, QFormLayout.FieldRole, self.comboBoxLandmarkFit)
+
 
         self.gridLayout.addWidget(self.configGroupBox, 0, 0, 1, 1)
 
@@ -185,5 +375,78 @@ class Ui_Dialog(object):
         self.checkBoxFitSize.setText("")
         self.label.setText(QCoreApplication.translate("Dialog", u"Landmarks:", None))
         self.label_2.setText(QCoreApplication.translate("Dialog", u"Landmark Weights:", None))
+        self.label15.setText(QCoreApplication.translate("Dialog", u"Optimiser:", None))
+#if QT_CONFIG(tooltip)
+        self.label16.setToolTip(QCoreApplication.translate("Dialog", u"Number of threads for surface evaluation and closest point queries. 0 uses all cores.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label16.setText(QCoreApplication.translate("Dialog", u"Threads:", None))
+#if QT_CONFIG(tooltip)
+        self.label17.setToolTip(QCoreApplication.translate("Dialog", u"Maximum number of point assignment and fit rounds when fitting several models to one point cloud.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label17.setText(QCoreApplication.translate("Dialog", u"Multi-Bone Rounds:", None))
+#if QT_CONFIG(tooltip)
+        self.label18.setToolTip(QCoreApplication.translate("Dialog", u"Wall-clock time limit for each fit in seconds. 0 for no limit.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label18.setText(QCoreApplication.translate("Dialog", u"Max Fit Time (s):", None))
+#if QT_CONFIG(tooltip)
+        self.label19.setToolTip(QCoreApplication.translate("Dialog", u"Wall-clock time limit for all fits of a multi-bone fit in seconds. 0 for no limit.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label19.setText(QCoreApplication.translate("Dialog", u"Max Batch Time (s):", None))
+#if QT_CONFIG(tooltip)
+        self.label20.setToolTip(QCoreApplication.translate("Dialog", u"Stop when the best objective improves by less than this fraction over the stagnation window. 0 disables.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label20.setText(QCoreApplication.translate("Dialog", u"Objective Tolerance:", None))
+#if QT_CONFIG(tooltip)
+        self.label21.setToolTip(QCoreApplication.translate("Dialog", u"Stop when the best RMS error improves by less than this distance over the stagnation window. 0 disables.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label21.setText(QCoreApplication.translate("Dialog", u"RMSE Plateau:", None))
+#if QT_CONFIG(tooltip)
+        self.label22.setToolTip(QCoreApplication.translate("Dialog", u"Stop when every mode score changes by less than its tolerance in standard deviations over the stagnation window. Comma separated, one per mode, the last value is used for the remaining modes. Empty disables.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label22.setText(QCoreApplication.translate("Dialog", u"Mode Change Tolerance:", None))
+#if QT_CONFIG(tooltip)
+        self.label23.setToolTip(QCoreApplication.translate("Dialog", u"Number of objective evaluations over which the stagnation tests are applied.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label23.setText(QCoreApplication.translate("Dialog", u"Stagnation Window:", None))
+#if QT_CONFIG(tooltip)
+        self.label24.setToolTip(QCoreApplication.translate("Dialog", u"Directory to write offscreen QA snapshots to after each fit without the GUI. Empty disables.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label24.setText(QCoreApplication.translate("Dialog", u"QA Snapshots:", None))
+#if QT_CONFIG(tooltip)
+        self.label25.setToolTip(QCoreApplication.translate("Dialog", u"Maximum number of point cloud points shown in the fitting viewer. Fitting always uses all points.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label25.setText(QCoreApplication.translate("Dialog", u"Viewer Max Points:", None))
+#if QT_CONFIG(tooltip)
+        self.label26.setToolTip(QCoreApplication.translate("Dialog", u"Directory to write a compact binary file of each accepted or batch fit to. Empty disables.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label26.setText(QCoreApplication.translate("Dialog", u"Fit Export:", None))
+#if QT_CONFIG(tooltip)
+        self.label27.setToolTip(QCoreApplication.translate("Dialog", u"Number of most recent frames of a sequence fit whose fitted models and errors are output.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label27.setText(QCoreApplication.translate("Dialog", u"Sequence Window:", None))
+#if QT_CONFIG(tooltip)
+        self.label28.setToolTip(QCoreApplication.translate("Dialog", u"Directory of the resumable job queue for fits without the GUI. Leave empty to fit without a queue.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label28.setText(QCoreApplication.translate("Dialog", u"Job Queue:", None))
+#if QT_CONFIG(tooltip)
+        self.label29.setToolTip(QCoreApplication.translate("Dialog", u"Number of times a failed or interrupted job is run before it is given up on.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label29.setText(QCoreApplication.translate("Dialog", u"Job Max Attempts:", None))
+#if QT_CONFIG(tooltip)
+        self.label30.setToolTip(QCoreApplication.translate("Dialog", u"Function evaluations between checkpoints of a queued fit. 0 disables checkpoints.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label30.setText(QCoreApplication.translate("Dialog", u"Checkpoint Interval:", None))
+#if QT_CONFIG(tooltip)
+        self.label31.setToolTip(QCoreApplication.translate("Dialog", u"Maximum rigid ICP iterations aligning the model pose to the data before the fit. 0 disables.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label31.setText(QCoreApplication.translate("Dialog", u"Pre-Alignment Iterations:", None))
+#if QT_CONFIG(tooltip)
+        self.label32.setToolTip(QCoreApplication.translate("Dialog", u"Number of modes released at each stage of a progressive fit. 0 fits all modes at once.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label32.setText(QCoreApplication.translate("Dialog", u"Modes per Stage:", None))
+#if QT_CONFIG(tooltip)
+        self.label33.setToolTip(QCoreApplication.translate("Dialog", u"None: landmarks only add terms to the point cloud fit. Initialise: start the point cloud fit from a fit to the landmarks. Only: fit to the landmarks alone.", None))
+#endif // QT_CONFIG(tooltip)
+        self.label33.setText(QCoreApplication.translate("Dialog", u"Landmark Fit:", None))
     # retranslateUi
 
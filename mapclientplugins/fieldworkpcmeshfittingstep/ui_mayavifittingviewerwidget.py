@@ -173,6 +173,16 @@ class Ui_Dialog(object):
 
         self.formLayout_3.setWidget(8, QFormLayout.LabelRole, self.label_9)
 
+        self.label_10 = QLabel(self.groupBox)
+        self.label_10.setObjectName(u"label_10")
+
+        self.formLayout_3.setWidget(9, QFormLayout.LabelRole, self.label_10)
+
+        self.comboBoxOptimiser = QComboBox(self.groupBox)
+        self.comboBoxOptimiser.setObjectName(u"comboBoxOptimiser")
+
+        self.formLayout_3.setWidget(9, QFormLayout.FieldRole, self.comboBoxOptimiser)
+
 
         self.verticalLayout.addWidget(self.groupBox)
 
@@ -242,10 +252,149 @@ class Ui_Dialog(object):
 
         self.formLayout_2.setWidget(2, QFormLayout.FieldRole, self.SDLineEdit)
 
+        self.medianErrorLabel = QLabel(self.errorGroup)
+        self.medianErrorLabel.setObjectName(u"medianErrorLabel")
+
+        self.formLayout_2.setWidget(3, QFormLayout.LabelRole, self.medianErrorLabel)
+
+        self.medianErrorLineEdit = QLineEdit(self.errorGroup)
+        self.medianErrorLineEdit.setObjectName(u"medianErrorLineEdit")
+        self.medianErrorLineEdit.setAlignment(Qt.AlignRight|Qt.AlignTrailing|Qt.AlignVCenter)
+        self.medianErrorLineEdit.setReadOnly(True)
+
+        self.formLayout_2.setWidget(3, QFormLayout.FieldRole, self.medianErrorLineEdit)
+
+        self.p95ErrorLabel = QLabel(self.errorGroup)
+        self.p95ErrorLabel.setObjectName(u"p95ErrorLabel")
+
+        self.formLayout_2.setWidget(4, QFormLayout.LabelRole, self.p95ErrorLabel)
+
+        self.p95ErrorLineEdit = QLineEdit(self.errorGroup)
+        self.p95ErrorLineEdit.setObjectName(u"p95ErrorLineEdit")
+        self.p95ErrorLineEdit.setAlignment(Qt.AlignRight|Qt.AlignTrailing|Qt.AlignVCenter)
+        self.p95ErrorLineEdit.setReadOnly(True)
+
+        self.formLayout_2.setWidget(4, QFormLayout.FieldRole, self.p95ErrorLineEdit)
+
+        self.maxErrorLabel = QLabel(self.errorGroup)
+        self.maxErrorLabel.setObjectName(u"maxErrorLabel")
+
+        self.formLayout_2.setWidget(5, QFormLayout.LabelRole, self.maxErrorLabel)
+
+        self.maxErrorLineEdit = QLineEdit(self.errorGroup)
+        self.maxErrorLineEdit.setObjectName(u"maxErrorLineEdit")
+        self.maxErrorLineEdit.setAlignment(Qt.AlignRight|Qt.AlignTrailing|Qt.AlignVCenter)
+        self.maxErrorLineEdit.setReadOnly(True)
+
+        self.formLayout_2.setWidget(5, QFormLayout.FieldRole, self.maxErrorLineEdit)
+
 
         self.verticalLayout.addWidget(self.errorGroup)
 
         self.toolBox.addItem(self.page_fitting, u"Fitting")
+        self.page_sweep = QWidget()
+        self.page_sweep.setObjectName(u"page_sweep")
+        self.page_sweep.setGeometry(QRect(0, 0, 332, 507))
+        self.verticalLayout_2 = QVBoxLayout(self.page_sweep)
+        self.verticalLayout_2.setObjectName(u"verticalLayout_2")
+        self.sweepGroup = QGroupBox(self.page_sweep)
+        self.sweepGroup.setObjectName(u"sweepGroup")
+        self.formLayout_4 = QFormLayout(self.sweepGroup)
+        self.formLayout_4.setObjectName(u"formLayout_4")
+        self.formLayout_4.setFieldGrowthPolicy(QFormLayout.AllNonFixedFieldsGrow)
+        self.label_11 = QLabel(self.sweepGroup)
+        self.label_11.setObjectName(u"label_11")
+
+        self.formLayout_4.setWidget(0, QFormLayout.LabelRole, self.label_11)
+
+        self.lineEditSweepDistModes = QLineEdit(self.sweepGroup)
+        self.lineEditSweepDistModes.setObjectName(u"lineEditSweepDistModes")
+
+        self.formLayout_4.setWidget(0, QFormLayout.FieldRole, self.lineEditSweepDistModes)
+
+        self.label_12 = QLabel(self.sweepGroup)
+        self.label_12.setObjectName(u"label_12")
+
+        self.formLayout_4.setWidget(1, QFormLayout.LabelRole, self.label_12)
+
+        self.lineEditSweepPCs = QLineEdit(self.sweepGroup)
+        self.lineEditSweepPCs.setObjectName(u"lineEditSweepPCs")
+
+        self.formLayout_4.setWidget(1, QFormLayout.FieldRole, self.lineEditSweepPCs)
+
+        self.label_13 = QLabel(self.sweepGroup)
+        self.label_13.setObjectName(u"label_13")
+
+        self.formLayout_4.setWidget(2, QFormLayout.LabelRole, self.label_13)
+
+        self.lineEditSweepMWeights = QLineEdit(self.sweepGroup)
+        self.lineEditSweepMWeights.setObjectName(u"lineEditSweepMWeights")
+
+        self.formLayout_4.setWidget(2, QFormLayout.FieldRole, self.lineEditSweepMWeights)
+
+        self.label_14 = QLabel(self.sweepGroup)
+        self.label_14.setObjectName(u"label_14")
+
+        self.formLayout_4.setWidget(3, QFormLayout.LabelRole, self.label_14)
+
+        self.lineEditSweepSurfDisc = QLineEdit(self.sweepGroup)
+        self.lineEditSweepSurfDisc.setObjectName(u"lineEditSweepSurfDisc")
+
+        self.formLayout_4.setWidget(3, QFormLayout.FieldRole, self.lineEditSweepSurfDisc)
+
+        self.label_15 = QLabel(self.sweepGroup)
+        self.label_15.setObjectName(u"label_15")
+
+        self.formLayout_4.setWidget(4, QFormLayout.LabelRole, self.label_15)
+
+        self.spinBoxSweepWorkers = QSpinBox(self.sweepGroup)
+        self.spinBoxSweepWorkers.setObjectName(u"spinBoxSweepWorkers")
+
+        self.formLayout_4.setWidget(4, QFormLayout.FieldRole, self.spinBoxSweepWorkers)
+
+
+        self.verticalLayout_2.addWidget(self.sweepGroup)
+
+        self.sweepButtonsGroup = QGridLayout()
+        self.sweepButtonsGroup.setObjectName(u"sweepButtonsGroup")
+        self.runSweepButton = QPushButton(self.page_sweep)
+        self.runSweepButton.setObjectName(u"runSweepButton")
+
+        self.sweepButtonsGroup.addWidget(self.runSweepButton, 0, 0, 1, 1)
+
+        self.stopSweepButton = QPushButton(self.page_sweep)
+        self.stopSweepButton.setObjectName(u"stopSweepButton")
+        self.stopSweepButton.setEnabled(False)
+
+        self.sweepButtonsGroup.addWidget(self.stopSweepButton, 0, 1, 1, 1)
+
+
+        self.verticalLayout_2.addLayout(self.sweepButtonsGroup)
+
+        self.sweepTableWidget = QTableWidget(self.page_sweep)
+        if (self.sweepTableWidget.columnCount() < 8):
+            self.sweepTableWidget.setColumnCount(8)
+        __qtablewidgetitem1 = QTableWidgetItem()
+        self.sweepTableWidget.setHorizontalHeaderItem(0, __qtablewidgetitem1)
+        __qtablewidgetitem2 = QTableWidgetItem()
+        self.sweepTableWidget.setHorizontalHeaderItem(1, __qtablewidgetitem2)
+        __qtablewidgetitem3 = QTableWidgetItem()
+        self.sweepTableWidget.setHorizontalHeaderItem(2, __qtablewidgetitem3)
+        __qtablewidgetitem4 = QTableWidgetItem()
+        self.sweepTableWidget.setHorizontalHeaderItem(3, __qtablewidgetitem4)
+        __qtablewidgetitem5 = QTableWidgetItem()
+        self.sweepTableWidget.setHorizontalHeaderItem(4, __qtablewidgetitem5)
+        __qtablewidgetitem6 = QTableWidgetItem()
+        self.sweepTableWidget.setHorizontalHeaderItem(5, __qtablewidgetitem6)
+        __qtablewidgetitem7 = QTableWidgetItem()
+        self.sweepTableWidget.setHorizontalHeaderItem(6, __qtablewidgetitem7)
+        __qtablewidgetitem8 = QTableWidgetItem()
+        self.sweepTableWidget.setHorizontalHeaderItem(7, __qtablewidgetitem8)
+        self.sweepTableWidget.setObjectName(u"sweepTableWidget")
+
+        self.verticalLayout_2.addWidget(self.sweepTableWidget)
+
+        self.toolBox.addItem(self.page_sweep, u"Parameter Sweep")
         self.Screenshot = QWidget()
         self.Screenshot.setObjectName(u"Screenshot")
         self.Screenshot.setGeometry(QRect(0, 0, 159, 119))
@@ -351,6 +500,7 @@ class Ui_Dialog(object):
         self.checkBoxFitSize.setText("")
         self.label_8.setText(QCoreApplication.translate("Dialog", u"Landmarks:", None))
         self.label_9.setText(QCoreApplication.translate("Dialog", u"Landmark Weights:", None))
+        self.label_10.setText(QCoreApplication.translate("Dialog", u"Optimiser:", None))
         self.acceptButton.setText(QCoreApplication.translate("Dialog", u"Accept", None))
         self.resetButton.setText(QCoreApplication.translate("Dialog", u"Reset", None))
         self.abortButton.setText(QCoreApplication.translate("Dialog", u"Abort", None))
@@ -359,7 +509,34 @@ class Ui_Dialog(object):
         self.RMSELabel.setText(QCoreApplication.translate("Dialog", u"RMS:", None))
         self.meanErrorLabel.setText(QCoreApplication.translate("Dialog", u"Mean:", None))
         self.SDLabel.setText(QCoreApplication.translate("Dialog", u"S.D.:", None))
+        self.medianErrorLabel.setText(QCoreApplication.translate("Dialog", u"Median Dist.:", None))
+        self.p95ErrorLabel.setText(QCoreApplication.translate("Dialog", u"95% Dist.:", None))
+        self.maxErrorLabel.setText(QCoreApplication.translate("Dialog", u"Max Dist.:", None))
         self.toolBox.setItemText(self.toolBox.indexOf(self.page_fitting), QCoreApplication.translate("Dialog", u"Fitting", None))
+        self.label_11.setText(QCoreApplication.translate("Dialog", u"Distance Modes:", None))
+        self.label_12.setText(QCoreApplication.translate("Dialog", u"PCs to Fit:", None))
+        self.label_13.setText(QCoreApplication.translate("Dialog", u"Mahalanobis Weights:", None))
+        self.label_14.setText(QCoreApplication.translate("Dialog", u"Surface Discretisations:", None))
+        self.label_15.setText(QCoreApplication.translate("Dialog", u"Workers:", None))
+        self.runSweepButton.setText(QCoreApplication.translate("Dialog", u"Run Sweep", None))
+        self.stopSweepButton.setText(QCoreApplication.translate("Dialog", u"Stop", None))
+        ___qtablewidgetitem1 = self.sweepTableWidget.horizontalHeaderItem(0)
+        ___qtablewidgetitem1.setText(QCoreApplication.translate("Dialog", u"Dist. Mode", None));
+        ___qtablewidgetitem2 = self.sweepTableWidget.horizontalHeaderItem(1)
+        ___qtablewidgetitem2.setText(QCoreApplication.translate("Dialog", u"PCs", None));
+        ___qtablewidgetitem3 = self.sweepTableWidget.horizontalHeaderItem(2)
+        ___qtablewidgetitem3.setText(QCoreApplication.translate("Dialog", u"M. Weight", None));
+        ___qtablewidgetitem4 = self.sweepTableWidget.horizontalHeaderItem(3)
+        ___qtablewidgetitem4.setText(QCoreApplication.translate("Dialog", u"Disc.", None));
+        ___qtablewidgetitem5 = self.sweepTableWidget.horizontalHeaderItem(4)
+        ___qtablewidgetitem5.setText(QCoreApplication.translate("Dialog", u"RMS", None));
+        ___qtablewidgetitem6 = self.sweepTableWidget.horizontalHeaderItem(5)
+        ___qtablewidgetitem6.setText(QCoreApplication.translate("Dialog", u"Mean", None));
+        ___qtablewidgetitem7 = self.sweepTableWidget.horizontalHeaderItem(6)
+        ___qtablewidgetitem7.setText(QCoreApplication.translate("Dialog", u"S.D.", None));
+        ___qtablewidgetitem8 = self.sweepTableWidget.horizontalHeaderItem(7)
+        ___qtablewidgetitem8.setText(QCoreApplication.translate("Dialog", u"Time (s)", None));
+        self.toolBox.setItemText(self.toolBox.indexOf(self.page_sweep), QCoreApplication.translate("Dialog", u"Parameter Sweep", None))
         self.pixelsXLabel.setText(QCoreApplication.translate("Dialog", u"Pixels X:", None))
         self.screenshotPixelXLineEdit.setText(QCoreApplication.translate("Dialog", u"800", None))
         self.pixelsYLabel.setText(QCoreApplication.translate("Dialog", u"Pixels Y:", None))
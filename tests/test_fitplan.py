@@ -0,0 +1,40 @@
+'''
+Tests of the validation of the step config by FitPlan.fromConfig.
+'''
+import pytest
+
+from mapclientplugins.fieldworkpcmeshfittingstep import fitplan
+from mapclientplugins.fieldworkpcmeshfittingstep.step import FieldworkPCMeshFittingStep
+
+
+def makeConfig(items=()):
+    """Step default config with the given items changed.
+    """
+    config = dict(FieldworkPCMeshFittingStep._configDefaults)
+    config.update(items)
+    return config
+
+
+def testDefaults():
+    plan = fitplan.FitPlan.fromConfig(makeConfig())
+    assert plan.maxfev == 1000
+    assert plan.multiBoneRounds == 5
+
+
+@pytest.mark.parametrize('key', ['Max Func Evaluations', 'Multi-Bone Rounds', 'PCs to Fit',
+                                 'N Closest Points'])
+def testCountsBelowOne(key):
+    config = makeConfig({key: '0'})
+    with pytest.raises(ValueError):
+        fitplan.FitPlan.fromConfig(config)
+
+
+def testAutoDiscretisation():
+    plan = fitplan.FitPlan.fromConfig(makeConfig({'Surface Discretisation': '0'}))
+    assert plan.GD is None
+    with pytest.raises(ValueError):
+        fitplan.FitPlan.fromConfig(makeConfig({'Surface Discretisation': '-1'}))
+
+
+def testFitConfigKeysAreConfigItems():
+    assert set(fitplan.FIT_CONFIG_KEYS) <= set(FieldworkPCMeshFittingStep._configDefaults)
@@ -0,0 +1,63 @@
+'''
+Tests of the fit of a small synthetic shape model to landmarks at its
+nodes.
+'''
+import time
+
+import numpy as np
+from gias3.learning.PCA import PrincipalComponents
+
+from mapclientplugins.fieldworkpcmeshfittingstep import landmarkfit
+from mapclientplugins.fieldworkpcmeshfittingstep import optimisers
+
+X_TRUE = np.array([4.0, -3.0, 2.0, 0.35, -0.25, 0.4, 0.8, -0.5, 0.3])
+LANDMARK_NODES = [0, 5, 11, 17, 23, 29, 31, 38]
+
+
+def makeModel(nNodes=40, nModes=3, seed=0):
+    rng = np.random.default_rng(seed)
+    mean = rng.normal(size=(3, nNodes)) * 20.0
+    modes = np.linalg.qr(rng.normal(size=(3 * nNodes, nModes)))[0]
+    weights = np.array([100.0 / (i + 1) for i in range(nModes)])
+    pc = PrincipalComponents(mean=mean.ravel(), weights=weights, modes=modes)
+    return optimisers.RigidModesModel(pc, np.arange(nModes))
+
+
+def makeEvaluators(delay=0.0):
+    def evaluator(node):
+        def evaluate(P3):
+            time.sleep(delay)
+            return P3[:, node]
+        return evaluate
+
+    return [evaluator(n) for n in LANDMARK_NODES]
+
+
+def makeTargets(model):
+    return model(X_TRUE).reshape((3, -1))[:, LANDMARK_NODES].T
+
+
+def testRecoversParameters():
+    model = makeModel()
+    xOpt, POpt, errors, info = landmarkfit.fitLandmarks(
+        model, makeEvaluators(), makeTargets(model), np.zeros(9), xtol=1e-12)
+    np.testing.assert_allclose(xOpt, X_TRUE, atol=1e-6)
+    assert errors.shape == (len(LANDMARK_NODES),)
+    assert info['stopReason'] == 'optimiser'
+
+
+def testMaxfevRespected():
+    model = makeModel()
+    for maxfev in (15, 40):
+        xOpt, POpt, errors, info = landmarkfit.fitLandmarks(
+            model, makeEvaluators(), makeTargets(model), np.zeros(9), xtol=1e-12, maxfev=maxfev)
+        assert 0 < info['nfev'] <= maxfev
+
+
+def testDeadlineRespected():
+    model = makeModel()
+    xOpt, POpt, errors, info = landmarkfit.fitLandmarks(
+        model, makeEvaluators(0.002), makeTargets(model) + 0.1, np.zeros(9), xtol=1e-12,
+        deadline=time.time() + 0.05)
+    assert info['budgetExhausted']
+    assert info['time'] < 0.5
@@ -0,0 +1,85 @@
+'''
+Tests of the memory profiling harness on a small synthetic mesh, against
+the baseline in data/memprofile_baseline.json. Regenerate the baseline
+with PYTHONPATH=. python tests/test_memprofile.py after an intended change
+in memory use.
+'''
+import json
+import os
+
+import numpy as np
+from gias3.fieldwork.field import ensemble_field_function
+from gias3.fieldwork.field import geometric_field
+from gias3.fieldwork.field.topology import element_types
+from gias3.learning.PCA import PrincipalComponents
+
+from mapclientplugins.fieldworkpcmeshfittingstep import memprofile
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'memprofile_baseline.json')
+SIZES = [20000, 200000]
+CONFIG = {'PCs to Fit': '2', 'Max Func Evaluations': '100', 'Pre-Alignment Iterations': '10'}
+
+
+def makeSurfaceGF(nElements=3, size=30.0):
+    """Bumpy patch of nElements x nElements quadratic quad elements.
+    """
+    F = ensemble_field_function.EnsembleFieldFunction('patch', 2, debug=0)
+    F.set_basis({'quad33': 'quad_L2_L2'})
+    F.set_new_mesh('patch')
+    GF = geometric_field.GeometricField('patch', 3, ensemble_field_function=F)
+    xs = np.linspace(0.0, size, 2 * nElements + 1)
+    for i in range(nElements):
+        for j in range(nElements):
+            x = np.tile(xs[2 * i:2 * i + 3], 3)
+            y = np.repeat(xs[2 * j:2 * j + 3], 3)
+            z = 3.0 * np.sin(x / 7.0) * np.cos(y / 9.0)
+            GF.add_element_with_parameters(element_types.create_element('quad33'),
+                                           np.array([x, y, z])[:, :, np.newaxis])
+    return GF
+
+
+def makeInputs():
+    """Mesh, shape model with random modes and a noisy cloud on the mesh.
+    """
+    rng = np.random.default_rng(0)
+    GF = makeSurfaceGF()
+    mean = GF.get_field_parameters()[:, :, 0].ravel()
+    modes = np.linalg.qr(rng.normal(size=(len(mean), 4)))[0]
+    pc = PrincipalComponents(mean=mean, weights=np.array([50.0, 25.0, 12.0, 6.0]), modes=modes)
+    data = GF.evaluate_geometric_field([50, 50]).T
+    data += rng.normal(scale=0.1, size=data.shape) + [1.0, -1.0, 0.5]
+    return data, GF, pc
+
+
+def runProfile():
+    data, GF, pc = makeInputs()
+    return memprofile.profileStep(data, GF, pc, CONFIG, sizes=SIZES)
+
+
+def testProfileStep():
+    results = runProfile()
+    assert [r['points'] for r in results] == SIZES
+    for r in results:
+        assert set(memprofile.STAGES) <= set(r['stages'])
+        for s in r['stages'].values():
+            assert s['calls'] >= 1
+            assert s['peak'] >= 0
+    assert 'optimisation' in memprofile.formatResults(results)
+
+    with open(BASELINE, 'r') as f:
+        baseline = json.load(f)
+    assert memprofile.checkRegressions(results, baseline) == []
+
+
+def testCheckRegressions():
+    mb = 1024 * 1024
+    baseline = [{'points': 10, 'stages': {'optimisation': {'peak': 10 * mb}}}]
+    results = [{'points': 10, 'stages': {'optimisation': {'peak': 11 * mb}}}]
+    assert memprofile.checkRegressions(results, baseline) == []
+    results[0]['stages']['optimisation']['peak'] = 13 * mb
+    assert memprofile.checkRegressions(results, baseline) == [(10, 'optimisation', 10 * mb, 13 * mb)]
+
+
+if __name__ == '__main__':
+    with open(BASELINE, 'w') as f:
+        json.dump(runProfile(), f, indent=1, sort_keys=True)
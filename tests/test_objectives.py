@@ -0,0 +1,51 @@
+'''
+Tests of the distance objectives against distances computed directly.
+'''
+import numpy as np
+import pytest
+from scipy import sparse
+from scipy.spatial.distance import cdist
+
+from mapclientplugins.fieldworkpcmeshfittingstep import objectives
+
+
+def makeProblem(nNodes=30, nPoints=200, nData=300, seed=0):
+    """Random basis matrix of surface points on nodes, nodal parameters,
+    data points and data weights.
+    """
+    rng = np.random.default_rng(seed)
+    A = sparse.random(nPoints, nNodes, density=0.2, random_state=seed, format='csr')
+    P = rng.normal(size=3 * nNodes)
+    data = rng.normal(size=(nData, 3))
+    weights = rng.random(nData) + 0.5
+    return A, P, data, weights
+
+
+@pytest.mark.parametrize('k', [1, 3])
+@pytest.mark.parametrize('weighted', [False, True])
+def testDPEP(k, weighted):
+    A, P, data, weights = makeProblem()
+    if not weighted:
+        weights = None
+    obj = objectives.DPEPObj(objectives.SurfaceEvaluator(A), data, weights, k)
+    ep = A.dot(P.reshape((3, -1)).T)
+    expected = np.sort(cdist(data, ep), axis=1)[:, :k].mean(1) ** 2
+    if weighted:
+        expected *= weights
+    assert np.allclose(obj(P), expected)
+
+
+@pytest.mark.parametrize('k', [1, 3])
+@pytest.mark.parametrize('weighted', [False, True])
+def testEPDP(k, weighted):
+    A, P, data, weights = makeProblem()
+    if not weighted:
+        weights = None
+    obj = objectives.EPDPObj(objectives.SurfaceEvaluator(A), data, weights, k)
+    ep = A.dot(P.reshape((3, -1)).T)
+    D = cdist(ep, data)
+    closest = np.argsort(D, axis=1)[:, :k]
+    expected = np.take_along_axis(D, closest, 1).mean(1) ** 2
+    if weighted:
+        expected *= weights[closest].mean(1)
+    assert np.allclose(obj(P), expected)
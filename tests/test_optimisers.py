@@ -0,0 +1,113 @@
+'''
+Tests of the optimiser backends on a small synthetic shape model, fitted to
+target nodes with known correspondence.
+'''
+import time
+
+import numpy as np
+import pytest
+from gias3.learning.PCA import PrincipalComponents
+
+from mapclientplugins.fieldworkpcmeshfittingstep import optimisers
+
+N_NODES = 40
+N_MODES = 3
+X_TRUE = np.array([2.0, -1.0, 0.5, 0.1, -0.15, 0.05, 0.8, -0.5, 0.3])
+
+
+def makePC(nNodes=N_NODES, nModes=N_MODES, seed=0):
+    rng = np.random.default_rng(seed)
+    mean = rng.normal(size=(3, nNodes)) * 20.0
+    modes = np.linalg.qr(rng.normal(size=(3 * nNodes, nModes)))[0]
+    weights = np.array([100.0 / (i + 1) for i in range(nModes)])
+    return PrincipalComponents(mean=mean.ravel(), weights=weights, modes=modes)
+
+
+def makeObj(target):
+    target = target.reshape((3, -1))
+
+    def obj(P):
+        return np.square(P.reshape((3, -1)) - target).sum(0)
+
+    return obj
+
+
+@pytest.fixture
+def problem():
+    model = optimisers.RigidModesModel(makePC(), np.arange(N_MODES))
+    return model, makeObj(model(X_TRUE)), np.zeros(len(X_TRUE))
+
+
+def testBackendsAgree(problem):
+    model, obj, x0 = problem
+    solutions = []
+    for name in optimisers.OPTIMISERS:
+        xOpt, POpt, info = optimisers.minimise(name, obj, model, x0, xtol=1e-10, maxfev=5000)
+        assert np.sqrt(obj(POpt).mean()) < 1e-4, name
+        solutions.append(xOpt)
+    for xOpt in solutions:
+        np.testing.assert_allclose(xOpt, X_TRUE, atol=1e-4)
+
+
+@pytest.mark.parametrize('name', optimisers.OPTIMISERS)
+def testMaxfevRespected(problem, name):
+    model, obj, x0 = problem
+    for maxfev in (15, 40):
+        xOpt, POpt, info = optimisers.minimise(name, obj, model, x0, xtol=1e-12, maxfev=maxfev)
+        assert 0 < info['nfev'] <= maxfev
+
+
+def testCompareOptimisers(problem):
+    model, obj, x0 = problem
+    results = optimisers.compareOptimisers(obj, model, x0, maxfev=2000)
+    assert [r[0] for r in results] == list(optimisers.OPTIMISERS)
+    for name, nfev, t, rmse in results:
+        assert nfev > 0 and t >= 0.0 and rmse < 1e-2
+
+
+def testInvalidArguments(problem):
+    model, obj, x0 = problem
+    with pytest.raises(ValueError):
+        optimisers.minimise('Simplex', obj, model, x0)
+    with pytest.raises(ValueError):
+        optimisers.minimise('Gauss-Newton', obj, model, x0, maxfev=0)
+
+
+@pytest.mark.parametrize('name', optimisers.OPTIMISERS)
+def testDeadlineRespected(problem, monkeypatch, name):
+    model, obj, x0 = problem
+
+    def slowObj(P):
+        time.sleep(0.002)
+        return obj(P)
+
+    # cost of every evaluation, as ranked by the backend
+    costs = []
+    monitorCall = optimisers._FitMonitor.__call__
+
+    def recordingCall(monitor, P, x):
+        err = monitorCall(monitor, P, x)
+        costs.append(monitor.cost(err, model.modeSDs(x), monitor.mWeight))
+        return err
+
+    monkeypatch.setattr(optimisers._FitMonitor, '__call__', recordingCall)
+    t0 = time.time()
+    xOpt, POpt, info = optimisers.minimise(name, slowObj, model, x0, mWeight=50.0, xtol=1e-12,
+                                           maxfev=100000, deadline=t0 + 0.1)
+    assert info['budgetExhausted']
+    assert time.time() - t0 < 0.5
+    # the best evaluation seen is returned
+    m = model.modeSDs(xOpt)
+    cost = optimisers._backends[name][1](obj(POpt), m, 50.0)
+    assert cost == pytest.approx(min(costs), rel=1e-9)
+
+
+@pytest.mark.parametrize('name', optimisers.OPTIMISERS)
+def testStagnationStop(problem, name):
+    model, obj, x0 = problem
+    stopping = optimisers.StoppingCriteria(rmseTol=1.0, window=20)
+    xOpt, POpt, info = optimisers.minimise(name, obj, model, x0, xtol=1e-12, maxfev=5000,
+                                           stopping=stopping)
+    assert info['stopReason'] == 'rmse plateau'
+    assert info['nfev'] < 5000
+    np.testing.assert_allclose(POpt, model(xOpt))
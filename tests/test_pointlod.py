@@ -0,0 +1,28 @@
+'''
+Tests of the level-of-detail ordering of point clouds.
+'''
+import numpy as np
+
+from mapclientplugins.fieldworkpcmeshfittingstep.pointlod import PointCloudLOD
+
+
+def testCoarseLevelCoversCloud():
+    # points sorted along x, so a prefix in file order covers only one end
+    x = np.linspace(0.0, 100.0, 5000)
+    points = np.column_stack([x, np.zeros_like(x), np.zeros_like(x)])
+    lod = PointCloudLOD(points, maxPoints=10000, minPoints=100)
+    coarse = lod.current()
+    assert len(coarse) == 100
+    assert coarse[:, 0].min() < 5.0
+    assert coarse[:, 0].max() > 95.0
+
+
+def testRefineToAllPoints():
+    points = np.random.default_rng(0).random((1000, 3))
+    lod = PointCloudLOD(points, maxPoints=10000, minPoints=100)
+    while lod.refine() is not None:
+        pass
+    assert lod.isFull
+    shown = lod.current()
+    assert len(shown) == 1000
+    assert len(np.unique(shown, axis=0)) == 1000